@@ -31,7 +31,17 @@ with app.app_context():
     # Import routes
     from routes import *
     
+    # Register CLI commands
+    import commands  # noqa: F401
+    
     # Make sure to import the models here so their tables will be created
     import models  # noqa: F401
+    
+    # Registers the flush hook that keeps the dashboard counters current
+    import email_counters  # noqa: F401
+
+    db.create_all()
 
-    db.create_all()
\ No newline at end of file
+    # Add columns and indexes that create_all() won't add to existing tables
+    from migrations import upgrade_schema
+    upgrade_schema()
\ No newline at end of file
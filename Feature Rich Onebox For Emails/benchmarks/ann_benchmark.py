@@ -0,0 +1,87 @@
+"""Compare the IVF-PQ index against exact search on synthetic embeddings
+
+Usage: python benchmarks/ann_benchmark.py [--n 200000] [--dim 256] [--k 3]
+
+Vectors are drawn as small groups of near-duplicates inside broader topics
+so the data has structure like real embeddings; uniform random vectors are a
+worst case no ANN index handles well. Reports recall@k and p50/p99 latency
+per nprobe/rerank setting.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# Import the index module directly so the benchmark doesn't need the app or a database
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services'))
+from ann_index import IvfPqIndex  # noqa: E402
+
+
+def make_data(n, dim, topics, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    # Topics contain small groups of near-duplicates, like real mail/doc chunks
+    topic_centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    groups = max(n // 10, 1)
+    group_centers = topic_centers[rng.integers(0, topics, groups)] + 0.7 * rng.standard_normal((groups, dim)).astype(np.float32)
+    labels = rng.integers(0, groups, n + queries)
+    data = group_centers[labels] + 0.25 * rng.standard_normal((n + queries, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data[:n], data[n:]
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--m', type=int, default=16)
+    parser.add_argument('--rerank', type=int, default=64)
+    args = parser.parse_args()
+
+    data, queries = make_data(args.n, args.dim, topics=args.nlist * 2, queries=args.queries)
+    ids = np.arange(1, args.n + 1)
+
+    # Exact baseline
+    truth, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores = data @ query
+        top = np.argpartition(-scores, args.k - 1)[:args.k]
+        truth.append(set(ids[top[np.argsort(-scores[top])]]))
+        latencies.append(time.perf_counter() - start)
+    p50, p99 = percentiles(latencies)
+    print(f"{'method':<28}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'exact':<28}{1.0:>10.3f}{p50:>10.2f}{p99:>10.2f}")
+
+    start = time.perf_counter()
+    index = IvfPqIndex(dim=args.dim, nlist=args.nlist, m=args.m)
+    index.train(data[np.random.default_rng(1).choice(args.n, min(args.n, 50000), replace=False)])
+    index.add(ids, data)
+    print(f"(index built in {time.perf_counter() - start:.1f}s, {index.codes.nbytes + sum(c.nbytes for c in index.delta_codes)} code bytes)")
+
+    fetch_vectors = lambda entry_ids: data[np.asarray(entry_ids) - 1]  # noqa: E731
+
+    for rerank in (0, args.rerank):
+        for nprobe in (1, 4, 16, 64):
+            hits, latencies = 0, []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                found, _ = index.search(query, args.k, nprobe=nprobe, rerank=rerank,
+                                        fetch_vectors=fetch_vectors if rerank else None)
+                latencies.append(time.perf_counter() - start)
+                hits += len(expected & set(found.tolist()))
+            p50, p99 = percentiles(latencies)
+            label = f"ivfpq nprobe={nprobe} rerank={rerank}"
+            print(f"{label:<28}{hits / (len(queries) * args.k):>10.3f}{p50:>10.2f}{p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
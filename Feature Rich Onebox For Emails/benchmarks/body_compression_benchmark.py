@@ -0,0 +1,200 @@
+"""Compression ratio and decode latency of email body storage options
+
+Usage: python benchmarks/body_compression_benchmark.py [--emails 5000] [--source-url postgresql://...]
+
+By default bodies come from a synthetic corpus shaped like a sales inbox:
+newsletters and transactional mail with table layouts and inline CSS,
+Outlook and Gmail HTML replies, and plain-text replies with quoted history
+and signatures, in a long-tailed size mix. With --source-url, bodies are
+sampled from an existing database instead (read only). Half of the corpus
+trains the dictionaries; the other half is measured, and so are the texts
+derived from it at ingest (cleaned text, sanitized HTML and its text
+rendering), which are stored compressed with the same dictionaries.
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+FIRST_NAMES = ['Alex', 'Sam', 'Priya', 'Jordan', 'Chen', 'Maria', 'Tom', 'Aisha', 'Lukas', 'Emma']
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark Industries', 'Wayne Enterprises']
+WORDS = (
+    "thanks for reaching out we would love to learn more about your product pricing demo next week "
+    "schedule a call meeting calendar proposal contract budget team quarter follow up interested "
+    "please let me know if you have any questions happy to help looking forward to hearing from you "
+    "our platform integrates with your existing tools and saves hours every week for sales teams"
+).split()
+
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words)))
+    return text.capitalize() + '.'
+
+
+def token(rng, length=24):
+    return ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def newsletter(rng):
+    blocks = []
+    for _ in range(rng.randint(3, 15)):
+        blocks.append(
+            f'<tr><td align="left" valign="top" style="padding:0px 20px 20px 20px;font-family:Arial, Helvetica, sans-serif;'
+            f'font-size:14px;line-height:20px;color:#333333;"><h2 style="margin:0;font-size:20px;">{sentence(rng, 6)}</h2>'
+            f'<p>{" ".join(sentence(rng) for _ in range(rng.randint(1, 4)))}</p>'
+            f'<a href="https://click.{rng.choice(COMPANIES).lower().replace(" ", "")}.com/ls/click?upn={token(rng, 60)}" '
+            f'target="_blank" style="color:#0066cc;text-decoration:underline;">Read more</a>'
+            f'<img src="https://cdn.example.com/img/{token(rng, 16)}.png" alt="" width="600" border="0" '
+            f'style="display:block;border:0;outline:none;text-decoration:none;" /></td></tr>'
+        )
+    return (
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1.0"><style type="text/css">'
+        'body{margin:0;padding:0;-webkit-text-size-adjust:100%;}table,td{border-collapse:collapse;}'
+        + ''.join(f'.c{token(rng, 6)}{{color:#{rng.randrange(0xffffff):06x};}}' for _ in range(rng.randint(5, 40)))
+        + '</style></head><body style="margin:0;padding:0;background-color:#ffffff;">'
+        '<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" align="center" style="max-width:600px;">'
+        + ''.join(blocks)
+        + f'<tr><td style="font-size:11px;color:#999999;">You are receiving this email because you signed up for updates from '
+        f'{rng.choice(COMPANIES)}. <a href="https://example.com/unsubscribe?u={token(rng, 40)}">Unsubscribe</a> | '
+        'Manage preferences | Privacy Policy</td></tr></table></body></html>'
+    )
+
+
+def quoted_history(rng, depth):
+    text = ''
+    for _ in range(depth):
+        name = rng.choice(FIRST_NAMES)
+        text += (
+            f"\n\nOn {rng.choice(['Mon', 'Tue', 'Wed', 'Thu', 'Fri'])}, {rng.randint(1, 28)} Mar 2025 at {rng.randint(1, 12)}:"
+            f"{rng.randint(10, 59)} PM {name} <{name.lower()}@{rng.choice(COMPANIES).lower().replace(' ', '')}.com> wrote:\n"
+        )
+        text += '\n'.join(f"> {sentence(rng)}" for _ in range(rng.randint(2, 8)))
+    return text
+
+
+def plain_reply(rng):
+    name = rng.choice(FIRST_NAMES)
+    body = f"Hi {rng.choice(FIRST_NAMES)},\n\n" + '\n\n'.join(sentence(rng, 20) for _ in range(rng.randint(1, 4)))
+    body += f"\n\nBest regards,\n{name}\n--\n{name} | Account Executive | {rng.choice(COMPANIES)}\n+1 555 {rng.randint(1000, 9999)}"
+    if rng.random() < 0.3:
+        body += "\n\nThis message and any attachments are confidential and intended solely for the addressee."
+    return body + quoted_history(rng, rng.choice([0, 1, 1, 2, 3, 6]))
+
+
+def html_reply(rng):
+    paragraphs = ''.join(
+        f'<p class="MsoNormal"><span style="font-size:11.0pt;font-family:&quot;Calibri&quot;,sans-serif">{sentence(rng, 20)}</span></p>'
+        for _ in range(rng.randint(1, 4))
+    )
+    quote = plain_reply(rng).replace('\n', '<br>\n')
+    return (
+        f'<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8"></head><body><div dir="ltr">{paragraphs}'
+        '<div style="border:none;border-top:solid #E1E1E1 1.0pt;padding:3.0pt 0in 0in 0in"><p class="MsoNormal"><b>From:</b> '
+        f'{rng.choice(FIRST_NAMES)}<br><b>Sent:</b> Tuesday, March 4, 2025<br><b>Subject:</b> {sentence(rng, 5)}</p></div>'
+        f'<blockquote class="gmail_quote" style="margin:0px 0px 0px 0.8ex;border-left:1px solid rgb(204,204,204);padding-left:1ex">'
+        f'{quote}</blockquote></div></body></html>'
+    )
+
+
+def synthetic_corpus(count, seed=0):
+    rng = random.Random(seed)
+    kinds = [(newsletter, 0.35), (html_reply, 0.25), (plain_reply, 0.4)]
+    corpus = []
+    for _ in range(count):
+        make = rng.choices([kind for kind, _ in kinds], weights=[weight for _, weight in kinds])[0]
+        corpus.append(make(rng))
+    return corpus
+
+
+def database_corpus(url, count):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(url)
+    corpus = []
+    with engine.connect() as conn:
+        for column in ('body_html', 'body_text'):
+            rows = conn.execute(text(f"SELECT {column} FROM email WHERE {column} IS NOT NULL ORDER BY id DESC LIMIT :n"), {"n": count // 2})
+            corpus.extend(value for value, in rows if value)
+    return corpus
+
+
+def measure(label, encode, decode, corpus):
+    raw = sum(len(text.encode('utf-8')) for text in corpus)
+
+    start = time.perf_counter()
+    stored = [encode(text) for text in corpus]
+    encode_seconds = time.perf_counter() - start
+
+    latencies = []
+    for value in stored:
+        start = time.perf_counter()
+        decode(value)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    size = sum(len(value) for value in stored)
+    print(f"{label:<28}{raw / size:>7.2f}x{size / 1024 / 1024:>10.1f} MB{raw / 1024 / 1024 / encode_seconds:>10.0f} MB/s"
+          f"{statistics.median(latencies) * 1e6:>10.0f} us{latencies[int(len(latencies) * 0.99)] * 1e6:>10.0f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--emails', type=int, default=5000)
+    parser.add_argument('--source-url', help='Sample bodies from this database instead of generating them')
+    args = parser.parse_args()
+
+    # compression needs the app for trained dictionaries; use a throwaway database
+    os.environ['DATABASE_URL'] = 'sqlite:////tmp/body_compression_bench.db'
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from app import app, db  # noqa: E402
+    from models import CompressionDictionary  # noqa: E402
+    import compression  # noqa: E402
+    from services.html_sanitizer import sanitize_html  # noqa: E402
+    from services.text_processing import clean_email_body  # noqa: E402
+
+    corpus = database_corpus(args.source_url, args.emails) if args.source_url else synthetic_corpus(args.emails)
+    random.Random(1).shuffle(corpus)
+    training, corpus = corpus[:len(corpus) // 2], corpus[len(corpus) // 2:]
+    derived = []
+    for text in corpus:
+        if text.lstrip().startswith('<'):
+            derived.extend(value for value in sanitize_html(text) if value)
+        else:
+            derived.append(clean_email_body(text))
+
+    with app.app_context():
+        codecs = [('zlib', compression.ZLIB)] + ([('zstd', compression.ZSTD)] if compression.zstandard else [])
+        trained = {}
+        for name, codec in codecs:
+            trained[codec] = CompressionDictionary(codec=codec, data=compression.train_dictionary(training, codec),
+                                                   sample_size=len(training))
+            db.session.add(trained[codec])
+        db.session.commit()
+
+        for title, texts in (("bodies", corpus), ("derived texts", derived)):
+            raw = sum(len(text.encode('utf-8')) for text in texts)
+            print(f"{len(texts)} {title}, {raw / 1024 / 1024:.1f} MB, median {statistics.median(len(text) for text in texts):.0f} chars\n")
+            print(f"{'':<28}{'ratio':>8}{'stored':>13}{'encode':>15}{'decode p50':>13}{'p99':>13}")
+            measure("uncompressed", lambda text: text.encode('utf-8'), lambda value: value.decode('utf-8'), texts)
+
+            for name, codec in codecs:
+                if codec == compression.ZLIB:
+                    measure("zlib, no dictionary", lambda text: compression.zlib.compress(text.encode('utf-8'), compression.ZLIB_LEVEL),
+                            lambda value: compression.zlib.decompress(value).decode('utf-8'), texts)
+                for label, dictionary_id in ((f"{name}, built-in dictionary", 0), (f"{name}, trained dictionary", trained[codec].id)):
+                    measure(label, lambda text: compression.compress(text, codec, dictionary_id), compression.decompress, texts)
+            print()
+
+        if not compression.zstandard:
+            print("\n(install zstandard to include zstd)")
+
+        db.session.query(CompressionDictionary).delete()
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
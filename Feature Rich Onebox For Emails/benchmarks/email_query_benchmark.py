@@ -0,0 +1,139 @@
+"""Query plans and timings for the hot Email queries, without and with the indexes
+
+Usage: python benchmarks/email_query_benchmark.py [--rows 1000000] [--url sqlite:////tmp/email_bench.db]
+
+Fills the email table of the given database (a throwaway SQLite file by
+default; never point it at a real database) with synthetic rows, drops the
+Email indexes, and runs the ingest-key lookup, list views and dashboard
+aggregate. It then recreates the indexes and runs them again, printing the
+plan and median latency of each.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+QUERIES = {
+    "ingest key lookup": (
+        "SELECT id FROM email WHERE account_id = :account_id AND folder = :folder AND uid = :uid",
+        lambda rng: {"account_id": rng.randint(1, 10), "folder": "INBOX", "uid": rng.randint(1, 100000)}
+    ),
+    "newest emails": (
+        "SELECT id, subject, sender, category FROM email ORDER BY received_date DESC LIMIT 100",
+        lambda rng: {}
+    ),
+    "newest by account": (
+        "SELECT id, subject, sender, category FROM email WHERE account_id = :account_id ORDER BY received_date DESC LIMIT 100",
+        lambda rng: {"account_id": rng.randint(1, 10)}
+    ),
+    "newest by category": (
+        "SELECT id, subject, sender, category FROM email WHERE category = :category ORDER BY received_date DESC LIMIT 100",
+        lambda rng: {"category": rng.choice(CATEGORIES)}
+    ),
+    "dashboard counts": (
+        "SELECT category, count(id) FROM email GROUP BY category",
+        lambda rng: {}
+    ),
+}
+
+CATEGORIES = ['interested', 'not_interested', 'meeting_booked', 'spam', 'out_of_office', 'uncategorized']
+FOLDERS = ['INBOX', 'Sent', 'Archive']
+
+
+def populate(db, Email, EmailAccount, rows, batch_size=50000):
+    accounts = [
+        {"id": i, "name": f"bench{i}", "email": f"bench{i}@example.com", "password": "x", "host": "localhost", "port": 993}
+        for i in range(1, 11)
+    ]
+    db.session.execute(EmailAccount.__table__.insert(), accounts)
+
+    rng = random.Random(0)
+    start_date = datetime(2020, 1, 1)
+    # Each (account, folder) gets its own UID sequence, like a real mailbox
+    next_uid = {}
+    for start in range(0, rows, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, rows)):
+            account_id, folder = rng.randint(1, 10), rng.choice(FOLDERS)
+            uid = next_uid[(account_id, folder)] = next_uid.get((account_id, folder), 0) + 1
+            batch.append({
+                "account_id": account_id,
+                "folder": folder,
+                "uid": uid,
+                "message_id": str(uid),
+                "subject": f"Subject {i}",
+                "sender": f"sender{rng.randint(1, 5000)}@example.com",
+                "category": rng.choice(CATEGORIES),
+                "received_date": start_date + timedelta(seconds=i * 60 + rng.randint(0, 59))
+            })
+        db.session.execute(Email.__table__.insert(), batch)
+        db.session.commit()
+        print(f"  inserted {min(start + batch_size, rows)}/{rows}", end="\r")
+    print()
+
+
+def explain(db, sql, params):
+    dialect = db.engine.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == 'sqlite' else "EXPLAIN "
+    rows = db.session.execute(db.text(prefix + sql), params).fetchall()
+    # SQLite returns (id, parent, notused, detail); PostgreSQL one text column
+    return [row[-1] for row in rows]
+
+
+def run(db, label, repeats):
+    print(f"\n== {label} ==")
+    rng = random.Random(1)
+    for name, (sql, make_params) in QUERIES.items():
+        latencies = []
+        for _ in range(repeats):
+            params = make_params(rng)
+            start = time.perf_counter()
+            db.session.execute(db.text(sql), params).fetchall()
+            latencies.append(time.perf_counter() - start)
+        print(f"{name:<22}{statistics.median(latencies) * 1000:>10.2f} ms")
+        for line in explain(db, sql, make_params(rng)):
+            print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--url', default='sqlite:////tmp/email_bench.db')
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from app import app, db  # noqa: E402  (creates the schema, including indexes)
+    from models import Email, EmailAccount  # noqa: E402
+
+    with app.app_context():
+        indexes = list(Email.__table__.indexes)
+
+        if not db.session.query(Email.id).first():
+            print(f"Populating {args.rows} emails...")
+            # Load without indexes; much faster, and the baseline needs them gone anyway
+            for index in indexes:
+                index.drop(db.engine, checkfirst=True)
+            populate(db, Email, EmailAccount, args.rows)
+
+        for index in indexes:
+            index.drop(db.engine, checkfirst=True)
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+        run(db, "without indexes", args.repeats)
+
+        start = time.perf_counter()
+        for index in indexes:
+            index.create(db.engine)
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+        print(f"\n(indexes built in {time.perf_counter() - start:.1f}s)")
+        run(db, "with indexes", args.repeats)
+
+
+if __name__ == '__main__':
+    main()
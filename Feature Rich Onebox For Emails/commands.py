@@ -0,0 +1,309 @@
+import json
+import logging
+import os
+import random
+import click
+from app import app, db
+from models import Email
+
+logger = logging.getLogger(__name__)
+
+# Categories the classifier learns; "uncategorized" is not a real label
+CLASSIFIER_CATEGORIES = ['interested', 'not_interested', 'meeting_booked', 'spam', 'out_of_office']
+
+
+@app.cli.command('classifier-train')
+@click.option('--holdout', default=0.2, show_default=True, help='Fraction of labels held out for the accuracy report')
+@click.option('--min-samples', default=50, show_default=True, help='Minimum labeled emails required to train')
+@click.option('--seed', default=42, show_default=True, help='Random seed for the train/holdout split')
+def classifier_train(holdout, min_samples, seed):
+    """Retrain the local classifier from stored LLM labels"""
+    from services.local_classifier import LocalClassifier, evaluate
+
+    # Only learn from LLM (or legacy, pre-routing) labels so the classifier
+    # never trains on its own output or on rule decisions
+    rows = db.session.query(Email.subject, Email.body_text_z, Email._body_text, Email.category).filter(
+        Email.category.in_(CLASSIFIER_CATEGORIES),
+        db.or_(Email.category_source == 'llm', Email.category_source.is_(None))
+    ).all()
+
+    if len(rows) < min_samples:
+        raise click.ClickException(f"Only {len(rows)} labeled emails found, need at least {min_samples}")
+
+    random.Random(seed).shuffle(rows)
+    texts = [f"{subject or ''}\n{body_text if body_text is not None else legacy_body_text or ''}"
+             for subject, body_text, legacy_body_text, _ in rows]
+    labels = [category for _, _, _, category in rows]
+
+    classifier = LocalClassifier()
+
+    split = int(len(rows) * (1 - holdout))
+    if 0 < split < len(rows):
+        classifier.train(texts[:split], labels[:split])
+        report = evaluate(classifier, texts[split:], labels[split:], classifier.threshold)
+        click.echo(json.dumps(report, indent=2))
+
+    # Ship a model trained on every label
+    classifier.train(texts, labels)
+    classifier.save()
+    click.echo(f"Trained on {len(rows)} emails, saved to {classifier.path}")
+
+
+@app.cli.command('vector-index-build')
+@click.option('--nlist', default=1024, show_default=True, help='Number of coarse clusters')
+@click.option('--m', default=16, show_default=True, help='PQ subquantizers (bytes per vector); must divide the dimension')
+@click.option('--sample-size', default=50000, show_default=True, help='Vectors sampled for training')
+@click.option('--iterations', default=10, show_default=True, help='k-means iterations')
+def vector_index_build(nlist, m, sample_size, iterations):
+    """Build the approximate nearest-neighbor index for the RAG store"""
+    from services import ai_service
+
+    index = ai_service.vector_store.build_index(nlist=nlist, m=m, sample_size=sample_size, iterations=iterations)
+    click.echo(f"Indexed {len(index)} vectors into {ai_service.vector_store.index_dir}")
+
+
+@app.cli.command('rag-ingest')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-tokens', default=500, show_default=True, help='Maximum tokens per chunk')
+@click.option('--overlap', default=50, show_default=True, help='Tokens shared between neighbouring chunks')
+@click.option('--batch-size', default=256, show_default=True, help='Chunks embedded per API call')
+def rag_ingest(paths, chunk_tokens, overlap, batch_size):
+    """Bulk-load text files into the RAG knowledge base
+
+    Plain text/markdown files are loaded whole. .jsonl files are read as one
+    document per line with 'text' and optional 'description' keys.
+    """
+    from services import ai_service
+
+    documents = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                documents.extend(json.loads(line) for line in f if line.strip())
+            else:
+                documents.append({"text": f.read(), "description": os.path.basename(path)})
+
+    result = ai_service.ingest_documents(documents, chunk_tokens=chunk_tokens, overlap=overlap, batch_size=batch_size)
+    if not result.get('success'):
+        raise click.ClickException(result.get('error', 'Ingestion failed'))
+    click.echo(json.dumps(result, indent=2))
+
+
+@app.cli.command('webhooks-dispatch')
+@click.option('--once', is_flag=True, help='Deliver what is currently due and exit')
+def webhooks_dispatch(once):
+    """Deliver queued webhooks from the outbox"""
+    from services import webhook_dispatcher
+
+    if once:
+        attempted = webhook_dispatcher.dispatch_pending()
+        click.echo(f"Attempted {attempted} deliveries")
+        click.echo(json.dumps(webhook_dispatcher.get_stats(), indent=2))
+        return
+
+    click.echo(f"Dispatching webhooks with {webhook_dispatcher.workers} workers (Ctrl+C to stop)")
+    try:
+        webhook_dispatcher.run()
+    except KeyboardInterrupt:
+        webhook_dispatcher.stop()
+
+
+@app.cli.command('emails-backfill-snippets')
+@click.option('--batch-size', default=1000, show_default=True, help='Emails updated per transaction')
+def emails_backfill_snippets(batch_size):
+    """Fill in list-view snippets (and cleaned bodies) for emails stored before they existed"""
+    from services.text_processing import clean_email_body, make_snippet
+
+    updated, last_id = 0, 0
+    while True:
+        rows = db.session.query(Email.id, Email.body_clean_z, Email._body_clean, Email.body_text_z, Email._body_text).filter(
+            Email.snippet.is_(None),
+            Email.id > last_id
+        ).order_by(Email.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        changes = []
+        for email_id, body_clean, legacy_body_clean, body_text, legacy_body_text in rows:
+            if body_text is None:
+                body_text = legacy_body_text
+            if body_clean is None:
+                body_clean = legacy_body_clean
+            if body_clean is None:
+                body_clean = clean_email_body(body_text)
+            changes.append({"id": email_id, "body_clean_z": body_clean, "_body_clean": None,
+                            "snippet": make_snippet(body_clean or body_text)})
+
+        db.session.execute(db.update(Email), changes)
+        db.session.commit()
+
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+    click.echo(f"Backfilled snippets for {updated} emails")
+
+
+@app.cli.command('emails-dedupe')
+@click.option('--apply', is_flag=True, help='Delete the duplicates instead of only listing them')
+@click.option('--batch-size', default=500, show_default=True, help='Emails deleted per transaction')
+def emails_dedupe(apply, batch_size):
+    """List (or with --apply delete) emails that repeat an account/folder/uid ingest key
+
+    The oldest row for each key is kept. Once none are left the ingest key's
+    unique index is created.
+    """
+    from migrations import dedupe_emails, find_duplicate_emails
+
+    duplicates = find_duplicate_emails()
+    for account_id, folder, count in duplicates:
+        click.echo(f"Account {account_id}, folder {folder}: {count} duplicate emails")
+    total = sum(count for _, _, count in duplicates)
+    if not total:
+        click.echo("No duplicate emails")
+    elif not apply:
+        click.echo(f"{total} duplicate emails would be deleted; run with --apply to delete them")
+        return
+    else:
+        click.echo(f"Deleted {dedupe_emails(batch_size)} duplicate emails")
+
+    for index in Email.__table__.indexes:
+        if index.name == 'uq_email_account_folder_uid':
+            index.create(db.engine, checkfirst=True)
+
+
+@app.cli.command('counters-reconcile')
+def counters_reconcile():
+    """Recount the dashboard email counters from the email table"""
+    import email_counters
+
+    drifted = email_counters.reconcile()
+    click.echo(f"Corrected {drifted} drifted counters")
+
+
+@app.cli.command('bodies-compress')
+@click.option('--batch-size', default=500, show_default=True, help='Emails converted per transaction')
+@click.option('--pause', default=0.1, show_default=True, help='Seconds to sleep between batches to limit load')
+def bodies_compress(batch_size, pause):
+    """Move uncompressed email bodies and their derived texts into the compressed columns
+
+    Safe to run while the app is serving and to interrupt; it picks up where
+    it left off. PostgreSQL only reuses the freed space after VACUUM (or
+    returns it to the OS after VACUUM FULL / pg_repack).
+    """
+    import time
+
+    # Uncompressed column and the compressed one that replaces it
+    columns = [('_body_text', 'body_text_z'), ('_body_html', 'body_html_z'), ('_body_clean', 'body_clean_z'),
+               ('_html_safe', 'html_safe_z'), ('_html_text', 'html_text_z')]
+
+    converted, last_id, raw_bytes = 0, 0, 0
+    while True:
+        rows = db.session.query(Email.id, *(getattr(Email, plain) for plain, _ in columns)).filter(
+            db.or_(*(getattr(Email, plain).isnot(None) for plain, _ in columns)),
+            Email.id > last_id
+        ).order_by(Email.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        changes = []
+        for email_id, *values in rows:
+            change = {"id": email_id}
+            for (plain, compressed), value in zip(columns, values):
+                change[plain] = None
+                # Leave values already in the compressed column alone
+                if value is not None:
+                    change[compressed] = value
+                    raw_bytes += len(value.encode('utf-8'))
+            changes.append(change)
+
+        # Grouped by key set, as an executemany needs the same columns in every row
+        for keys in {tuple(sorted(change)) for change in changes}:
+            db.session.execute(db.update(Email), [change for change in changes if tuple(sorted(change)) == keys])
+        db.session.commit()
+
+        converted += len(rows)
+        last_id = rows[-1][0]
+        click.echo(f"\rCompressed {converted} emails ({raw_bytes / 1024 / 1024:.1f} MB of text)", nl=False)
+        time.sleep(pause)
+
+    click.echo(f"\nCompressed bodies of {converted} emails")
+
+
+@app.cli.command('bodies-train-dictionary')
+@click.option('--sample-size', default=2000, show_default=True, help='Number of recent bodies to train on')
+@click.option('--size', default=32768, show_default=True, help='Dictionary size in bytes (zlib uses at most 32 KB)')
+def bodies_train_dictionary(sample_size, size):
+    """Train a compression dictionary on recent email bodies and use it for new writes"""
+    import compression
+    from models import CompressionDictionary
+
+    codec = compression.default_codec()
+    if codec == compression.RAW:
+        raise click.ClickException("Compression is disabled (BODY_COMPRESSION=none)")
+
+    emails = Email.query.options(db.load_only(Email.id), db.undefer_group('body')).order_by(
+        Email.id.desc()
+    ).limit(sample_size).all()
+    samples = [body for email in emails for body in (email.body_text, email.body_html) if body]
+    if len(samples) < 10:
+        raise click.ClickException(f"Only {len(samples)} bodies found, need at least 10")
+
+    data = compression.train_dictionary(samples, codec, size=size)
+    dictionary = CompressionDictionary(codec=codec, data=data, sample_size=len(samples))
+    db.session.add(dictionary)
+    db.session.commit()
+    click.echo(f"Stored dictionary {dictionary.id} ({len(data)} bytes from {len(samples)} bodies); "
+               f"processes pick it up within {compression.CURRENT_DICTIONARY_TTL}s")
+
+
+@app.cli.command('threads-rebuild')
+@click.option('--account-id', type=int, help='Only rebuild this account\'s threads')
+def threads_rebuild(account_id):
+    """Rebuild conversation threads from the stored email headers"""
+    import email_threads
+
+    threaded = email_threads.rebuild(account_id)
+    click.echo(f"Threaded {threaded} emails")
+
+
+@app.cli.command('emails-export')
+@click.option('--format', 'export_format', type=click.Choice(['ndjson', 'mbox']), default='ndjson', show_default=True)
+@click.option('--output', '-o', default='-', show_default=True, help='File to write, or - for stdout')
+@click.option('--account-id', type=int, help='Only export this account\'s emails')
+@click.option('--folder', help='Only export emails in this folder')
+@click.option('--category', help='Only export emails in this category')
+@click.option('--received-after', help='Only export emails received at or after this ISO date')
+@click.option('--received-before', help='Only export emails received before this ISO date')
+@click.option('--batch-size', default=500, show_default=True, help='Rows fetched from the database cursor at a time')
+def emails_export(export_format, output, account_id, folder, category, received_after, received_before, batch_size):
+    """Stream stored emails to a file as NDJSON or mbox"""
+    from email_export import export_emails
+
+    filters = {name: value for name, value in (
+        ('account_id', account_id), ('folder', folder), ('category', category),
+        ('received_after', received_after), ('received_before', received_before)
+    ) if value is not None}
+    try:
+        chunks = export_emails(filters, export_format, batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    with click.open_file(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+    if output != '-':
+        click.echo(f"Exported to {output}")
+
+
+@app.cli.command('emails-archive')
+@click.option('--older-than-days', type=int, help='Archive emails received more than this many days ago [default: RETENTION_DAYS]')
+@click.option('--batch-size', default=2000, show_default=True, help='Emails moved per archive file set and transaction')
+def emails_archive(older_than_days, batch_size):
+    """Move old emails out of the database into the Parquet archive"""
+    import email_archive
+
+    try:
+        archived = email_archive.archive(older_than_days, batch_size)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Archived {archived} emails to {email_archive.ARCHIVE_DIR}")
@@ -0,0 +1,238 @@
+"""Compressed storage for large text columns
+
+Values are stored as a 3-byte header (codec, dictionary id) followed by the
+payload. Both codecs use a preset dictionary: id 0 is the built-in one below,
+higher ids are dictionaries trained from real mail and stored in the
+compression_dictionary table (see `flask bodies-train-dictionary`). Stored
+values name the dictionary they were written with, so dictionaries must never
+be deleted once used.
+
+zstd is used when the zstandard package is installed, zlib otherwise;
+BODY_COMPRESSION=zlib|zstd|none overrides that for new writes. Reading
+always works for zlib and raw values, and for zstd values when zstandard is
+installed.
+"""
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from sqlalchemy import types
+from app import db
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW, ZLIB, ZSTD = 0, 1, 2
+CODECS = {'none': RAW, 'zlib': ZLIB, 'zstd': ZSTD}
+HEADER = struct.Struct('>BH')
+
+# Below this many bytes the header and dictionary overhead isn't worth it
+MIN_COMPRESS_SIZE = 64
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+# zlib can only use the last 32 KB of a preset dictionary
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Boilerplate that turns up in most marketing and client-generated mail.
+# zlib favours matches near the end of the dictionary, so the most common
+# fragments come last. Never change this; stored values depend on it.
+DEFAULT_DICTIONARY = b"""Unsubscribe | Manage preferences | View this email in your browser
+You are receiving this email because you signed up for updates. If you no longer wish to receive these emails, you can unsubscribe at any time.
+This message and any attachments are confidential and intended solely for the addressee. If you have received this email in error, please notify the sender and delete it.
+Privacy Policy | Terms of Service | Contact Us | All rights reserved.
+Sent from my iPhone
+Get Outlook for iOS
+-----Original Message-----
+From: Sent: To: Subject: Cc:
+On Mon, Tue, Wed, Thu, Fri, Sat, Sun, Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec at AM PM wrote:
+Thanks, Best regards, Kind regards, Hi Hello Dear Thank you for your email. Please let me know if you have any questions.
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:v="urn:schemas-microsoft-com:vml" xmlns:o="urn:schemas-microsoft-com:office:office">
+<head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><meta http-equiv="X-UA-Compatible" content="IE=edge"><title></title>
+<!--[if mso]><xml><o:OfficeDocumentSettings><o:AllowPNG/><o:PixelsPerInch>96</o:PixelsPerInch></o:OfficeDocumentSettings></xml><![endif]-->
+<style type="text/css">body{margin:0;padding:0;-webkit-text-size-adjust:100%;-ms-text-size-adjust:100%;}table,td{border-collapse:collapse;mso-table-lspace:0pt;mso-table-rspace:0pt;}img{border:0;height:auto;line-height:100%;outline:none;text-decoration:none;-ms-interpolation-mode:bicubic;}@media only screen and (max-width:600px){</style>
+</head>
+<body style="margin:0;padding:0;background-color:#ffffff;">
+<div dir="ltr"><div class="gmail_quote"><div class="gmail_attr">
+<blockquote class="gmail_quote" style="margin:0px 0px 0px 0.8ex;border-left:1px solid rgb(204,204,204);padding-left:1ex">
+<p class="MsoNormal"><span style="font-size:11.0pt;font-family:&quot;Calibri&quot;,sans-serif;color:#1F497D"><o:p>&nbsp;</o:p></span></p>
+<div style="border:none;border-top:solid #E1E1E1 1.0pt;padding:3.0pt 0in 0in 0in"><p class="MsoNormal"><b>From:</b> <b>Sent:</b> <b>To:</b> <b>Subject:</b>
+<a href="https://" target="_blank" rel="noopener noreferrer" style="color:#0066cc;text-decoration:underline;">
+<img src="https://" alt="" width="600" height="" border="0" style="display:block;border:0;outline:none;text-decoration:none;" />
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" align="center" style="max-width:600px;">
+<tr><td align="left" valign="top" style="padding:0px 20px 20px 20px;font-family:Arial, Helvetica, sans-serif;font-size:14px;line-height:20px;color:#333333;">
+</td></tr></table></td></tr></table></div></div></div><br></div></body></html>
+<div><br></div><div>&nbsp;</div><p>&nbsp;</p></p><p></span></div></td></tr><br>
+"""
+
+# Where the zlib dictionary trainer splits bodies into candidate fragments
+FRAGMENT_BOUNDARY = re.compile(rb"\n|(?=<)|[?=&]")
+
+
+class CompressedText(types.TypeDecorator):
+    """Text column stored compressed in a binary column
+
+    Reads and writes plain str; compression happens on the way to the database.
+    """
+    impl = types.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress(value)
+
+
+def compress(text, codec=None, dictionary_id=None):
+    """Encode text for storage with the configured (or given) codec and dictionary"""
+    data = text.encode('utf-8')
+    codec = default_codec() if codec is None else codec
+    if codec == RAW or len(data) < MIN_COMPRESS_SIZE:
+        return HEADER.pack(RAW, 0) + data
+
+    if dictionary_id is None:
+        dictionary_id = current_dictionary_id(codec)
+    dictionary = get_dictionary(dictionary_id)
+
+    if codec == ZSTD:
+        payload = _zstd_compressor(dictionary_id, dictionary).compress(data)
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=dictionary[-MAX_DICTIONARY_SIZE:])
+        payload = compressor.compress(data) + compressor.flush()
+    return HEADER.pack(codec, dictionary_id) + payload
+
+
+def decompress(value):
+    """Decode a value written by compress()"""
+    value = bytes(value)  # psycopg2 returns memoryview for bytea
+    codec, dictionary_id = HEADER.unpack_from(value)
+    payload = value[HEADER.size:]
+
+    if codec == RAW:
+        data = payload
+    elif codec == ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=get_dictionary(dictionary_id)[-MAX_DICTIONARY_SIZE:])
+        data = decompressor.decompress(payload) + decompressor.flush()
+    elif codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Value is zstd compressed but the zstandard package is not installed")
+        data = _zstd_decompressor(dictionary_id, get_dictionary(dictionary_id)).decompress(payload)
+    else:
+        raise ValueError(f"Unknown compression codec {codec}")
+    return data.decode('utf-8')
+
+
+def default_codec():
+    name = os.environ.get('BODY_COMPRESSION', 'zstd' if zstandard else 'zlib').lower()
+    if name not in CODECS:
+        logger.warning(f"Unknown BODY_COMPRESSION {name}, using zlib")
+        return ZLIB
+    if name == 'zstd' and zstandard is None:
+        return ZLIB
+    return CODECS[name]
+
+
+# Dictionaries never change once stored, so they are cached forever
+_dictionaries = {0: DEFAULT_DICTIONARY}
+_current = {}  # codec -> (dictionary id, time looked up)
+_zstd_local = threading.local()
+CURRENT_DICTIONARY_TTL = 300
+
+
+def get_dictionary(dictionary_id):
+    dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None:
+        # A separate connection, as this can run while a query's results are being processed
+        with db.engine.connect() as conn:
+            data = conn.execute(
+                db.text("SELECT data FROM compression_dictionary WHERE id = :id"), {"id": dictionary_id}
+            ).scalar()
+        if data is None:
+            raise LookupError(f"Compression dictionary {dictionary_id} not found")
+        dictionary = _dictionaries[dictionary_id] = bytes(data)
+    return dictionary
+
+
+def current_dictionary_id(codec):
+    """Get the newest dictionary trained for codec, or 0 for the built-in one"""
+    cached = _current.get(codec)
+    if cached and time.monotonic() - cached[1] < CURRENT_DICTIONARY_TTL:
+        return cached[0]
+
+    try:
+        with db.engine.connect() as conn:
+            dictionary_id = conn.execute(
+                db.text("SELECT max(id) FROM compression_dictionary WHERE codec = :codec"), {"codec": codec}
+            ).scalar() or 0
+    except Exception as e:  # e.g. the table doesn't exist yet
+        logger.warning(f"Could not look up compression dictionary: {str(e)}")
+        dictionary_id = 0
+
+    _current[codec] = (dictionary_id, time.monotonic())
+    return dictionary_id
+
+
+def _zstd_compressor(dictionary_id, dictionary):
+    # zstd (de)compressors aren't thread-safe, and loading a dictionary isn't free
+    compressors = _zstd_local.__dict__.setdefault('compressors', {})
+    if dictionary_id not in compressors:
+        compressors[dictionary_id] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_zstd_dictionary(dictionary_id, dictionary))
+    return compressors[dictionary_id]
+
+
+def _zstd_decompressor(dictionary_id, dictionary):
+    decompressors = _zstd_local.__dict__.setdefault('decompressors', {})
+    if dictionary_id not in decompressors:
+        decompressors[dictionary_id] = zstandard.ZstdDecompressor(dict_data=_zstd_dictionary(dictionary_id, dictionary))
+    return decompressors[dictionary_id]
+
+
+def _zstd_dictionary(dictionary_id, dictionary):
+    # Trained zstd dictionaries carry their own header; the built-in one is raw content
+    dict_type = zstandard.DICT_TYPE_AUTO if dictionary_id else zstandard.DICT_TYPE_RAWCONTENT
+    return zstandard.ZstdCompressionDict(dictionary, dict_type=dict_type)
+
+
+def train_dictionary(samples, codec, size=MAX_DICTIONARY_SIZE):
+    """Build a preset dictionary for codec from sample texts
+
+    zstd has a real trainer; for zlib the dictionary is the fragments that
+    occur in the most samples, weighted by length, most valuable last.
+    """
+    samples = [sample.encode('utf-8') for sample in samples if sample]
+    if codec == ZSTD:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    # Fragments: tags, text between tags, and lines (split at URLs' variable parts) of a useful length
+    document_frequency = Counter()
+    for sample in samples:
+        fragments = set()
+        for fragment in FRAGMENT_BOUNDARY.split(sample):
+            fragment = fragment.strip()
+            if 8 <= len(fragment) <= 512:
+                fragments.add(fragment)
+        document_frequency.update(fragments)
+
+    scored = sorted(
+        (count * len(fragment), fragment) for fragment, count in document_frequency.items() if count > 1
+    )
+    dictionary, total = [], 0
+    for score, fragment in reversed(scored):
+        if total + len(fragment) + 1 > size:
+            continue
+        dictionary.append(fragment)
+        total += len(fragment) + 1
+    return b'\n'.join(reversed(dictionary))
@@ -0,0 +1,17 @@
+from app import db
+
+
+def dialect_insert(model):
+    """Get an INSERT for model that supports on_conflict_do_nothing/do_update
+
+    ON CONFLICT is dialect-specific in SQLAlchemy; PostgreSQL (production)
+    and SQLite (development) are supported.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT upserts are not supported on {dialect}")
+    return insert(model)
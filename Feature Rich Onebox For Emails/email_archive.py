@@ -0,0 +1,354 @@
+"""Tiered retention: cold emails move out of the email table into Parquet files
+
+archive() moves emails received more than RETENTION_DAYS ago, with their
+bodies, headers and attachments, into Parquet files under ARCHIVE_DIR,
+partitioned by account and month of receipt
+(account_id=3/month=2024-05/part-<run>.parquet). Each archived email keeps a
+small archived_email row naming its file: it answers retrieval by id and
+metadata searches, and picks the files a full-text archive search scans.
+
+Archived emails are deleted from the email table (with their counters and
+thread stats updated) and from Elasticsearch. Files are written and synced
+before the database commit and removed again if it fails.
+
+Needs the pyarrow package.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from app import app, db
+from models import ArchivedEmail, Attachment, Email, EmailThread, ReplyDraft, ThreadReference
+import email_counters
+import email_threads
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'data/archive')
+# 0 keeps everything in the email table
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '0'))
+# Syncs re-fetch up to 30 days back; archiving newer mail would let it be stored twice
+MIN_RETENTION_DAYS = 30
+BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '2000'))
+ROW_GROUP_SIZE = 500
+# PostgreSQL advisory lock held for a whole run, so schedulers in several
+# processes and `flask emails-archive` never archive at the same time
+ARCHIVE_LOCK_KEY = 7460217351
+
+_run_lock = threading.Lock()
+
+STRING_COLUMNS = ('folder', 'message_id', 'in_reply_to', 'reference_ids', 'subject', 'sender', 'recipients', 'cc',
+                  'headers', 'body_text', 'body_html', 'body_clean', 'snippet', 'category', 'category_source', 'flags')
+
+
+def _schema():
+    return pyarrow.schema(
+        [('id', pyarrow.int64()), ('account_id', pyarrow.int64()), ('uid', pyarrow.int64()), ('thread_id', pyarrow.int64())]
+        + [(name, pyarrow.string()) for name in STRING_COLUMNS]
+        + [('date', pyarrow.timestamp('us')), ('received_date', pyarrow.timestamp('us')),
+           ('attachments', pyarrow.list_(pyarrow.struct([
+               ('filename', pyarrow.string()), ('content_type', pyarrow.string()),
+               ('size', pyarrow.int64()), ('content', pyarrow.binary())
+           ])))]
+    )
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise RuntimeError("The email archive needs the pyarrow package")
+
+
+def _full_path(archive_file):
+    return os.path.join(ARCHIVE_DIR, archive_file)
+
+
+def archive(older_than_days=None, batch_size=None):
+    """Move emails received more than older_than_days (default RETENTION_DAYS) ago to the archive
+
+    Works oldest first, batch_size emails per file set and transaction.
+    Only one run happens at a time; others return 0 right away. Raises
+    ValueError if the age is below MIN_RETENTION_DAYS. Returns the number
+    of emails archived.
+    """
+    _require_pyarrow()
+    days = RETENTION_DAYS if older_than_days is None else older_than_days
+    if days < MIN_RETENTION_DAYS:
+        raise ValueError(f"Emails can only be archived after at least {MIN_RETENTION_DAYS} days")
+
+    if not _run_lock.acquire(blocking=False):
+        logger.info("Email archive already running in this process, skipping")
+        return 0
+    try:
+        with _advisory_lock() as acquired:
+            if not acquired:
+                logger.info("Email archive already running in another process, skipping")
+                return 0
+            return _archive(datetime.utcnow() - timedelta(days=days), batch_size or BATCH_SIZE)
+    finally:
+        _run_lock.release()
+
+
+@contextmanager
+def _advisory_lock():
+    """Hold the cross-process archive lock; yields whether it was acquired"""
+    if db.engine.dialect.name != 'postgresql':
+        # SQLite is only used for development; runs in other processes can only fail on the
+        # lookup insert, and unique file names mean they never touch this run's files
+        yield True
+        return
+
+    # Its own connection in autocommit, so the lock lasts the whole run without an open transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        acquired = conn.execute(db.text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(db.text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_KEY})
+
+
+def _archive(cutoff, batch_size):
+    from services import elasticsearch_service
+
+    # Unique per run, so no two runs can ever write the same file
+    run = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex}"
+    archived, batch_number = 0, 0
+    while True:
+        emails = Email.query.options(
+            db.undefer_group('body'), db.selectinload(Email.attachments).undefer(Attachment.content)
+        ).filter(Email.received_date < cutoff).order_by(Email.received_date, Email.id).limit(batch_size).all()
+        if not emails:
+            break
+
+        email_ids = _archive_batch(emails, f"{run}-{batch_number}")
+        # After the commit: a failure here only leaves search hits that no longer open
+        elasticsearch_service.delete_emails(email_ids)
+        archived += len(email_ids)
+        batch_number += 1
+        logger.info(f"Archived {archived} emails received before {cutoff:%Y-%m-%d}")
+
+    return archived
+
+
+def _archive_batch(emails, name):
+    partitions = defaultdict(list)
+    for email in emails:
+        partitions[(email.account_id, email.received_date.strftime('%Y-%m'))].append(email)
+
+    written, files = [], {}
+    try:
+        for (account_id, month), group in partitions.items():
+            archive_file = os.path.join(f"account_id={account_id}", f"month={month}", f"part-{name}.parquet")
+            _write_file(archive_file, group)
+            written.append(archive_file)
+            files.update((email.id, archive_file) for email in group)
+
+        _remove_from_hot_table(emails, files)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for archive_file in written:
+            os.remove(_full_path(archive_file))
+        raise
+
+    db.session.expunge_all()  # The deleted emails and their bodies
+    return list(files)
+
+
+def _write_file(archive_file, emails):
+    path = _full_path(archive_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    table = pyarrow.Table.from_pylist([_archive_row(email) for email in emails], schema=_schema())
+    partial = f"{path}.partial"
+    pq.write_table(table, partial, compression='zstd', row_group_size=ROW_GROUP_SIZE)
+    # On disk before the rows leave the database
+    with open(partial, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+
+def _archive_row(email):
+    row = {name: getattr(email, name) for name in STRING_COLUMNS}
+    row.update({
+        'id': email.id,
+        'account_id': email.account_id,
+        'uid': email.uid,
+        'thread_id': email.thread_id,
+        'date': email.date,
+        'received_date': email.received_date,
+        'attachments': [{
+            'filename': attachment.filename,
+            'content_type': attachment.content_type,
+            'size': attachment.size,
+            'content': attachment.content
+        } for attachment in email.attachments]
+    })
+    return row
+
+
+def _remove_from_hot_table(emails, files):
+    email_ids = [email.id for email in emails]
+    db.session.execute(db.insert(ArchivedEmail), [{
+        'id': email.id,
+        'account_id': email.account_id,
+        'folder': email.folder,
+        'uid': email.uid,
+        'message_id': email.message_id,
+        'subject': email.subject,
+        'sender': email.sender,
+        'date': email.date,
+        'received_date': email.received_date,
+        'category': email.category,
+        'archive_file': files[email.id]
+    } for email in emails])
+
+    # Bulk deletes skip the flush hook, so the counters are adjusted here
+    removed = Counter(email_counters.counter_key(email.account_id, email.category, email.folder) for email in emails)
+    email_counters.adjust({key: -count for key, count in removed.items()})
+
+    db.session.execute(db.delete(Attachment).where(Attachment.email_id.in_(email_ids)),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(db.delete(ReplyDraft).where(ReplyDraft.email_id.in_(email_ids)),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(db.delete(Email).where(Email.id.in_(email_ids)),
+                       execution_options={'synchronize_session': False})
+
+    # Threads keep their remaining messages; ones left empty go, so a late reply starts a new thread
+    for thread_id in sorted({email.thread_id for email in emails if email.thread_id}):
+        thread = db.session.get(EmailThread, thread_id)
+        if thread is None:
+            continue
+        email_threads.refresh_stats(thread)
+        if thread.message_count == 0:
+            db.session.execute(db.delete(ThreadReference).where(ThreadReference.thread_id == thread_id))
+            db.session.delete(thread)
+
+
+def get_archived(email_id):
+    """Get an archived email in the same shape as an NDJSON export record, or None"""
+    entry = db.session.get(ArchivedEmail, email_id)
+    if entry is None:
+        return None
+
+    _require_pyarrow()
+    table = pq.read_table(_full_path(entry.archive_file), filters=[('id', '=', email_id)])
+    if not table.num_rows:
+        logger.error(f"Archived email {email_id} is missing from {entry.archive_file}")
+        return None
+
+    row = table.slice(0, 1).to_pylist()[0]
+    try:
+        headers = json.loads(row['headers']) if row['headers'] else {}
+    except ValueError:
+        headers = {}
+    return {
+        'id': row['id'],
+        'account_id': row['account_id'],
+        'folder': row['folder'],
+        'uid': row['uid'],
+        'message_id': row['message_id'],
+        'in_reply_to': row['in_reply_to'],
+        'references': row['reference_ids'].split() if row['reference_ids'] else [],
+        'thread_id': row['thread_id'],
+        'subject': row['subject'],
+        'sender': row['sender'],
+        'recipients': row['recipients'],
+        'cc': row['cc'],
+        'date': row['date'].isoformat() if row['date'] else None,
+        'received_date': row['received_date'].isoformat() if row['received_date'] else None,
+        'flags': row['flags'],
+        'category': row['category'],
+        'headers': headers,
+        'body_text': row['body_text'],
+        'body_html': row['body_html'],
+        'attachments': [{
+            'filename': attachment['filename'],
+            'content_type': attachment['content_type'],
+            'size': attachment['size']
+        } for attachment in row['attachments'] or []],
+        'archived_at': entry.archived_at.isoformat() if entry.archived_at else None
+    }
+
+
+def search(query=None, account_id=None, received_after=None, received_before=None, limit=100):
+    """Search archived emails, most recently received first
+
+    The filters are answered from the lookup table. A text query also scans
+    subject, sender and body text, in only the files holding emails that
+    pass the filters. Returns lookup entries.
+    """
+    lookup = ArchivedEmail.query
+    if account_id is not None:
+        lookup = lookup.filter(ArchivedEmail.account_id == account_id)
+    if received_after:
+        lookup = lookup.filter(ArchivedEmail.received_date >= received_after)
+    if received_before:
+        lookup = lookup.filter(ArchivedEmail.received_date < received_before)
+
+    newest_first = (ArchivedEmail.received_date.desc(), ArchivedEmail.id.desc())
+    if not query:
+        return lookup.order_by(*newest_first).limit(limit).all()
+
+    _require_pyarrow()
+    archive_files = [archive_file for archive_file, in lookup.with_entities(ArchivedEmail.archive_file).distinct()]
+    if not archive_files:
+        return []
+
+    matches = None
+    for column in ('subject', 'sender', 'body_text'):
+        match = pc.match_substring(ds.field(column), pattern=query, ignore_case=True)
+        matches = match if matches is None else matches | match
+    if account_id is not None:
+        matches = matches & (ds.field('account_id') == account_id)
+    if received_after:
+        matches = matches & (ds.field('received_date') >= pyarrow.scalar(received_after, pyarrow.timestamp('us')))
+    if received_before:
+        matches = matches & (ds.field('received_date') < pyarrow.scalar(received_before, pyarrow.timestamp('us')))
+
+    dataset = ds.dataset([_full_path(archive_file) for archive_file in archive_files], format='parquet', schema=_schema())
+    found = dataset.to_table(columns=['id', 'received_date'], filter=matches)
+    found = found.sort_by([('received_date', 'descending'), ('id', 'descending')]).slice(0, limit)
+    email_ids = found.column('id').to_pylist()
+    if not email_ids:
+        return []
+
+    # Rows only count once their lookup entry exists
+    return ArchivedEmail.query.filter(ArchivedEmail.id.in_(email_ids)).order_by(*newest_first).all()
+
+
+def delete_account_files(account_id):
+    """Remove an account's archive files once its lookup entries are gone"""
+    shutil.rmtree(os.path.join(ARCHIVE_DIR, f"account_id={account_id}"), ignore_errors=True)
+
+
+def start_scheduler(interval):
+    """Run archive() every interval seconds on a daemon thread"""
+    def run():
+        stop = threading.Event()
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    archive()
+                except Exception as e:
+                    logger.error(f"Email archive error: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='email-archiver', daemon=True)
+    thread.start()
+    return thread
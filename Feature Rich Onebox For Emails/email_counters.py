@@ -0,0 +1,150 @@
+"""Per-(account, category, folder) email counts for the dashboard
+
+Counts are adjusted inside the transaction that changes the emails: ORM
+inserts, deletes and category/folder changes are picked up by a
+before_flush hook, and code that writes emails with Core statements (like
+the ingest upsert) calls adjust() itself. reconcile() recomputes everything
+from the email table to correct any drift.
+"""
+import logging
+import threading
+from collections import Counter
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app import app, db
+from db_utils import dialect_insert
+from models import Email, EmailCounter
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL advisory lock taken by reconcile(), so only one process recounts at a time
+RECONCILE_LOCK_KEY = 7460217352
+
+
+def counter_key(account_id, category, folder):
+    # Counter keys are part of the primary key, so NULL categories are stored as ''
+    return account_id, category or '', folder
+
+
+def adjust(deltas, session=None):
+    """Apply {(account_id, category, folder): delta} to the counters"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    session = session or db.session
+    statement = dialect_insert(EmailCounter)
+    statement = statement.on_conflict_do_update(
+        index_elements=['account_id', 'category', 'folder'],
+        set_={'count': EmailCounter.count + statement.excluded.count}
+    )
+    session.execute(statement, [
+        {"account_id": account_id, "category": category, "folder": folder, "count": delta}
+        for (account_id, category, folder), delta in sorted(deltas.items())  # fixed order avoids deadlocks
+    ])
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_email_changes(session, flush_context, instances):
+    deltas = Counter()
+
+    for email in session.new:
+        if isinstance(email, Email):
+            deltas[counter_key(email.account_id, email.category, email.folder)] += 1
+
+    for email in session.deleted:
+        if isinstance(email, Email):
+            state = inspect(email)
+            deltas[counter_key(
+                _committed(state, 'account_id'), _committed(state, 'category'), _committed(state, 'folder')
+            )] -= 1
+
+    for email in session.dirty:
+        if not isinstance(email, Email) or not session.is_modified(email):
+            continue
+        state = inspect(email)
+        old = counter_key(_committed(state, 'account_id'), _committed(state, 'category'), _committed(state, 'folder'))
+        new = counter_key(email.account_id, email.category, email.folder)
+        if old != new:
+            deltas[old] -= 1
+            deltas[new] += 1
+
+    if deltas:
+        adjust(deltas, session)
+
+
+def _committed(state, attribute):
+    """Get an attribute's value as of the last flush"""
+    history = state.attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.attrs[attribute].value
+
+
+def totals():
+    """Get the total email count and counts per category from the counters"""
+    rows = db.session.query(EmailCounter.category, db.func.sum(EmailCounter.count)).group_by(EmailCounter.category)
+    categories = {(category or None): int(count) for category, count in rows if count}
+    return sum(categories.values()), categories
+
+
+def reconcile():
+    """Rebuild the counters from the email table
+
+    Returns the number of counter rows that were wrong. Returns 0 without
+    recounting if another process is already reconciling.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # Held until the commit below
+        if not db.session.execute(db.text("SELECT pg_try_advisory_xact_lock(:key)"),
+                                  {"key": RECONCILE_LOCK_KEY}).scalar():
+            db.session.rollback()
+            logger.info("Email counters are already being reconciled, skipping")
+            return 0
+        # Block concurrent adjustments so none are lost between the count and the rewrite
+        db.session.execute(db.text("LOCK TABLE email_counter IN EXCLUSIVE MODE"))
+
+    actual = {
+        counter_key(account_id, category, folder): count
+        for account_id, category, folder, count in db.session.query(
+            Email.account_id, Email.category, Email.folder, db.func.count(Email.id)
+        ).group_by(Email.account_id, Email.category, Email.folder)
+    }
+    stored = {
+        (counter.account_id, counter.category, counter.folder): counter.count
+        for counter in EmailCounter.query.all()
+    }
+
+    drift = {key: actual.get(key, 0) - stored.get(key, 0) for key in actual.keys() | stored.keys()}
+    drift = {key: delta for key, delta in drift.items() if delta}
+
+    if drift:
+        adjust(drift)
+        logger.warning(f"Corrected {len(drift)} drifted email counters")
+    # Drop rows for combinations that no longer have any email
+    EmailCounter.query.filter(EmailCounter.count == 0).delete(synchronize_session=False)
+    db.session.commit()
+    return len(drift)
+
+
+def start_reconciler(interval):
+    """Run reconcile() every interval seconds on a daemon thread
+
+    Each run blocks counter updates (and so ingest) while it recounts, so
+    this is meant for a single process; see COUNTER_RECONCILE_INTERVAL in main.py.
+    """
+    def run():
+        stop = threading.Event()
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    reconcile()
+                except Exception as e:
+                    logger.error(f"Counter reconcile error: {str(e)}")
+                    db.session.rollback()
+
+    thread = threading.Thread(target=run, name='counter-reconciler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,171 @@
+"""Streaming bulk export of stored emails as NDJSON or mbox
+
+Emails are read from a server-side cursor (yield_per) in id order and
+serialized one at a time, so memory stays constant however many are
+exported. Output is yielded in chunks of about CHUNK_SIZE bytes for a
+streaming HTTP response or a file.
+"""
+import json
+import logging
+import mailbox
+import os
+from email import encoders
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime, parseaddr
+from io import BytesIO
+from app import db
+from models import Attachment, Email
+from services.bulk_jobs import JOB_FILTERS, email_query
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'mbox': 'application/mbox'}
+# Same filters as bulk jobs; id lists are for jobs, not exports
+EXPORT_FILTERS = tuple(name for name in JOB_FILTERS if name != 'ids')
+BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+CHUNK_SIZE = 64 * 1024
+
+# Rebuilt for the exported body, so the original values would be wrong
+MIME_HEADERS = {'content-type', 'content-transfer-encoding', 'content-disposition', 'mime-version'}
+
+
+def export_emails(filters, export_format='ndjson', batch_size=None):
+    """Get a generator of bytes chunks exporting the emails matching filters
+
+    Raises ValueError for an unknown format or invalid filters before
+    anything is read, so callers can report it.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, use one of: {', '.join(FORMATS)}")
+    unknown = set(filters) - set(EXPORT_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    attachments = db.selectinload(Email.attachments)
+    if export_format == 'mbox':
+        attachments = attachments.undefer(Attachment.content)
+    query = email_query(filters).options(db.undefer_group('body'), attachments).order_by(Email.id)
+    serialize = ndjson_record if export_format == 'ndjson' else mbox_record
+    return _generate(query.yield_per(batch_size or BATCH_SIZE), serialize, export_format)
+
+
+def _generate(emails, serialize, export_format):
+    buffer, buffered, exported, total_bytes = [], 0, 0, 0
+    for email in emails:
+        record = serialize(email)
+        buffer.append(record)
+        buffered += len(record)
+        exported += 1
+        if buffered >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            total_bytes += buffered
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+        total_bytes += buffered
+    logger.info(f"Exported {exported} emails as {export_format} ({total_bytes} bytes)")
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _stored_headers(email):
+    try:
+        return json.loads(email.headers) if email.headers else {}
+    except ValueError:
+        return {}
+
+
+def ndjson_record(email):
+    """Serialize an email as one JSON line"""
+    return json.dumps({
+        'id': email.id,
+        'account_id': email.account_id,
+        'folder': email.folder,
+        'uid': email.uid,
+        'message_id': email.message_id,
+        'in_reply_to': email.in_reply_to,
+        'references': email.reference_ids.split() if email.reference_ids else [],
+        'thread_id': email.thread_id,
+        'subject': email.subject,
+        'sender': email.sender,
+        'recipients': email.recipients,
+        'cc': email.cc,
+        'date': _isoformat(email.date),
+        'received_date': _isoformat(email.received_date),
+        'flags': email.flags,
+        'category': email.category,
+        'headers': _stored_headers(email),
+        'body_text': email.body_text,
+        'body_html': email.body_html,
+        'attachments': [{
+            'filename': attachment.filename,
+            'content_type': attachment.content_type,
+            'size': attachment.size
+        } for attachment in email.attachments]
+    }, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def mbox_record(email):
+    """Serialize an email as an mbox entry: a From_ line and the rebuilt message"""
+    body_text, body_html = email.body_text, email.body_html
+    if body_text and body_html:
+        body = MIMEMultipart('alternative')
+        body.attach(MIMEText(body_text, 'plain', 'utf-8'))
+        body.attach(MIMEText(body_html, 'html', 'utf-8'))
+    elif body_html:
+        body = MIMEText(body_html, 'html', 'utf-8')
+    else:
+        body = MIMEText(body_text or '', 'plain', 'utf-8')
+
+    # Attachment content is optional; ones stored without it are left out
+    files = [attachment for attachment in email.attachments if attachment.content is not None]
+    if files:
+        message = MIMEMultipart('mixed')
+        message.attach(body)
+        for attachment in files:
+            maintype, _, subtype = (attachment.content_type or 'application/octet-stream').partition('/')
+            part = MIMEBase(maintype, subtype or 'octet-stream')
+            part.set_payload(attachment.content)
+            encoders.encode_base64(part)
+            part.add_header('Content-Disposition', 'attachment', filename=attachment.filename)
+            message.attach(part)
+    else:
+        message = body
+
+    headers = _stored_headers(email)
+    for name, values in headers.items():
+        if name.lower() in MIME_HEADERS:
+            continue
+        for value in values:
+            message[name.title()] = value
+    if not headers:
+        # Emails without saved headers get them from their columns
+        for name, value in (('From', email.sender), ('To', email.recipients), ('Cc', email.cc),
+                            ('Subject', email.subject)):
+            if value:
+                message[name] = value
+        if email.date:
+            message['Date'] = format_datetime(email.date)
+        if email.message_id:
+            message['Message-ID'] = f"<{email.message_id}>"
+    message['X-Onebox-Folder'] = email.folder
+    if email.category:
+        message['X-Onebox-Category'] = email.category
+
+    entry = mailbox.mboxMessage(message)
+    flags = email.flags or ''
+    entry.set_flags(('R' if '\\Seen' in flags else '') + ('A' if '\\Answered' in flags else '')
+                    + ('F' if '\\Flagged' in flags else ''))
+    sent = email.date or email.received_date
+    entry.set_from(parseaddr(email.sender or '')[1] or 'MAILER-DAEMON', sent.timetuple() if sent else True)
+
+    output = BytesIO()
+    output.write(f"From {entry.get_from()}\n".encode('utf-8'))
+    BytesGenerator(output, mangle_from_=True).flatten(entry)
+    output.write(b'\n')
+    return output.getvalue()
@@ -0,0 +1,188 @@
+"""Conversation threading, maintained as emails are stored
+
+Threads follow JWZ's algorithm (https://www.jwz.org/doc/threading.html),
+done incrementally: every Message-ID an email has or refers to (its own,
+In-Reply-To and References) is recorded in thread_reference against the
+email's thread, so a later message naming any of them joins that thread,
+and one naming ids from several threads merges them. Replies without usable
+headers fall back to matching the normalized subject of a recent thread.
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from app import db
+from db_utils import dialect_insert
+from models import Email, EmailThread, ThreadReference
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ID = re.compile(r"<([^<>\s]+)>")
+# Reply/forward prefixes in common languages, optionally counted ("Re[2]:") or bracketed list tags
+SUBJECT_PREFIX = re.compile(r"^\s*((re|fwd?|aw|wg|sv|vs|antw|tr|rif)(\[\d+\])?\s*:|\[[^\]]{1,40}\])\s*", re.IGNORECASE)
+REPLY_PREFIX = re.compile(r"^\s*(re|aw|sv|antw|rif)(\[\d+\])?\s*:", re.IGNORECASE)
+
+# Only the most recent References are looked up; long chains repeat the same thread
+MAX_REFERENCES = 20
+SUBJECT_WINDOW = timedelta(days=int(os.environ.get('THREAD_SUBJECT_WINDOW_DAYS', '30')))
+
+
+def parse_message_ids(value):
+    """Get the Message-IDs (without <>) from a header value, in order"""
+    if not value:
+        return []
+    ids = MESSAGE_ID.findall(value)
+    # Some clients send a bare id without brackets
+    if not ids and value.strip() and ' ' not in value.strip():
+        ids = [value.strip()]
+    return [message_id[:256] for message_id in ids]
+
+
+def header_ids(headers):
+    """Get (message_id, in_reply_to, reference_ids) from a {name: [values]} header dict"""
+    def first(name):
+        values = headers.get(name) or headers.get(name.title()) or ['']
+        return values[0] if values else ''
+
+    message_ids = parse_message_ids(first('message-id'))
+    in_reply_to = parse_message_ids(first('in-reply-to'))
+    references = parse_message_ids(first('references'))
+    return (
+        message_ids[0] if message_ids else None,
+        in_reply_to[0] if in_reply_to else None,
+        ' '.join(dict.fromkeys(references)) or None
+    )
+
+
+def normalize_subject(subject):
+    """Strip reply/forward prefixes and list tags, collapse whitespace and lowercase"""
+    subject = subject or ''
+    while True:
+        stripped = SUBJECT_PREFIX.sub('', subject, count=1)
+        if stripped == subject:
+            break
+        subject = stripped
+    return ' '.join(subject.split()).lower()[:255] or None
+
+
+def assign_thread(email):
+    """Put a newly stored email in its thread, creating or merging threads as needed
+
+    Runs in the caller's transaction; returns the thread.
+    """
+    references = (email.reference_ids or '').split()[-MAX_REFERENCES:]
+    ids = list(dict.fromkeys(filter(None, references + [email.in_reply_to, email.message_id])))
+    sort_date = email.date or email.received_date or datetime.utcnow()
+    subject_key = normalize_subject(email.subject)
+
+    thread = None
+    if ids:
+        thread_ids = sorted({thread_id for thread_id, in db.session.query(ThreadReference.thread_id).filter(
+            ThreadReference.account_id == email.account_id,
+            ThreadReference.message_id.in_(ids)
+        )})
+        if thread_ids:
+            thread = db.session.get(EmailThread, thread_ids[0])
+            if len(thread_ids) > 1:
+                _merge(thread, thread_ids[1:])
+
+    # No header links: a reply ("Re: ...") joins a recent thread with the same subject
+    is_reply = bool(email.in_reply_to or references or REPLY_PREFIX.match(email.subject or ''))
+    if thread is None and is_reply and subject_key:
+        thread = EmailThread.query.filter(
+            EmailThread.account_id == email.account_id,
+            EmailThread.subject_key == subject_key,
+            EmailThread.last_date >= sort_date - SUBJECT_WINDOW
+        ).order_by(EmailThread.last_date.desc()).first()
+
+    if thread is None:
+        thread = EmailThread(account_id=email.account_id, subject=email.subject, subject_key=subject_key, message_count=0)
+        db.session.add(thread)
+        db.session.flush()
+
+    if ids:
+        db.session.execute(dialect_insert(ThreadReference).on_conflict_do_nothing(), [
+            {"account_id": email.account_id, "message_id": message_id, "thread_id": thread.id} for message_id in ids
+        ])
+
+    email.thread_id = thread.id
+    thread.message_count = (thread.message_count or 0) + 1
+    if thread.first_date is None or sort_date < thread.first_date:
+        # An earlier message (often the root, arriving after its replies) names the thread
+        thread.first_date = sort_date
+        thread.subject = email.subject
+    if thread.last_date is None or sort_date >= thread.last_date:
+        thread.last_date = sort_date
+        thread.last_email_id = email.id
+    return thread
+
+
+def _merge(thread, other_ids):
+    """Move everything in the other threads into thread and delete them"""
+    db.session.query(Email).filter(Email.thread_id.in_(other_ids)).update(
+        {Email.thread_id: thread.id}, synchronize_session='fetch'
+    )
+    db.session.query(ThreadReference).filter(ThreadReference.thread_id.in_(other_ids)).update(
+        {ThreadReference.thread_id: thread.id}, synchronize_session=False
+    )
+    db.session.query(EmailThread).filter(EmailThread.id.in_(other_ids)).delete(synchronize_session='fetch')
+    refresh_stats(thread)
+    logger.debug(f"Merged threads {other_ids} into {thread.id}")
+
+
+def refresh_stats(thread):
+    """Recompute a thread's message count, dates and latest email from its emails"""
+    sort_date = db.func.coalesce(Email.date, Email.received_date)
+    count, first_date = db.session.query(db.func.count(Email.id), db.func.min(sort_date)).filter(
+        Email.thread_id == thread.id
+    ).one()
+    latest = db.session.query(Email.id, sort_date).filter(Email.thread_id == thread.id).order_by(
+        sort_date.desc(), Email.id.desc()
+    ).first()
+
+    thread.message_count = count
+    thread.first_date = first_date
+    thread.last_date, thread.last_email_id = (latest[1], latest[0]) if latest else (None, None)
+
+
+def rebuild(account_id=None, batch_size=500):
+    """Re-thread stored emails from their saved headers
+
+    Emails stored before threading existed only have the IMAP UID in
+    message_id, so the ids are re-read from the headers column first.
+    Emails are threaded in the order they were stored. Returns the number
+    of emails threaded.
+    """
+    scope = [Email.account_id == account_id] if account_id else []
+
+    # Start from scratch for the scope
+    db.session.query(Email).filter(*scope).update({Email.thread_id: None}, synchronize_session=False)
+    reference_scope = [ThreadReference.account_id == account_id] if account_id else []
+    db.session.query(ThreadReference).filter(*reference_scope).delete(synchronize_session=False)
+    thread_scope = [EmailThread.account_id == account_id] if account_id else []
+    # 'fetch' so loaded threads leave the identity map; their ids can be reused
+    db.session.query(EmailThread).filter(*thread_scope).delete(synchronize_session='fetch')
+    db.session.commit()
+
+    threaded, last_id = 0, 0
+    while True:
+        emails = Email.query.options(db.undefer(Email.headers)).filter(*scope, Email.id > last_id).order_by(
+            Email.id
+        ).limit(batch_size).all()
+        if not emails:
+            break
+
+        for email in emails:
+            try:
+                headers = json.loads(email.headers) if email.headers else {}
+            except ValueError:
+                headers = {}
+            email.message_id, email.in_reply_to, email.reference_ids = header_ids(headers)
+            assign_thread(email)
+
+        db.session.commit()
+        threaded += len(emails)
+        last_id = emails[-1].id
+
+    return threaded
@@ -0,0 +1,97 @@
+"""Conditional GET and response compression for the JSON API
+
+@conditional(marker) gives an endpoint a strong ETag derived from a cheap
+change marker (a few indexed aggregates) plus the request's query string.
+A request whose If-None-Match still matches gets a 304 before the view runs,
+so polling an unchanged resource costs one small query and no serialization.
+
+Every JSON response over COMPRESS_MIN_SIZE bytes is brotli (if the brotli
+package is installed) or gzip compressed when the client accepts it.
+"""
+import functools
+import gzip
+import hashlib
+import os
+from flask import request, make_response
+from app import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Close to gzip's speed with a better ratio; 11 is far too slow per request
+
+
+def conditional(marker):
+    """Serve 304 Not Modified while marker() and the query string are unchanged
+
+    marker() must return something that changes whenever the endpoint's
+    output would; it is called with the view's arguments.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            state = repr((request.path, sorted(request.args.items(multi=True)), marker(*args, **kwargs)))
+            etag = hashlib.sha256(state.encode('utf-8')).hexdigest()[:32]
+
+            requested = _requested_etags()
+            if etag in requested:
+                response = make_response('', 304)
+                response.set_etag(requested[etag])
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            # Clients may keep the response but must check back each time
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
+
+
+def _requested_etags():
+    # Compressed responses carry the encoding in their ETag; a 304 repeats the one the client has
+    return {etag.split('-')[0]: etag for etag in request.if_none_match.as_set()}
+
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+@app.after_request
+def compress_response(response):
+    """Compress large JSON responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _accepted_encoding()
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+
+    # A strong ETag names exactly one representation
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
@@ -1,5 +1,29 @@
+import os
 from app import app
 import routes  # Import routes to register them with Flask
+from services import webhook_dispatcher, bulk_job_runner
+import email_counters
+import email_archive
+
+# Deliver queued webhooks from the web process unless a separate
+# `flask webhooks-dispatch` worker does it
+if os.environ.get('WEBHOOK_DISPATCHER_AUTOSTART', 'true').lower() == 'true':
+    webhook_dispatcher.start()
+
+# Pick up bulk jobs interrupted by a restart; jobs are claimed, so every worker can do this
+with app.app_context():
+    bulk_job_runner.resume()
+
+# Periodically correct any drift in the dashboard counters. Off by default: each run
+# locks the counters while it recounts, so enable it in one process only (or run
+# `flask counters-reconcile` from cron)
+counter_reconcile_interval = float(os.environ.get('COUNTER_RECONCILE_INTERVAL', '0'))
+if counter_reconcile_interval > 0:
+    email_counters.start_reconciler(counter_reconcile_interval)
+
+# Move emails older than RETENTION_DAYS to the archive (0, the default, keeps everything)
+if email_archive.RETENTION_DAYS > 0:
+    email_archive.start_scheduler(float(os.environ.get('RETENTION_INTERVAL', '86400')))
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
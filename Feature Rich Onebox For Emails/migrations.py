@@ -0,0 +1,148 @@
+import logging
+from sqlalchemy import inspect, text
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models
+
+    db.create_all() only creates missing tables, so columns and indexes added
+    to existing models never reach a database that was created earlier. This
+    adds whatever the models declare but the database is missing.
+    """
+    inspector = inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column['name']: column for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name in existing:
+                    # SQLite can't alter constraints; it is only used for development
+                    if column.nullable and not existing[column.name]['nullable'] and db.engine.dialect.name != 'sqlite':
+                        conn.execute(text(f"ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} DROP NOT NULL"))
+                        logger.info(f"Made column {table.name}.{column.name} nullable")
+                    continue
+
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                statement = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"
+                if column.server_default is not None:
+                    statement += f" DEFAULT {column.server_default.arg}"
+
+                conn.execute(text(statement))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+    backfill_email_counters()
+
+    # The ingest key can't be created while duplicate rows exist; removing them
+    # deletes user data, so it is left to `flask emails-dedupe`
+    skipped = set()
+    if 'uq_email_account_folder_uid' not in {index['name'] for index in inspector.get_indexes('email')}:
+        duplicates = sum(count for _, _, count in find_duplicate_emails())
+        if duplicates:
+            skipped.add('uq_email_account_folder_uid')
+            logger.error(f"Not creating index uq_email_account_folder_uid: {duplicates} emails repeat an "
+                         f"(account_id, folder, uid) ingest key, and syncs can't store email without it; "
+                         f"run `flask emails-dedupe` to review and remove them")
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in skipped:
+                index.create(db.engine, checkfirst=True)
+
+    backfill_webhook_events()
+
+
+def find_duplicate_emails():
+    """Count emails that repeat an (account_id, folder, uid) ingest key
+
+    Returns (account_id, folder, count) for each account and folder that has
+    any, counting the rows dedupe_emails() would delete.
+    """
+    from models import Email
+
+    keys = db.session.query(
+        Email.account_id, Email.folder, (db.func.count(Email.id) - 1).label('extra')
+    ).filter(Email.uid.isnot(None)).group_by(
+        Email.account_id, Email.folder, Email.uid
+    ).having(db.func.count(Email.id) > 1).subquery()
+
+    return db.session.query(keys.c.account_id, keys.c.folder, db.func.sum(keys.c.extra)).group_by(
+        keys.c.account_id, keys.c.folder
+    ).order_by(keys.c.account_id, keys.c.folder).all()
+
+
+def dedupe_emails(batch_size=500):
+    """Delete emails that repeat an (account_id, folder, uid) ingest key, keeping the oldest row
+
+    Works batch_size emails per transaction and returns the number deleted.
+    """
+    from models import Email, EmailThread, ThreadReference
+    from services import elasticsearch_service
+    import email_threads
+
+    keep = db.session.query(db.func.min(Email.id)).filter(Email.uid.isnot(None)).group_by(
+        Email.account_id, Email.folder, Email.uid
+    )
+
+    deleted, last_id = 0, 0
+    while True:
+        emails = Email.query.filter(
+            Email.uid.isnot(None), Email.id > last_id, ~Email.id.in_(keep)
+        ).order_by(Email.id).limit(batch_size).all()
+        if not emails:
+            break
+
+        email_ids = [email.id for email in emails]
+        thread_ids = {email.thread_id for email in emails if email.thread_id}
+        # Delete through the ORM so attachments, drafts and counters follow
+        for email in emails:
+            db.session.delete(email)
+        db.session.flush()
+        for thread_id in sorted(thread_ids):
+            thread = db.session.get(EmailThread, thread_id)
+            if thread is None:
+                continue
+            email_threads.refresh_stats(thread)
+            if thread.message_count == 0:
+                db.session.query(ThreadReference).filter(ThreadReference.thread_id == thread_id).delete()
+                db.session.delete(thread)
+        db.session.commit()
+        db.session.expunge_all()
+
+        elasticsearch_service.delete_emails(email_ids)
+        deleted += len(email_ids)
+        last_id = email_ids[-1]
+        logger.info(f"Removed {deleted} duplicate emails")
+
+    return deleted
+
+
+def backfill_email_counters():
+    """Count existing emails into the counter table when it is first added"""
+    from models import Email, EmailCounter
+    import email_counters
+
+    if db.session.query(EmailCounter.account_id).first() is None and db.session.query(Email.id).first() is not None:
+        email_counters.reconcile()
+        logger.info("Built email counters from the email table")
+
+
+def backfill_webhook_events():
+    """Create event subscriptions for webhooks saved before they were normalized"""
+    from models import Webhook, WebhookEvent
+
+    webhooks = Webhook.query.filter(~Webhook.subscriptions.any()).all()
+    for webhook in webhooks:
+        events = dict.fromkeys(event.strip() for event in (webhook.events or '').split(',') if event.strip())
+        db.session.add_all(WebhookEvent(webhook_id=webhook.id, event=event) for event in events)
+
+    if webhooks:
+        db.session.commit()
+        logger.info(f"Backfilled event subscriptions for {len(webhooks)} webhooks")
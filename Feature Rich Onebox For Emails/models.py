@@ -1,5 +1,6 @@
 from datetime import datetime
 from app import db
+from compression import CompressedText
 
 class EmailAccount(db.Model):
     """Model for storing email account information"""
@@ -13,9 +14,14 @@ class EmailAccount(db.Model):
     last_sync = db.Column(db.DateTime)
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Change marker for API ETags
     
     # Relationship
     emails = db.relationship('Email', backref='account', lazy=True, cascade="all, delete-orphan")
+    counters = db.relationship('EmailCounter', lazy=True, cascade="all, delete-orphan")
+    threads = db.relationship('EmailThread', backref='account', lazy=True, cascade="all, delete-orphan")
+    thread_references = db.relationship('ThreadReference', lazy=True, cascade="all, delete-orphan")
+    archived_emails = db.relationship('ArchivedEmail', lazy=True, cascade="all, delete-orphan")
     
     def __repr__(self):
         return f'<EmailAccount {self.email}>'
@@ -26,23 +32,47 @@ class Email(db.Model):
     account_id = db.Column(db.Integer, db.ForeignKey('email_account.id'), nullable=False)
     
     # Email metadata
-    message_id = db.Column(db.String(256), nullable=True)  # From email header
-    folder = db.Column(db.String(100), nullable=False, default='INBOX')
+    message_id = db.Column(db.String(256), nullable=True)  # Message-ID header, without <>
+    in_reply_to = db.Column(db.String(256), nullable=True)  # First Message-ID in In-Reply-To
+    reference_ids = db.Column(db.Text, nullable=True)  # Message-IDs from References, space separated, oldest first
+    thread_id = db.Column(db.Integer, db.ForeignKey('email_thread.id'), nullable=True)
+    # active_history so the old value is known when it changes (see email_counters)
+    folder = db.column_property(db.Column(db.String(100), nullable=False, default='INBOX'), active_history=True)
     subject = db.Column(db.String(512), nullable=True)
     sender = db.Column(db.String(256), nullable=True)  # From field
     recipients = db.Column(db.Text, nullable=True)  # To field, can be multiple
     cc = db.Column(db.Text, nullable=True)  # CC field, can be multiple
+    headers = db.deferred(db.Column(db.Text, nullable=True), group='body')  # JSON serialized raw headers
     
-    # Email content
-    body_text = db.Column(db.Text, nullable=True)
-    body_html = db.Column(db.Text, nullable=True)
+    # Email content. Bodies can be hundreds of KB, so they are only loaded
+    # (together, in one query) when first accessed; lists use snippet.
+    # Bodies and their derived texts are stored compressed in the *_z columns
+    # behind the properties below; the uncompressed columns only hold rows
+    # from before that, until `flask bodies-compress` converts them
+    _body_text = db.deferred(db.Column('body_text', db.Text, nullable=True), group='body')
+    _body_html = db.deferred(db.Column('body_html', db.Text, nullable=True), group='body')
+    _body_clean = db.deferred(db.Column('body_clean', db.Text, nullable=True), group='body')
+    _html_safe = db.deferred(db.Column('html_safe', db.Text, nullable=True), group='body')
+    _html_text = db.deferred(db.Column('html_text', db.Text, nullable=True), group='body')
+    body_text_z = db.deferred(db.Column(CompressedText, nullable=True), group='body')
+    body_html_z = db.deferred(db.Column(CompressedText, nullable=True), group='body')
+    body_clean_z = db.deferred(db.Column(CompressedText, nullable=True), group='body')  # body_text without quoted history, signature and disclaimers
+    # body_html sanitized for display, and rendered as plain text (see services.html_sanitizer)
+    html_safe_z = db.deferred(db.Column(CompressedText, nullable=True), group='body')
+    html_text_z = db.deferred(db.Column(CompressedText, nullable=True), group='body')
+    snippet = db.Column(db.String(255), nullable=True)  # Start of the cleaned body for list views
+    html_version = db.Column(db.Integer, nullable=True)  # SANITIZER_VERSION that produced them
     
     # Timestamps
     date = db.Column(db.DateTime, nullable=True)  # Date from email header
     received_date = db.Column(db.DateTime, default=datetime.utcnow)  # When our system received it
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Last stored or changed, for API ETags
     
     # AI processing
-    category = db.Column(db.String(50), nullable=True)  # interested, not_interested, meeting_booked, spam, out_of_office
+    category = db.column_property(db.Column(db.String(50), nullable=True), active_history=True)  # interested, not_interested, meeting_booked, spam, out_of_office
+    category_source = db.Column(db.String(20), nullable=True)  # rule, local, llm
+    # Set when stored, cleared in the transaction that saves the category and queues email.new
+    categorize_pending = db.Column(db.Boolean, nullable=True)
     
     # IMAP specific
     uid = db.Column(db.Integer, nullable=True)  # IMAP UID
@@ -50,43 +80,317 @@ class Email(db.Model):
     
     # Relationships
     attachments = db.relationship('Attachment', backref='email', lazy=True, cascade="all, delete-orphan")
+    reply_draft = db.relationship('ReplyDraft', backref='email', lazy=True, uselist=False, cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Ingest key: IMAP UIDs are unique per folder
+        db.Index('uq_email_account_folder_uid', 'account_id', 'folder', 'uid', unique=True),
+        # Newest-first lists, overall and filtered by account or category
+        db.Index('ix_email_received', 'received_date', 'id'),
+        db.Index('ix_email_account_received', 'account_id', 'received_date', 'id'),
+        db.Index('ix_email_category_received', 'category', 'received_date', 'id'),
+        # Conversation view: a thread's messages in order
+        db.Index('ix_email_thread_date', 'thread_id', 'date', 'id'),
+        # Emails whose categorization still has to be (re)tried
+        db.Index('ix_email_categorize_pending', 'account_id', 'categorize_pending'),
+        # max(updated_at) for conditional GETs
+        db.Index('ix_email_updated', 'updated_at'),
+    )
+    
+    @property
+    def body_text(self):
+        return self.body_text_z if self.body_text_z is not None else self._body_text
+    
+    @body_text.setter
+    def body_text(self, value):
+        self.body_text_z, self._body_text = value, None
+    
+    @property
+    def body_html(self):
+        return self.body_html_z if self.body_html_z is not None else self._body_html
+    
+    @body_html.setter
+    def body_html(self, value):
+        self.body_html_z, self._body_html = value, None
+    
+    @property
+    def body_clean(self):
+        return self.body_clean_z if self.body_clean_z is not None else self._body_clean
+    
+    @body_clean.setter
+    def body_clean(self, value):
+        self.body_clean_z, self._body_clean = value, None
+    
+    @property
+    def html_safe(self):
+        return self.html_safe_z if self.html_safe_z is not None else self._html_safe
+    
+    @html_safe.setter
+    def html_safe(self, value):
+        self.html_safe_z, self._html_safe = value, None
+    
+    @property
+    def html_text(self):
+        return self.html_text_z if self.html_text_z is not None else self._html_text
+    
+    @html_text.setter
+    def html_text(self, value):
+        self.html_text_z, self._html_text = value, None
     
     def __repr__(self):
         return f'<Email {self.subject}>'
 
+class EmailThread(db.Model):
+    """A conversation: emails linked by Message-ID/In-Reply-To/References (see email_threads)"""
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('email_account.id'), nullable=False)
+    subject = db.Column(db.String(512), nullable=True)  # Subject of the first message seen
+    subject_key = db.Column(db.String(255), nullable=True)  # Normalized subject, for matching replies without headers
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    first_date = db.Column(db.DateTime, nullable=True)
+    last_date = db.Column(db.DateTime, nullable=True)
+    last_email_id = db.Column(db.Integer, nullable=True)  # Latest message, for thread lists
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    # Emails are moved off a thread before it is deleted (or deleted with their account)
+    emails = db.relationship('Email', backref='thread', lazy=True, passive_deletes=True)
+    
+    __table_args__ = (
+        # Latest threads first, overall and per account
+        db.Index('ix_email_thread_last', 'last_date', 'id'),
+        db.Index('ix_email_thread_account_last', 'account_id', 'last_date', 'id'),
+        db.Index('ix_email_thread_subject', 'account_id', 'subject_key', 'last_date'),
+    )
+    
+    def __repr__(self):
+        return f'<EmailThread {self.id} ({self.message_count} messages) {self.subject}>'
+
+class ThreadReference(db.Model):
+    """Which thread a Message-ID belongs to, including ids only seen in References"""
+    account_id = db.Column(db.Integer, db.ForeignKey('email_account.id'), primary_key=True)
+    message_id = db.Column(db.String(256), primary_key=True)
+    thread_id = db.Column(db.Integer, db.ForeignKey('email_thread.id'), nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<ThreadReference {self.message_id} -> {self.thread_id}>'
+
+class ArchivedEmail(db.Model):
+    """Lookup entry for an email moved out of the email table into an archive file (see email_archive)"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # The email's original id
+    account_id = db.Column(db.Integer, db.ForeignKey('email_account.id'), nullable=False)
+    folder = db.Column(db.String(100), nullable=False)
+    uid = db.Column(db.Integer, nullable=True)
+    message_id = db.Column(db.String(256), nullable=True)
+    subject = db.Column(db.String(512), nullable=True)
+    sender = db.Column(db.String(256), nullable=True)
+    date = db.Column(db.DateTime, nullable=True)
+    received_date = db.Column(db.DateTime, nullable=True)
+    category = db.Column(db.String(50), nullable=True)
+    archive_file = db.Column(db.String(512), nullable=False)  # Parquet file holding the full email, relative to ARCHIVE_DIR
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Archive listings and searches, newest first, overall and by account
+        db.Index('ix_archived_email_received', 'received_date', 'id'),
+        db.Index('ix_archived_email_account_received', 'account_id', 'received_date', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<ArchivedEmail {self.id} in {self.archive_file}>'
+
+class EmailCounter(db.Model):
+    """Number of emails per (account, category, folder), kept current by email_counters"""
+    account_id = db.Column(db.Integer, db.ForeignKey('email_account.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)  # '' for uncategorized (NULL) emails
+    folder = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<EmailCounter {self.account_id}/{self.category}/{self.folder}: {self.count}>'
+
 class Attachment(db.Model):
     """Model for storing email attachments"""
     id = db.Column(db.Integer, primary_key=True)
-    email_id = db.Column(db.Integer, db.ForeignKey('email.id'), nullable=False)
+    email_id = db.Column(db.Integer, db.ForeignKey('email.id'), nullable=False, index=True)
     
     filename = db.Column(db.String(256), nullable=False)
     content_type = db.Column(db.String(100), nullable=True)
     size = db.Column(db.Integer, nullable=True)  # Size in bytes
-    content = db.Column(db.LargeBinary, nullable=True)  # Actual file content (optional)
+    content = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Actual file content (optional)
     
     def __repr__(self):
         return f'<Attachment {self.filename}>'
 
+class ReplyDraft(db.Model):
+    """Model for precomputed AI reply suggestions"""
+    id = db.Column(db.Integer, primary_key=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('email.id'), nullable=False, unique=True)
+    
+    text = db.Column(db.Text, nullable=False)
+    prompt_version = db.Column(db.String(20), nullable=False)  # Reply prompt the draft was made with
+    rag_version = db.Column(db.Integer, nullable=False)  # Marker of the RAG store's contents when the draft was made
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReplyDraft for email {self.email_id}>'
+
 class Webhook(db.Model):
     """Model for storing webhook configurations"""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     url = db.Column(db.String(512), nullable=False)
-    events = db.Column(db.String(256), nullable=False)  # Comma-separated event names
+    events = db.Column(db.String(256), nullable=False)  # Comma-separated event names, for display; routing uses WebhookEvent
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_triggered = db.Column(db.DateTime, nullable=True)
+    secret = db.Column(db.String(128), nullable=True)  # HMAC-SHA256 signing key for requests
+    
+    # Batch delivery: events are sent together in arrays of up to batch_size,
+    # waiting at most batch_window seconds. Unbatched when batch_size is unset or 1
+    batch_size = db.Column(db.Integer, nullable=True)
+    batch_window = db.Column(db.Integer, nullable=True, default=10)
+    
+    # Relationships
+    subscriptions = db.relationship('WebhookEvent', backref='webhook', lazy=True, cascade="all, delete-orphan")
+    deliveries = db.relationship('WebhookDelivery', backref='webhook', lazy=True, cascade="all, delete-orphan")
+    batches = db.relationship('WebhookBatch', backref='webhook', lazy=True, cascade="all, delete-orphan")
+    
+    @property
+    def batched(self):
+        return (self.batch_size or 1) > 1
     
     def __repr__(self):
         return f'<Webhook {self.name}>'
 
+class WebhookEvent(db.Model):
+    """Model for the events a webhook is subscribed to"""
+    id = db.Column(db.Integer, primary_key=True)
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook.id'), nullable=False, index=True)
+    event = db.Column(db.String(50), nullable=False, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('webhook_id', 'event', name='uq_webhook_event'),
+    )
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.event} -> {self.webhook_id}>'
+
+class WebhookDelivery(db.Model):
+    """Outbox of webhook calls, written in the same transaction as the change they report"""
+    id = db.Column(db.Integer, primary_key=True)
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook.id'), nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('webhook_batch.id'), nullable=True, index=True)
+    
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON request body
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, batched, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_status_code = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_webhook_delivery_due', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<WebhookDelivery {self.id} {self.event} {self.status}>'
+
+class WebhookBatch(db.Model):
+    """A group of deliveries sent to a batched webhook in one request"""
+    id = db.Column(db.Integer, primary_key=True)
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook.id'), nullable=False)
+    
+    size = db.Column(db.Integer, nullable=False)  # Number of events
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_status_code = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)  # Time taken by the last request
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    
+    # Relationship
+    deliveries = db.relationship('WebhookDelivery', backref='batch', lazy=True)
+    
+    __table_args__ = (
+        db.Index('ix_webhook_batch_due', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<WebhookBatch {self.id} ({self.size} events) {self.status}>'
+
+class BulkJob(db.Model):
+    """Background job over many emails, e.g. recategorizing a filter set (see services.bulk_jobs)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # recategorize
+    params = db.Column(db.Text, nullable=False)  # JSON serialized filter and options
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed, cancelled
+    total = db.Column(db.Integer, nullable=True)  # Matching emails when the job started
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    succeeded = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    last_email_id = db.Column(db.Integer, nullable=False, default=0)  # Progress marker; emails are processed in id order
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    worker = db.Column(db.String(64), nullable=True)  # Runner that claimed the job
+    lease_until = db.Column(db.DateTime, nullable=True)  # Renewed every chunk; others may take over after it
+    
+    # Relationship
+    items = db.relationship('BulkJobItem', backref='job', lazy=True, cascade="all, delete-orphan")
+    
+    def __repr__(self):
+        return f'<BulkJob {self.id} {self.kind} {self.status}>'
+
+class BulkJobItem(db.Model):
+    """Per-email result of a bulk job"""
+    job_id = db.Column(db.Integer, db.ForeignKey('bulk_job.id'), primary_key=True)
+    email_id = db.Column(db.Integer, primary_key=True)  # No foreign key; results outlive deleted emails
+    status = db.Column(db.String(20), nullable=False)  # changed, unchanged, error
+    old_value = db.Column(db.String(50), nullable=True)
+    new_value = db.Column(db.String(50), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    
+    def __repr__(self):
+        return f'<BulkJobItem {self.job_id}/{self.email_id} {self.status}>'
+
+class CompressionDictionary(db.Model):
+    """Preset dictionary for compressed columns (see compression.py); never delete a used one"""
+    id = db.Column(db.Integer, primary_key=True)
+    codec = db.Column(db.Integer, nullable=False)  # compression.ZLIB or compression.ZSTD
+    data = db.Column(db.LargeBinary, nullable=False)
+    sample_size = db.Column(db.Integer, nullable=True)  # Number of bodies it was trained on
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CompressionDictionary {self.id} codec={self.codec}>'
+
 class VectorEntry(db.Model):
     """Model for storing vector embeddings for RAG"""
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
-    embedding = db.Column(db.Text, nullable=False)  # JSON serialized embedding
+    embedding = db.Column(db.Text, nullable=True)  # Legacy JSON serialized embedding
+    vector = db.Column(db.LargeBinary, nullable=True)  # Packed float32 embedding
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of normalized text
     description = db.Column(db.String(256), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
-        return f'<VectorEntry {self.description or self.id}>'
\ No newline at end of file
+        return f'<VectorEntry {self.description or self.id}>'
+
+class MemoEntry(db.Model):
+    """Model for memoized AI results keyed by a hash of normalized content"""
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of kind, model and content
+    kind = db.Column(db.String(20), nullable=False)  # category, embedding
+    value = db.Column(db.Text, nullable=False)  # JSON serialized result
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<MemoEntry {self.kind} {self.key[:12]}>'
\ No newline at end of file
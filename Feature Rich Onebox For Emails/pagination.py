@@ -0,0 +1,90 @@
+import base64
+import json
+from datetime import datetime
+from app import db
+from models import Email, EmailThread
+
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort_date, item_id):
+    """Make an opaque page cursor from a (date, id) sort key"""
+    raw = json.dumps([sort_date.isoformat() if sort_date else None, item_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Get the (date, id) sort key back from a cursor; the date may be None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_date, item_id = json.loads(raw)
+        return (datetime.fromisoformat(sort_date) if sort_date is not None else None), int(item_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid page cursor: {cursor}") from e
+
+
+def clamp_per_page(per_page):
+    """Bound a requested page size to 1..MAX_PER_PAGE"""
+    return max(1, min(per_page or DEFAULT_PER_PAGE, MAX_PER_PAGE))
+
+
+def paginate_emails(query, after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """Get one page of emails, newest first, by keyset on (received_date, id)
+
+    after/before are cursors from a previous page: `after` continues to older
+    emails, `before` goes back to newer ones. Each page is a single index seek
+    whatever its depth, unlike OFFSET. Emails without a date come first, as
+    in PostgreSQL's descending index scan. Returns (emails, next_cursor,
+    prev_cursor), with a cursor set to None when there is no such page.
+    """
+    return _paginate(query, Email.received_date, Email.id, after, before, per_page)
+
+
+def paginate_threads(query, after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """Get one page of threads, most recently active first, by keyset on (last_date, id)
+
+    Works like paginate_emails.
+    """
+    return _paginate(query, EmailThread.last_date, EmailThread.id, after, before, per_page)
+
+
+def _paginate(query, date_column, id_column, after, before, per_page):
+    per_page = clamp_per_page(per_page)
+    key = db.tuple_(date_column, id_column)
+
+    # Newest first is (date DESC NULLS FIRST, id DESC); a NULL date never
+    # compares in a tuple, so rows and cursors without one are handled apart
+    if before:
+        sort_date, item_id = decode_cursor(before)
+        if sort_date is None:
+            newer = db.and_(date_column.is_(None), id_column > item_id)
+        else:
+            newer = db.or_(key > (sort_date, item_id), date_column.is_(None))
+        # Walk forward in time from the cursor, then flip to newest first
+        rows = query.filter(newer).order_by(
+            date_column.asc().nullslast(), id_column.asc()
+        ).limit(per_page + 1).all()
+        has_newer, has_older = len(rows) > per_page, True
+        items = list(reversed(rows[:per_page]))
+    else:
+        if after:
+            sort_date, item_id = decode_cursor(after)
+            if sort_date is None:
+                query = query.filter(db.or_(db.and_(date_column.is_(None), id_column < item_id), date_column.isnot(None)))
+            else:
+                query = query.filter(key < (sort_date, item_id))
+        rows = query.order_by(date_column.desc().nullsfirst(), id_column.desc()).limit(per_page + 1).all()
+        has_newer, has_older = bool(after), len(rows) > per_page
+        items = rows[:per_page]
+
+    def cursor(item):
+        return encode_cursor(getattr(item, date_column.key), getattr(item, id_column.key))
+
+    next_cursor = cursor(items[-1]) if items and has_older else None
+    prev_cursor = cursor(items[0]) if items and has_newer else None
+    return items, next_cursor, prev_cursor
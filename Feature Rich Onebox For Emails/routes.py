@@ -1,10 +1,16 @@
 import json
 import logging
 from datetime import datetime
-from flask import render_template, request, jsonify, redirect, url_for, flash
+from flask import render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from app import app, db
-from models import EmailAccount, Email, Attachment, Webhook, VectorEntry
-from services import imap_service, elasticsearch_service, ai_service, integration_service
+from models import EmailAccount, Email, EmailThread, Attachment, Webhook, WebhookEvent, VectorEntry, BulkJob, BulkJobItem
+from services import imap_service, elasticsearch_service, ai_service, integration_service, bulk_job_runner
+from services.html_sanitizer import render_email
+import email_counters
+from pagination import InvalidCursor, clamp_per_page, paginate_emails, paginate_threads
+from http_cache import conditional
+from email_export import FORMATS as EXPORT_FORMATS, EXPORT_FILTERS, export_emails
+import email_archive
 
 logger = logging.getLogger(__name__)
 
@@ -18,15 +24,13 @@ def inject_now():
 def index():
     """Homepage with dashboard overview"""
     accounts = EmailAccount.query.filter_by(active=True).all()
-    # Count emails by category
-    email_stats = db.session.query(
-        Email.category, db.func.count(Email.id)
-    ).group_by(Email.category).all()
+    # Read the maintained counters instead of counting the email table
+    total, categories = email_counters.totals()
     
     stats = {
         'accounts': len(accounts),
-        'emails': Email.query.count(),
-        'categories': {category: count for category, count in email_stats}
+        'emails': total,
+        'categories': categories
     }
     
     return render_template('index.html', stats=stats, accounts=accounts)
@@ -88,6 +92,7 @@ def delete_account(account_id):
     try:
         db.session.delete(account)
         db.session.commit()
+        email_archive.delete_account_files(account_id)
         flash('Account deleted successfully!', 'success')
     except Exception as e:
         logger.error(f"Delete error: {str(e)}")
@@ -109,17 +114,39 @@ def view_emails():
     if account_id:
         query = query.filter_by(account_id=account_id)
     
-    # Default to recent emails first
-    emails = query.order_by(Email.received_date.desc()).limit(100).all()
+    # Attachments are only counted, so fetch their ids for the whole page at once
+    query = query.options(db.selectinload(Email.attachments).load_only(Attachment.id))
+    
+    # Recent emails first, one page at a time
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
+    try:
+        emails, next_cursor, prev_cursor = paginate_emails(
+            query, after=request.args.get('after'), before=request.args.get('before'), per_page=per_page
+        )
+    except InvalidCursor:
+        flash('That page link is no longer valid; showing the newest emails.', 'warning')
+        return redirect(url_for('view_emails', category=category, account_id=account_id))
     
     accounts = EmailAccount.query.all()
-    return render_template('emails.html', emails=emails, accounts=accounts)
+    return render_template('emails.html', emails=emails, accounts=accounts,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor, per_page=per_page)
 
 @app.route('/emails/<int:email_id>')
 def view_email(email_id):
     """View a single email with details"""
-    email = Email.query.get_or_404(email_id)
-    return render_template('email_detail.html', email=email)
+    # The page shows the renderings made at ingest, not the raw HTML body
+    email = Email.query.options(
+        db.undefer(Email.body_text_z), db.undefer(Email._body_text),
+        db.undefer(Email.html_safe_z), db.undefer(Email._html_safe), db.undefer(Email.html_text_z), db.undefer(Email._html_text)
+    ).get_or_404(email_id)
+    
+    # Emails stored before the current sanitizer are re-rendered once, on first view
+    if render_email(email):
+        db.session.commit()
+    
+    conversation = thread_messages(email.thread_id) if email.thread_id else []
+    
+    return render_template('email_detail.html', email=email, conversation=conversation)
 
 @app.route('/emails/<int:email_id>/suggest-reply', methods=['GET'])
 def suggest_reply(email_id):
@@ -133,6 +160,28 @@ def suggest_reply(email_id):
         logger.error(f"Error generating reply: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/emails/<int:email_id>/suggest-reply/stream', methods=['GET'])
+def stream_suggest_reply(email_id):
+    """Stream an AI-generated reply suggestion as Server-Sent Events"""
+    email = Email.query.get_or_404(email_id)
+    
+    def events():
+        # Flush headers right away so the browser knows the stream is live
+        yield ": stream open\n\n"
+        try:
+            for fragment in ai_service.stream_reply_suggestion(email):
+                yield f"data: {json.dumps({'delta': fragment})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming reply: {str(e)}")
+            yield f"event: failed\ndata: {json.dumps({'error': str(e)})}\n\n"
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/search')
 def search_emails():
     """Search emails using Elasticsearch"""
@@ -155,7 +204,13 @@ def search_emails():
             search_options['filters']['category'] = category
         
         results = elasticsearch_service.search_emails(search_options)
-        emails = [Email.query.get(result['id']) for result in results]
+        
+        # Load all hits in one query, keeping the search ranking
+        found = Email.query.filter(Email.id.in_([result['id'] for result in results])).options(
+            db.selectinload(Email.attachments).load_only(Attachment.id)
+        ).all() if results else []
+        by_id = {email.id: email for email in found}
+        emails = [by_id[result['id']] for result in results if result['id'] in by_id]
         
         return render_template('search.html', 
                              emails=emails, 
@@ -175,13 +230,19 @@ def manage_webhooks():
     """View and manage webhooks"""
     if request.method == 'POST':
         try:
+            events = list(dict.fromkeys(event.strip() for event in request.form['events'].split(',') if event.strip()))
             webhook = Webhook(
                 name=request.form['name'],
                 url=request.form['url'],
-                events=request.form['events']
+                events=','.join(events),
+                subscriptions=[WebhookEvent(event=event) for event in events],
+                secret=request.form.get('secret') or None,
+                batch_size=request.form.get('batch_size', type=int),
+                batch_window=request.form.get('batch_window', 10, type=int)
             )
             db.session.add(webhook)
             db.session.commit()
+            integration_service.invalidate_routes()
             flash('Webhook added successfully!', 'success')
         except Exception as e:
             logger.error(f"Error adding webhook: {str(e)}")
@@ -214,6 +275,7 @@ def delete_webhook(webhook_id):
     try:
         db.session.delete(webhook)
         db.session.commit()
+        integration_service.invalidate_routes()
         flash('Webhook deleted successfully!', 'success')
     except Exception as e:
         logger.error(f"Delete error: {str(e)}")
@@ -222,8 +284,29 @@ def delete_webhook(webhook_id):
     
     return redirect(url_for('manage_webhooks'))
 
+# Change markers for conditional GETs: cheap aggregates that move whenever an
+# endpoint's output could. New emails raise max(id), edits raise
+# max(updated_at) and deletes lower the counter total.
+def email_list_marker():
+    newest_id, last_updated = db.session.query(db.func.max(Email.id), db.func.max(Email.updated_at)).one()
+    total, _ = email_counters.totals()
+    return newest_id, last_updated, total
+
+def email_marker(email_id):
+    return db.session.query(Email.updated_at).filter_by(id=email_id).scalar()
+
+def thread_list_marker():
+    # Threads only change when emails are stored, edited or deleted, or when they are rebuilt with new ids
+    return email_list_marker(), db.session.query(db.func.max(EmailThread.id)).scalar()
+
+def account_list_marker():
+    return db.session.query(
+        db.func.count(EmailAccount.id), db.func.max(EmailAccount.id), db.func.max(EmailAccount.updated_at)
+    ).one()
+
 # API routes
 @app.route('/api/emails', methods=['GET'])
+@conditional(email_list_marker)
 def api_get_emails():
     """API to get emails"""
     category = request.args.get('category')
@@ -235,9 +318,22 @@ def api_get_emails():
     if account_id:
         query = query.filter_by(account_id=account_id)
     
-    emails = query.order_by(Email.received_date.desc()).limit(100).all()
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
+    try:
+        emails, next_cursor, prev_cursor = paginate_emails(
+            query, after=request.args.get('after'), before=request.args.get('before'), per_page=per_page
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([{
+    # Cursors go in a Link header (rel="next"/"prev") so the body stays a plain list
+    links = []
+    if next_cursor:
+        links.append(f'<{url_for("api_get_emails", category=category, account_id=account_id, per_page=per_page, after=next_cursor, _external=True)}>; rel="next"')
+    if prev_cursor:
+        links.append(f'<{url_for("api_get_emails", category=category, account_id=account_id, per_page=per_page, before=prev_cursor, _external=True)}>; rel="prev"')
+    
+    response = jsonify([{
         'id': email.id,
         'subject': email.subject,
         'sender': email.sender,
@@ -245,16 +341,21 @@ def api_get_emails():
         'category': email.category,
         'folder': email.folder
     } for email in emails])
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    return response
 
 @app.route('/api/emails/<int:email_id>', methods=['GET'])
+@conditional(email_marker)
 def api_get_email(email_id):
     """API to get email details"""
-    email = Email.query.get_or_404(email_id)
+    email = Email.query.options(db.undefer_group('body')).get_or_404(email_id)
     
     return jsonify({
         'id': email.id,
         'account_id': email.account_id,
         'message_id': email.message_id,
+        'thread_id': email.thread_id,
         'folder': email.folder,
         'subject': email.subject,
         'sender': email.sender,
@@ -273,6 +374,263 @@ def api_get_email(email_id):
         } for att in email.attachments]
     })
 
+def thread_messages(thread_id):
+    """Get a thread's emails in conversation order, without their bodies"""
+    return Email.query.filter_by(thread_id=thread_id).order_by(Email.date, Email.id).all()
+
+def thread_summary(thread, latest=None):
+    return {
+        'id': thread.id,
+        'account_id': thread.account_id,
+        'subject': thread.subject,
+        'message_count': thread.message_count,
+        'first_date': thread.first_date.isoformat() if thread.first_date else None,
+        'last_date': thread.last_date.isoformat() if thread.last_date else None,
+        'latest': {
+            'id': latest.id,
+            'subject': latest.subject,
+            'sender': latest.sender,
+            'snippet': latest.snippet,
+            'category': latest.category
+        } if latest else None
+    }
+
+@app.route('/api/threads', methods=['GET'])
+@conditional(thread_list_marker)
+def api_get_threads():
+    """API to get threads, most recently active first, with their latest message"""
+    account_id = request.args.get('account_id')
+    query = EmailThread.query
+    if account_id:
+        query = query.filter_by(account_id=account_id)
+    
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
+    try:
+        threads, next_cursor, prev_cursor = paginate_threads(
+            query, after=request.args.get('after'), before=request.args.get('before'), per_page=per_page
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Latest messages in one query
+    latest_ids = [thread.last_email_id for thread in threads if thread.last_email_id]
+    latest = {email.id: email for email in Email.query.filter(Email.id.in_(latest_ids))} if latest_ids else {}
+    
+    links = []
+    if next_cursor:
+        links.append(f'<{url_for("api_get_threads", account_id=account_id, per_page=per_page, after=next_cursor, _external=True)}>; rel="next"')
+    if prev_cursor:
+        links.append(f'<{url_for("api_get_threads", account_id=account_id, per_page=per_page, before=prev_cursor, _external=True)}>; rel="prev"')
+    
+    response = jsonify([thread_summary(thread, latest.get(thread.last_email_id)) for thread in threads])
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    return response
+
+@app.route('/api/threads/<int:thread_id>', methods=['GET'])
+def api_get_thread(thread_id):
+    """API to get a conversation: the thread and its messages in order"""
+    thread = EmailThread.query.get_or_404(thread_id)
+    summary = thread_summary(thread)
+    summary['messages'] = [{
+        'id': email.id,
+        'message_id': email.message_id,
+        'in_reply_to': email.in_reply_to,
+        'subject': email.subject,
+        'sender': email.sender,
+        'date': email.date.isoformat() if email.date else None,
+        'snippet': email.snippet,
+        'category': email.category,
+        'folder': email.folder
+    } for email in thread_messages(thread.id)]
+    return jsonify(summary)
+
+# Fields /api/emails/batch can return: the columns to load for each, and how to serialize it
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+BATCH_EMAIL_FIELDS = {
+    'account_id': ([Email.account_id], lambda email: email.account_id),
+    'message_id': ([Email.message_id], lambda email: email.message_id),
+    'thread_id': ([Email.thread_id], lambda email: email.thread_id),
+    'folder': ([Email.folder], lambda email: email.folder),
+    'subject': ([Email.subject], lambda email: email.subject),
+    'sender': ([Email.sender], lambda email: email.sender),
+    'recipients': ([Email.recipients], lambda email: email.recipients),
+    'cc': ([Email.cc], lambda email: email.cc),
+    'snippet': ([Email.snippet], lambda email: email.snippet),
+    'body_text': ([Email.body_text_z, Email._body_text], lambda email: email.body_text),
+    'body_html': ([Email.body_html_z, Email._body_html], lambda email: email.body_html),
+    'date': ([Email.date], lambda email: _isoformat(email.date)),
+    'received_date': ([Email.received_date], lambda email: _isoformat(email.received_date)),
+    'category': ([Email.category], lambda email: email.category),
+    'flags': ([Email.flags], lambda email: email.flags),
+    'attachments': ([], lambda email: [{
+        'id': att.id,
+        'filename': att.filename,
+        'content_type': att.content_type,
+        'size': att.size
+    } for att in email.attachments]),
+}
+DEFAULT_BATCH_FIELDS = ['subject', 'sender', 'date', 'category', 'folder']
+MAX_BATCH_IDS = 1000
+
+@app.route('/api/emails/batch', methods=['POST'])
+def api_get_emails_batch():
+    """API to get many emails by id in one query, with only the requested fields"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    # A string would be iterated character by character
+    if not isinstance(data.get('ids'), list):
+        return jsonify({'error': 'ids must be a list of integers'}), 400
+    try:
+        ids = list(dict.fromkeys(int(email_id) for email_id in data['ids']))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ids must be a list of integers'}), 400
+    if not ids or len(ids) > MAX_BATCH_IDS:
+        return jsonify({'error': f'ids must list 1 to {MAX_BATCH_IDS} emails'}), 400
+    
+    fields = data.get('fields') or DEFAULT_BATCH_FIELDS
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        return jsonify({'error': 'fields must be a list of field names'}), 400
+    unknown = [field for field in fields if field not in BATCH_EMAIL_FIELDS]
+    if unknown:
+        return jsonify({'error': f'Unknown fields: {", ".join(unknown)}'}), 400
+    
+    # Load only the selected columns, bodies included only when asked for
+    columns = [column for field in fields for column in BATCH_EMAIL_FIELDS[field][0]]
+    options = [db.load_only(Email.id, *columns)]
+    if 'attachments' in fields:
+        options.append(db.selectinload(Email.attachments))
+    emails = {email.id: email for email in Email.query.options(*options).filter(Email.id.in_(ids))}
+    
+    return jsonify({
+        'emails': [
+            dict({'id': email_id}, **{field: BATCH_EMAIL_FIELDS[field][1](emails[email_id]) for field in fields})
+            for email_id in ids if email_id in emails
+        ],
+        'missing': [email_id for email_id in ids if email_id not in emails]
+    })
+
+@app.route('/api/categorize/batch', methods=['POST'])
+def api_categorize_batch():
+    """API to recategorize every email matching a filter set as a background job"""
+    data = request.get_json(silent=True) or {}
+    filters = data.get('filter')
+    if filters is None and data.get('ids'):
+        filters = {'ids': data['ids']}
+    if not filters:
+        return jsonify({'error': 'Provide a filter (or ids) selecting the emails to recategorize'}), 400
+    
+    try:
+        job = bulk_job_runner.submit_recategorize(filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    status_url = url_for('api_get_job', job_id=job.id, _external=True)
+    response = jsonify({'job_id': job.id, 'status': job.status, 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def api_get_job(job_id):
+    """API to get a bulk job's progress and its per-email results"""
+    job = BulkJob.query.get_or_404(job_id)
+    
+    # Results in email id order; pass `after` (an email id) for the next page
+    after = request.args.get('after', 0, type=int)
+    per_page = max(1, min(request.args.get('per_page', 1000, type=int), 10000))
+    items = BulkJobItem.query.filter(
+        BulkJobItem.job_id == job.id, BulkJobItem.email_id > after
+    ).order_by(BulkJobItem.email_id).limit(per_page + 1).all()
+    
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'succeeded': job.succeeded,
+        'failed': job.failed,
+        'error': job.error,
+        'created_at': _isoformat(job.created_at),
+        'started_at': _isoformat(job.started_at),
+        'finished_at': _isoformat(job.finished_at),
+        'results': [{
+            'email_id': item.email_id,
+            'status': item.status,
+            'old_category': item.old_value,
+            'new_category': item.new_value,
+            'error': item.error
+        } for item in items[:per_page]],
+        'next_after': items[per_page - 1].email_id if len(items) > per_page else None
+    })
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """API to stop a bulk job after its current chunk"""
+    job = BulkJob.query.get_or_404(job_id)
+    if not bulk_job_runner.cancel(job):
+        return jsonify({'success': False, 'error': f'Job already {job.status}'}), 409
+    return jsonify({'success': True, 'status': job.status})
+
+@app.route('/api/export', methods=['GET'])
+def api_export_emails():
+    """API to stream every email matching the filters as NDJSON (default) or mbox"""
+    export_format = request.args.get('format', 'ndjson')
+    filters = {name: request.args[name] for name in EXPORT_FILTERS if request.args.get(name)}
+    try:
+        chunks = export_emails(filters, export_format)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filename = f"emails-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+@app.route('/api/archive/search', methods=['GET'])
+def api_search_archive():
+    """API to search archived emails by text (q), account and received date range"""
+    try:
+        received_after = request.args.get('received_after')
+        received_before = request.args.get('received_before')
+        entries = email_archive.search(
+            request.args.get('q'),
+            account_id=request.args.get('account_id', type=int),
+            received_after=datetime.fromisoformat(received_after) if received_after else None,
+            received_before=datetime.fromisoformat(received_before) if received_before else None,
+            limit=clamp_per_page(request.args.get('limit', type=int))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify([{
+        'id': entry.id,
+        'account_id': entry.account_id,
+        'folder': entry.folder,
+        'subject': entry.subject,
+        'sender': entry.sender,
+        'date': _isoformat(entry.date),
+        'received_date': _isoformat(entry.received_date),
+        'category': entry.category
+    } for entry in entries])
+
+@app.route('/api/archive/<int:email_id>', methods=['GET'])
+def api_get_archived_email(email_id):
+    """API to get an archived email with its bodies"""
+    try:
+        email = email_archive.get_archived(email_id)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    if email is None:
+        return jsonify({'error': 'Archived email not found'}), 404
+    return jsonify(email)
+
 @app.route('/api/sync', methods=['POST'])
 def api_sync_all():
     """API to sync all accounts"""
@@ -284,6 +642,7 @@ def api_sync_all():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/accounts', methods=['GET'])
+@conditional(account_list_marker)
 def api_get_accounts():
     """API to get all accounts"""
     accounts = EmailAccount.query.all()
@@ -298,6 +657,33 @@ def api_get_accounts():
         'active': acc.active
     } for acc in accounts])
 
+@app.route('/api/ai/stats', methods=['GET'])
+def api_ai_stats():
+    """API to get categorization statistics (rule hits, etc.)"""
+    return jsonify(ai_service.get_stats())
+
+@app.route('/api/rag/documents', methods=['POST'])
+def api_ingest_documents():
+    """API to bulk-load documents into the RAG knowledge base"""
+    payload = request.get_json(silent=True) or {}
+    documents = payload.get('documents')
+    
+    if not isinstance(documents, list) or not documents:
+        return jsonify({'success': False, 'error': 'documents must be a non-empty list'}), 400
+    if not all(isinstance(document, dict) and isinstance(document.get('text'), str) for document in documents):
+        return jsonify({'success': False, 'error': 'each document must be an object with a text string'}), 400
+    
+    chunk_tokens = payload.get('chunk_tokens', 500)
+    overlap = payload.get('overlap', 50)
+    # bool is an int subclass, but true/false are not sizes
+    if not isinstance(chunk_tokens, int) or isinstance(chunk_tokens, bool) or chunk_tokens <= 0:
+        return jsonify({'success': False, 'error': 'chunk_tokens must be a positive integer'}), 400
+    if not isinstance(overlap, int) or isinstance(overlap, bool) or not 0 <= overlap < chunk_tokens:
+        return jsonify({'success': False, 'error': 'overlap must be an integer from 0 to chunk_tokens - 1'}), 400
+    
+    result = ai_service.ingest_documents(documents, chunk_tokens=chunk_tokens, overlap=overlap)
+    return jsonify(result), (200 if result.get('success') else 500)
+
 @app.route('/api/categorize/<int:email_id>', methods=['POST'])
 def api_categorize_email(email_id):
     """API to categorize an email using AI"""
@@ -305,14 +691,18 @@ def api_categorize_email(email_id):
     
     try:
         category = ai_service.categorize_email(email)
+        if category is None:
+            return jsonify({'success': False, 'error': 'Categorization failed, try again later'}), 503
         email.category = category
-        db.session.commit()
         
-        # Trigger webhooks for categorization event
+        # Queue webhooks for categorization event, saved with the category
         integration_service.trigger_webhooks('email.categorized', {
             'email_id': email.id,
             'category': category
         })
+        db.session.commit()
+        
+        ai_service.precompute_reply_drafts([email])
         
         return jsonify({'success': True, 'category': category})
     except Exception as e:
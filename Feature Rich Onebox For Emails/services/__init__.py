@@ -12,6 +12,7 @@ except ImportError as e:
     class ElasticsearchServiceMock:
         def initialize(self): return False
         def index_email(self, email): return False
+        def delete_emails(self, email_ids): return False
         def search_emails(self, options): return []
     elasticsearch_service = ElasticsearchServiceMock()
 
@@ -24,7 +25,12 @@ except ImportError as e:
     class AiServiceMock:
         def initialize(self): return False
         def categorize_email(self, email): return "uncategorized"
+        def categorize_emails(self, emails): return ["uncategorized" for _ in emails]
         def generate_reply_suggestion(self, email): return "Unable to generate reply. AI service not available."
+        def stream_reply_suggestion(self, email): raise RuntimeError("AI service not available")
+        def precompute_reply_drafts(self, emails): return 0
+        def get_stats(self): return {}
+        def ingest_documents(self, documents, **kwargs): return {"success": False, "error": "AI service not available"}
     ai_service = AiServiceMock()
 
 try:
@@ -35,9 +41,36 @@ except ImportError as e:
     # Create a simple mock service as fallback
     class IntegrationServiceMock:
         def trigger_webhooks(self, event, data): return []
+        def invalidate_routes(self): return None
+        def notify_new_emails(self, emails): return False
         def test_webhook(self, webhook): return {"success": False, "error": "Integration service not available"}
     integration_service = IntegrationServiceMock()
 
+try:
+    from services.webhook_dispatcher import WebhookDispatcher
+    webhook_dispatcher = WebhookDispatcher()
+except ImportError as e:
+    logger.warning(f"WebhookDispatcher could not be imported: {e}")
+    # Create a simple mock service as fallback
+    class WebhookDispatcherMock:
+        def start(self): return None
+        def stop(self): return None
+        def dispatch_pending(self): return 0
+        def get_stats(self): return {}
+    webhook_dispatcher = WebhookDispatcherMock()
+
+try:
+    from services.bulk_jobs import BulkJobRunner
+    bulk_job_runner = BulkJobRunner(ai_service, integration_service)
+except ImportError as e:
+    logger.warning(f"BulkJobRunner could not be imported: {e}")
+    # Create a simple mock service as fallback
+    class BulkJobRunnerMock:
+        def submit_recategorize(self, filters): raise RuntimeError("Bulk jobs not available")
+        def resume(self): return 0
+        def cancel(self, job): return False
+    bulk_job_runner = BulkJobRunnerMock()
+
 try:
     from services.imap_service import ImapService
     imap_service = ImapService(elasticsearch_service, ai_service, integration_service)
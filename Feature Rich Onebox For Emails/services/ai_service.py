@@ -1,13 +1,24 @@
-import json
 import logging
 import os
-import numpy as np
+import time
+import zlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from openai import OpenAI
-from models import VectorEntry, Email
-from app import db
+from models import VectorEntry, Email, ReplyDraft
+from app import app, db
+from services.llm_client import LlmClient
+from services.local_classifier import LocalClassifier
+from services.memo_cache import MemoCache
+from services.rule_engine import VALID_CATEGORIES, RuleEngine
+from services.text_processing import chunk_text, clean_email_body, content_hash, count_tokens, truncate_tokens
+from services.vector_store import VectorStore, pack_vector
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever _reply_messages changes so stored reply drafts are regenerated
+REPLY_PROMPT_VERSION = '2'
+
 class AiService:
     """Service for AI-powered email categorization, RAG, and reply suggestions"""
     
@@ -17,6 +28,36 @@ class AiService:
         self.model = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
         self.embedding_model = os.environ.get('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
         self.initialized = False
+        self.rule_engine = RuleEngine()
+        self.local_classifier = LocalClassifier()
+        self.memo_cache = MemoCache()
+        self.vector_store = VectorStore()
+        self.llm = LlmClient()
+        self.context_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rag-context')
+        # Streamed replies start without RAG context rather than wait longer than
+        # this; enough for an embedding round trip plus the vector search
+        self.context_timeout = float(os.environ.get('RAG_CONTEXT_TIMEOUT', '2'))
+        self.context_lookups = 0
+        self.context_timeouts = 0
+        # Row count of the RAG store as of the last _rag_version() recount
+        self.rag_count = None
+        self.rag_count_max_id = None
+        self.rag_counted_at = 0
+        self.local_hits = 0
+        self.local_escalations = 0
+        # Categories whose reply drafts are generated right after categorization
+        self.draft_categories = {
+            category.strip()
+            for category in os.environ.get('REPLY_PRECOMPUTE_CATEGORIES', 'interested,meeting_booked').split(',')
+            if category.strip()
+        }
+        self.draft_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='reply-drafts')
+        # Maximum email body tokens sent for each task
+        self.token_budgets = {
+            'categorize': int(os.environ.get('PROMPT_TOKENS_CATEGORIZE', '500')),
+            'reply': int(os.environ.get('PROMPT_TOKENS_REPLY', '1500')),
+            'embedding': int(os.environ.get('PROMPT_TOKENS_EMBEDDING', '1000'))
+        }
         
     def initialize(self):
         """Initialize OpenAI client"""
@@ -28,7 +69,8 @@ class AiService:
                 logger.warning("OpenAI API key not found in environment")
                 return False
                 
-            self.client = OpenAI(api_key=self.api_key)
+            # Retries are handled by LlmClient so they respect the shared rate budget
+            self.client = OpenAI(api_key=self.api_key, max_retries=0)
             self.initialized = True
             logger.info("OpenAI client initialized")
             return True
@@ -45,25 +87,122 @@ class AiService:
         - meeting_booked: Has booked or wants to book a meeting
         - spam: Unsolicited or irrelevant
         - out_of_office: Automated out of office reply
+        
+        Header/pattern rules are checked first, then the local classifier; the
+        LLM is only called when neither is confident. Sets email.category_source
+        to record which stage decided. Returns None if the LLM call failed.
+        """
+        return self.categorize_emails([email])[0]
+    
+    def categorize_emails(self, emails):
+        """Categorize many emails, running the needed LLM calls concurrently
+        
+        Returns the categories in the same order as emails, with None for
+        emails whose LLM call failed (so callers keep the old category and
+        can retry). Without an OpenAI API key the LLM stage is skipped and
+        those emails are "uncategorized".
         """
+        categories = [None] * len(emails)
+        memo_keys = {}
+        
+        # Cheap stages run inline; only what's left goes to the LLM
+        for i, email in enumerate(emails):
+            categories[i], memo_keys[i] = self._categorize_without_llm(email)
+        
+        pending = [i for i, category in enumerate(categories) if category is None]
+        if not pending:
+            return categories
+        
         if not self.initialized:
             self.initialize()
             
         if not self.initialized:
             logger.error("Cannot categorize email: OpenAI not initialized")
-            return "uncategorized"
-            
-        try:
-            # Prepare email content for analysis
-            email_content = f"""
+            # A missing key won't fix itself; a failed initialization may
+            for i in pending:
+                categories[i] = "uncategorized" if not self.api_key else None
+            return categories
+        
+        futures = {}
+        for i in pending:
+            messages = self._categorization_messages(emails[i])
+            futures[i] = self.llm.submit(
+                'bulk',
+                self.client.chat.completions.create,
+                estimated_tokens=count_tokens(messages[-1]["content"]) + 20,
+                model=self.model,
+                messages=messages,
+                temperature=0.0,  # Use deterministic output
+                max_tokens=20     # We only need a short response
+            )
+        
+        for i, future in futures.items():
+            email = emails[i]
+            try:
+                response = future.result()
+                
+                # Extract category from response
+                category = response.choices[0].message.content.strip().lower()
+                
+                # Validate category
+                if category not in VALID_CATEGORIES:
+                    logger.warning(f"Invalid category returned: {category}")
+                    # Default to uncategorized if the AI returns an invalid category
+                    categories[i] = "uncategorized"
+                    continue
+                    
+                logger.info(f"Categorized email {email.id} as '{category}'")
+                email.category_source = 'llm'
+                self.memo_cache.put('category', memo_keys[i], category)
+                categories[i] = category
+                
+            except Exception as e:
+                logger.error(f"Error categorizing email {email.id}: {str(e)}")
+        
+        return categories
+    
+    def _categorize_without_llm(self, email):
+        """Try rules, the local classifier and the memo cache
+        
+        Returns (category or None, memo cache key).
+        """
+        rule = self.rule_engine.match(email)
+        if rule:
+            logger.info(f"Categorized email {email.id} as '{rule.category}' by rule '{rule.name}'")
+            email.category_source = 'rule'
+            return rule.category, None
+        
+        category, confidence = self.local_classifier.classify(email)
+        if category:
+            self.local_hits += 1
+            logger.info(f"Categorized email {email.id} as '{category}' locally ({confidence:.2f})")
+            email.category_source = 'local'
+            return category, None
+        if self.local_classifier.trained:
+            self.local_escalations += 1
+        
+        # Identical content was already categorized by the LLM
+        memo_key = self.memo_cache.make_key('category', self.model, email.subject, self.prompt_text(email, 'categorize'))
+        category = self.memo_cache.get('category', memo_key)
+        if category:
+            logger.info(f"Categorized email {email.id} as '{category}' from memo cache")
+            email.category_source = 'llm'
+            return category, memo_key
+        
+        return None, memo_key
+    
+    def _categorization_messages(self, email):
+        """Build the chat messages for categorizing an email"""
+        # Prepare email content for analysis
+        email_content = f"""
             Subject: {email.subject}
             From: {email.sender}
             
-            {email.body_text or ''}
+            {self.prompt_text(email, 'categorize')}
             """
-            
-            # Create prompt for categorization
-            prompt = f"""
+        
+        # Create prompt for categorization
+        prompt = f"""
             Categorize the following email into exactly one of these categories:
             - interested: Shows genuine interest in the product/service
             - not_interested: Clearly not interested
@@ -76,37 +215,40 @@ class AiService:
             
             Category (return only the category name):
             """
-            
-            # Call OpenAI API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an email categorization assistant. Categorize the email into exactly one category."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.0,  # Use deterministic output
-                max_tokens=20     # We only need a short response
-            )
-            
-            # Extract category from response
-            category = response.choices[0].message.content.strip().lower()
-            
-            # Validate category
-            valid_categories = ['interested', 'not_interested', 'meeting_booked', 'spam', 'out_of_office']
-            if category not in valid_categories:
-                logger.warning(f"Invalid category returned: {category}")
-                # Default to uncategorized if the AI returns an invalid category
-                return "uncategorized"
-                
-            logger.info(f"Categorized email {email.id} as '{category}'")
-            return category
-            
-        except Exception as e:
-            logger.error(f"Error categorizing email: {str(e)}")
-            return "uncategorized"
+        
+        return [
+            {"role": "system", "content": "You are an email categorization assistant. Categorize the email into exactly one category."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def get_stats(self):
+        """Get categorization statistics"""
+        return {
+            "rules": self.rule_engine.get_stats(),
+            "local_classifier": {
+                "trained": self.local_classifier.trained,
+                "threshold": self.local_classifier.threshold,
+                "hits": self.local_hits,
+                "escalations": self.local_escalations
+            },
+            "memo_cache": self.memo_cache.get_stats(),
+            "rag_context": {
+                "timeout": self.context_timeout,
+                "lookups": self.context_lookups,
+                "timeouts": self.context_timeouts
+            },
+            "llm": self.llm.get_stats()
+        }
     
     def generate_reply_suggestion(self, email):
-        """Generate an AI-powered reply suggestion for an email"""
+        """Generate an AI-powered reply suggestion for an email
+        
+        A valid precomputed draft is returned without calling the API.
+        """
+        draft = self.get_reply_draft(email)
+        if draft:
+            return draft
+        
         if not self.initialized:
             self.initialize()
             
@@ -115,57 +257,201 @@ class AiService:
             return "Unable to generate reply suggestion. OpenAI API not available."
             
         try:
-            # Get email context
-            email_content = f"""
+            return self._generate_reply(email, 'interactive')
+            
+        except Exception as e:
+            logger.error(f"Error generating reply: {str(e)}")
+            return "Unable to generate reply suggestion. Error occurred."
+    
+    def _generate_reply(self, email, lane):
+        """Run the RAG lookup and reply completion on the given lane"""
+        # Get relevant context from vector store if available
+        context_texts = self._find_similar_texts(self.prompt_text(email, 'embedding'), limit=3, lane=lane)
+        messages = self._reply_messages(email, context_texts)
+        
+        # Call OpenAI API
+        response = self.llm.call(
+            lane,
+            self.client.chat.completions.create,
+            estimated_tokens=count_tokens(messages[-1]["content"]) + 500,
+            model=self.model,
+            messages=messages,
+            temperature=0.7,  # Some creativity
+            max_tokens=500    # Reasonably sized email
+        )
+        
+        # Extract reply from response
+        return response.choices[0].message.content.strip()
+    
+    def stream_reply_suggestion(self, email):
+        """Generate a reply suggestion, yielding text fragments as they arrive
+        
+        A valid precomputed draft is yielded whole. Otherwise the RAG context
+        lookup runs in the background while the request is set up; if it
+        takes longer than RAG_CONTEXT_TIMEOUT the reply starts without context
+        so the first token isn't held up.
+        """
+        draft = self.get_reply_draft(email)
+        if draft:
+            yield draft
+            return
+        
+        if not self.initialized:
+            self.initialize()
+            
+        if not self.initialized:
+            raise RuntimeError("OpenAI API not available")
+        
+        context_future = self.context_executor.submit(self._find_similar_texts_in_context, self.prompt_text(email, 'embedding'), 3)
+        
+        self.context_lookups += 1
+        try:
+            context_texts = context_future.result(timeout=self.context_timeout)
+        except TimeoutError:
+            self.context_timeouts += 1
+            logger.warning(f"RAG context lookup exceeded {self.context_timeout}s, streaming reply without it "
+                           f"({self.context_timeouts} of {self.context_lookups} lookups timed out)")
+            context_texts = []
+        
+        messages = self._reply_messages(email, context_texts)
+        stream = self.llm.call(
+            'interactive',
+            self.client.chat.completions.create,
+            estimated_tokens=count_tokens(messages[-1]["content"]) + 500,
+            model=self.model,
+            messages=messages,
+            temperature=0.7,  # Some creativity
+            max_tokens=500,   # Reasonably sized email
+            stream=True
+        )
+        
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def precompute_reply_drafts(self, emails):
+        """Generate reply drafts in the background for emails in draft categories
+        
+        Returns the number of drafts scheduled.
+        """
+        email_ids = [email.id for email in emails if email.category in self.draft_categories]
+        for email_id in email_ids:
+            self.draft_executor.submit(self._precompute_reply_draft, email_id)
+        return len(email_ids)
+    
+    def _precompute_reply_draft(self, email_id):
+        """Generate and store the reply draft for one email (runs on draft_executor)"""
+        with app.app_context():
+            try:
+                email = db.session.get(Email, email_id)
+                if not email or email.category not in self.draft_categories or self.get_reply_draft(email):
+                    return
+                
+                if not self.initialized:
+                    self.initialize()
+                    
+                if not self.initialized:
+                    return
+                
+                # Read the RAG version before generating so a concurrent ingest marks the draft stale
+                rag_version = self._rag_version()
+                text = self._generate_reply(email, 'bulk')
+                
+                draft = email.reply_draft or ReplyDraft(email_id=email.id)
+                draft.text = text
+                draft.prompt_version = REPLY_PROMPT_VERSION
+                draft.rag_version = rag_version
+                draft.created_at = datetime.utcnow()
+                db.session.add(draft)
+                db.session.commit()
+                
+                logger.info(f"Stored reply draft for email {email_id}")
+                
+            except Exception as e:
+                logger.error(f"Error precomputing reply draft for email {email_id}: {str(e)}")
+                db.session.rollback()
+    
+    def get_reply_draft(self, email):
+        """Get the stored reply draft for an email if it is still valid
+        
+        Drafts are stale once the reply prompt version changes or RAG entries
+        have been added, replaced or deleted since they were generated.
+        """
+        try:
+            draft = email.reply_draft
+            if not draft or draft.prompt_version != REPLY_PROMPT_VERSION or draft.rag_version != self._rag_version():
+                return None
+            return draft.text
+        except Exception as e:
+            logger.error(f"Error loading reply draft: {str(e)}")
+            return None
+    
+    def _rag_version(self):
+        """Cheap marker that changes whenever RAG entries are added, replaced or deleted
+        
+        max(id) moves with every insert and the row count with deletes.
+        Counting is much slower, so without inserts deletions are only
+        noticed after the vector store's recount interval.
+        """
+        max_id = db.session.query(db.func.max(VectorEntry.id)).scalar() or 0
+        if (max_id != self.rag_count_max_id
+                or time.monotonic() - self.rag_counted_at > self.vector_store.recount_interval):
+            self.rag_count = db.session.query(db.func.count(VectorEntry.id)).scalar()
+            self.rag_count_max_id = max_id
+            self.rag_counted_at = time.monotonic()
+        # Fits the integer rag_version column
+        return zlib.crc32(f"{max_id}:{self.rag_count}".encode('utf-8')) & 0x7fffffff
+    
+    def prompt_text(self, email, task):
+        """Get an email's body trimmed for an LLM task
+        
+        Quoted history, signatures and disclaimers are stripped once and cached
+        in email.body_clean (saved with the session's next commit), then the
+        text is cut to the task's token budget.
+        """
+        if email.body_clean is None and email.body_text:
+            email.body_clean = clean_email_body(email.body_text)
+        
+        # Fall back to the raw body if it was nothing but quotes and boilerplate
+        text = email.body_clean or (email.body_text or '').strip()
+        return truncate_tokens(text, self.token_budgets[task])
+    
+    def _reply_messages(self, email, context_texts):
+        """Build the chat messages for drafting a reply"""
+        # Get email context
+        email_content = f"""
             Subject: {email.subject}
             From: {email.sender}
             
-            {email.body_text or ''}
+            {self.prompt_text(email, 'reply')}
             """
-            
-            # Get relevant context from vector store if available
-            context_texts = self._find_similar_texts(email.body_text or '', limit=3)
-            context = "\n\n".join(context_texts) if context_texts else ""
-            
-            # Create prompt for reply generation
-            prompt = f"""
+        
+        context = "\n\n".join(context_texts) if context_texts else ""
+        
+        # Create prompt for reply generation
+        prompt = f"""
             Here is an email I've received:
             
             {email_content}
             
             """
-            
-            if context:
-                prompt += f"""
+        
+        if context:
+            prompt += f"""
                 Here is some additional context that might be relevant:
                 
                 {context}
                 
                 """
-                
-            prompt += """
+            
+        prompt += """
             Please draft a professional, helpful, and concise reply to this email.
             """
-            
-            # Call OpenAI API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an email assistant. Draft professional, helpful, and concise replies."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,  # Some creativity
-                max_tokens=500    # Reasonably sized email
-            )
-            
-            # Extract reply from response
-            reply = response.choices[0].message.content.strip()
-            
-            return reply
-            
-        except Exception as e:
-            logger.error(f"Error generating reply: {str(e)}")
-            return "Unable to generate reply suggestion. Error occurred."
+        
+        return [
+            {"role": "system", "content": "You are an email assistant. Draft professional, helpful, and concise replies."},
+            {"role": "user", "content": prompt}
+        ]
     
     def store_text_for_rag(self, text, description=None):
         """Store text in vector database for RAG"""
@@ -178,7 +464,7 @@ class AiService:
             
         try:
             # Generate embedding for text
-            embedding = self._get_embedding(text)
+            embedding = self._get_embedding(text, 'bulk')
             
             if not embedding:
                 return False
@@ -186,13 +472,17 @@ class AiService:
             # Store in database
             vector_entry = VectorEntry(
                 text=text,
-                embedding=json.dumps(embedding),
+                vector=pack_vector(embedding),
+                content_hash=content_hash(text),
                 description=description
             )
             
             db.session.add(vector_entry)
             db.session.commit()
             
+            # Pull the new row (and any added by other workers) into the matrix
+            self.vector_store.refresh()
+            
             logger.info(f"Stored text in vector database: {description or 'Unknown'}")
             return True
             
@@ -201,21 +491,127 @@ class AiService:
             db.session.rollback()
             return False
     
-    def _get_embedding(self, text):
-        """Get embedding vector for text"""
+    def ingest_documents(self, documents, chunk_tokens=500, overlap=50, batch_size=256):
+        """Bulk-load documents into the vector database for RAG
+        
+        Each document is a dict with 'text' and optional 'description'. Documents
+        are split into overlapping token-bounded chunks, chunks already stored
+        (by content hash) are skipped, the rest are embedded batch_size inputs
+        per API call, and all rows are written in a single transaction.
+        """
+        if not self.initialized:
+            self.initialize()
+            
+        if not self.initialized:
+            logger.error("Cannot ingest documents: OpenAI not initialized")
+            return {"success": False, "error": "OpenAI API not available"}
+            
+        try:
+            # Chunk everything up front, dropping duplicates within the upload
+            chunks = {}
+            for document in documents:
+                for chunk in chunk_text(document.get('text', ''), chunk_tokens, overlap):
+                    chunks.setdefault(content_hash(chunk), (chunk, document.get('description')))
+            
+            # Skip chunks that are already stored
+            hashes = list(chunks)
+            existing = set()
+            for start in range(0, len(hashes), 1000):
+                existing.update(row[0] for row in db.session.query(VectorEntry.content_hash).filter(
+                    VectorEntry.content_hash.in_(hashes[start:start + 1000])
+                ))
+            pending = [(chunk_hash, *chunks[chunk_hash]) for chunk_hash in hashes if chunk_hash not in existing]
+            
+            # Embed in batches, several requests in flight on the bulk lane
+            batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+            futures = [self._submit_embeddings([text for _, text, _ in batch]) for batch in batches]
+            
+            rows = []
+            for batch, future in zip(batches, futures):
+                embeddings = self._embeddings_result(future)
+                if embeddings is None:
+                    return {"success": False, "error": "Embedding request failed", "stored": 0}
+                    
+                for (chunk_hash, text, description), embedding in zip(batch, embeddings):
+                    rows.append({
+                        "text": text,
+                        "vector": pack_vector(embedding),
+                        "content_hash": chunk_hash,
+                        "description": description
+                    })
+            
+            if rows:
+                db.session.execute(VectorEntry.__table__.insert(), rows)
+            db.session.commit()
+            
+            self.vector_store.refresh()
+            
+            logger.info(f"Ingested {len(documents)} documents: {len(rows)} chunks stored, {len(existing)} already present")
+            return {
+                "success": True,
+                "documents": len(documents),
+                "chunks": len(chunks),
+                "skipped": len(existing),
+                "stored": len(rows)
+            }
+            
+        except Exception as e:
+            logger.error(f"Error ingesting documents: {str(e)}")
+            db.session.rollback()
+            return {"success": False, "error": str(e), "stored": 0}
+    
+    def _submit_embeddings(self, texts):
+        """Schedule one embeddings call for many texts on the bulk lane"""
+        return self.llm.submit(
+            'bulk',
+            self.client.embeddings.create,
+            estimated_tokens=sum(count_tokens(text) for text in texts),
+            model=self.embedding_model,
+            input=texts
+        )
+    
+    def _embeddings_result(self, future):
+        """Wait for a batched embeddings call, returning vectors in input order"""
         try:
-            response = self.client.embeddings.create(
+            response = future.result()
+            
+            # The API may return items out of order; index says which input each belongs to
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            
+        except Exception as e:
+            logger.error(f"Error getting embeddings: {str(e)}")
+            return None
+    
+    def _get_embedding(self, text, lane='interactive'):
+        """Get embedding vector for text, calling the API on the given lane"""
+        memo_key = self.memo_cache.make_key('embedding', self.embedding_model, text)
+        embedding = self.memo_cache.get('embedding', memo_key)
+        if embedding:
+            return embedding
+        
+        try:
+            response = self.llm.call(
+                lane,
+                self.client.embeddings.create,
+                estimated_tokens=count_tokens(text),
                 model=self.embedding_model,
                 input=text
             )
             
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            self.memo_cache.put('embedding', memo_key, embedding)
+            return embedding
             
         except Exception as e:
             logger.error(f"Error getting embedding: {str(e)}")
             return None
     
-    def _find_similar_texts(self, query, limit=3):
+    def _find_similar_texts_in_context(self, query, limit=3):
+        """Run _find_similar_texts from a worker thread"""
+        with app.app_context():
+            return self._find_similar_texts(query, limit)
+    
+    def _find_similar_texts(self, query, limit=3, lane='interactive'):
         """Find similar texts in vector database"""
         if not self.initialized:
             self.initialize()
@@ -225,50 +621,22 @@ class AiService:
             
         try:
             # Get embedding for query
-            query_embedding = self._get_embedding(query)
+            query_embedding = self._get_embedding(query, lane)
             
             if not query_embedding:
                 return []
                 
-            # Get all vectors from database
-            vector_entries = VectorEntry.query.all()
+            matches = self.vector_store.search(query_embedding, limit=limit)
             
-            if not vector_entries:
+            if not matches:
                 return []
                 
-            # Calculate similarity
-            results = []
-            for entry in vector_entries:
-                # Parse stored embedding
-                entry_embedding = json.loads(entry.embedding)
-                
-                # Calculate cosine similarity
-                similarity = self._cosine_similarity(query_embedding, entry_embedding)
-                
-                results.append((entry, similarity))
-                
-            # Sort by similarity (highest first)
-            results.sort(key=lambda x: x[1], reverse=True)
+            # Fetch texts for the matches, keeping similarity order
+            entries = VectorEntry.query.filter(VectorEntry.id.in_([entry_id for entry_id, _ in matches])).all()
+            texts = {entry.id: entry.text for entry in entries}
             
-            # Return most similar texts
-            return [entry.text for entry, _ in results[:limit]]
+            return [texts[entry_id] for entry_id, _ in matches if entry_id in texts]
             
         except Exception as e:
             logger.error(f"Error finding similar texts: {str(e)}")
-            return []
-    
-    def _cosine_similarity(self, vec1, vec2):
-        """Calculate cosine similarity between two vectors"""
-        try:
-            vec1 = np.array(vec1)
-            vec2 = np.array(vec2)
-            
-            dot_product = np.dot(vec1, vec2)
-            norm1 = np.linalg.norm(vec1)
-            norm2 = np.linalg.norm(vec2)
-            
-            return dot_product / (norm1 * norm2)
-            
-        except Exception as e:
-            logger.error(f"Error calculating similarity: {str(e)}")
-            return 0.0
\ No newline at end of file
+            return []
\ No newline at end of file
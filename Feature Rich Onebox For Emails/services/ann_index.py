@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def kmeans(vectors, k, iterations=10, seed=0, spherical=False):
+    """Plain NumPy k-means (Lloyd's algorithm)
+
+    With spherical=True vectors and centroids are unit length and assignment
+    uses the inner product, which matches cosine similarity search.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids, spherical)
+
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+
+        # Sum members per cluster with one sorted reduceat instead of np.add.at
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], starts[~empty], axis=0)
+
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        # Reseed empty clusters from random points
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+
+        if spherical:
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+def assign(vectors, centroids, spherical=False, batch_size=8192):
+    """Assign each vector to its nearest centroid"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    centroid_norms = None if spherical else (centroids ** 2).sum(axis=1)
+
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        scores = batch @ centroids.T
+        if not spherical:
+            # argmin |x - c|^2 == argmax 2x.c - |c|^2
+            scores = 2 * scores - centroid_norms
+        assignments[start:start + batch_size] = scores.argmax(axis=1)
+
+    return assignments
+
+
+class IvfPqIndex:
+    """Inverted-file index with product quantization for inner-product search
+
+    Vectors must be unit length so the inner product is cosine similarity.
+    Each vector is assigned to one of `nlist` coarse clusters and its residual
+    is compressed to `m` one-byte codes. A query scans only the `nprobe`
+    closest clusters using per-query lookup tables, then optionally reranks
+    the best `rerank` candidates with exact vectors.
+
+    Persisted indexes are a directory of .npy files that can be memory-mapped,
+    so loading a multi-million entry index costs almost nothing. Vectors added
+    after loading are kept in an in-memory delta until the next save.
+    """
+
+    def __init__(self, dim, nlist=1024, m=16, nprobe=16, rerank=64):
+        if dim % m:
+            raise ValueError(f"Dimension {dim} is not divisible by m={m}")
+
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.last_id = 0
+
+        self.centroids = None  # (nlist, dim)
+        self.codebooks = None  # (m, 256, dim / m)
+
+        # Sealed entries, sorted by list; entries of list l are offsets[l]:offsets[l + 1]
+        self.ids = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, m), dtype=np.uint8)
+        self.offsets = np.zeros(nlist + 1, dtype=np.int64)
+
+        # Entries added since the index was loaded or saved
+        self.delta_ids = []
+        self.delta_lists = []
+        self.delta_codes = []
+        self._delta_cache = None
+        self._lock = threading.Lock()
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self.ids) + sum(len(ids) for ids in self.delta_ids)
+
+    def train(self, vectors, iterations=10, seed=0):
+        """Learn coarse centroids and PQ codebooks from a sample of vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.centroids = kmeans(vectors, self.nlist, iterations, seed, spherical=True)
+        self.nlist = len(self.centroids)
+        self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+
+        residuals = vectors - self.centroids[assign(vectors, self.centroids, spherical=True)]
+        dsub = self.dim // self.m
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j * dsub:(j + 1) * dsub], 256, iterations, seed + j)
+            for j in range(self.m)
+        ])
+
+        logger.info(f"Trained IVF-PQ index on {len(vectors)} vectors (nlist={self.nlist}, m={self.m})")
+
+    def add(self, ids, vectors):
+        """Add vectors to the index"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+
+        lists = assign(vectors, self.centroids, spherical=True)
+        codes = self._encode(vectors - self.centroids[lists])
+
+        with self._lock:
+            self.delta_ids.append(ids)
+            self.delta_lists.append(lists)
+            self.delta_codes.append(codes)
+            self._delta_cache = None
+            self.last_id = max(self.last_id, int(ids.max()))
+
+    def search(self, query, k=3, nprobe=None, rerank=None, fetch_vectors=None):
+        """Find the approximate k most similar vectors
+
+        fetch_vectors, if given, maps a list of ids to an (n, dim) array of
+        their exact vectors and is used to rerank the best candidates.
+        Returns (ids, scores), most similar first.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        rerank = self.rerank if rerank is None else rerank
+        query = np.asarray(query, dtype=np.float32)
+
+        coarse = self.centroids @ query
+        probes = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        # Inner product with a residual is a sum of per-subspace lookups
+        dsub = self.dim // self.m
+        tables = np.einsum('jcd,jd->jc', self.codebooks, query.reshape(self.m, dsub))
+
+        candidate_ids, candidate_scores = [], []
+        for probe in probes:
+            start, end = self.offsets[probe], self.offsets[probe + 1]
+            if end > start:
+                candidate_ids.append(self.ids[start:end])
+                candidate_scores.append(coarse[probe] + self._lookup(tables, self.codes[start:end]))
+
+        delta_ids, delta_lists, delta_codes = self._delta()
+        if len(delta_ids):
+            mask = np.isin(delta_lists, probes)
+            candidate_ids.append(delta_ids[mask])
+            candidate_scores.append(coarse[delta_lists[mask]] + self._lookup(tables, delta_codes[mask]))
+
+        ids = np.concatenate(candidate_ids) if candidate_ids else np.empty(0, dtype=np.int64)
+        scores = np.concatenate(candidate_scores) if candidate_scores else np.empty(0, dtype=np.float32)
+        if not len(ids):
+            return ids, scores
+
+        shortlist = min(max(k, rerank), len(ids))
+        top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+        ids, scores = ids[top], scores[top]
+
+        if rerank and fetch_vectors is not None:
+            scores = np.asarray(fetch_vectors(ids), dtype=np.float32) @ query
+
+        order = np.argsort(-scores)[:k]
+        return ids[order], scores[order]
+
+    def save(self, directory):
+        """Merge the delta into the sealed entries and write the index to disk"""
+        with self._lock:
+            delta_ids, delta_lists, delta_codes = self._delta()
+
+            sealed_lists = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+            lists = np.concatenate([sealed_lists, delta_lists])
+            order = np.argsort(lists, kind='stable')
+
+            ids = np.concatenate([self.ids, delta_ids])[order]
+            codes = np.concatenate([self.codes, delta_codes])[order]
+            offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(lists, minlength=self.nlist))
+
+            # Write to a sibling directory and swap it in, so readers never see a partial index
+            tmp_directory = f"{directory}.tmp"
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            os.makedirs(tmp_directory)
+
+            np.save(os.path.join(tmp_directory, 'centroids.npy'), self.centroids)
+            np.save(os.path.join(tmp_directory, 'codebooks.npy'), self.codebooks)
+            np.save(os.path.join(tmp_directory, 'ids.npy'), ids)
+            np.save(os.path.join(tmp_directory, 'codes.npy'), codes)
+            np.save(os.path.join(tmp_directory, 'offsets.npy'), offsets)
+            with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+                json.dump({
+                    "dim": self.dim,
+                    "nlist": self.nlist,
+                    "m": self.m,
+                    "nprobe": self.nprobe,
+                    "rerank": self.rerank,
+                    "last_id": self.last_id
+                }, f)
+
+            old_directory = f"{directory}.old"
+            shutil.rmtree(old_directory, ignore_errors=True)
+            if os.path.exists(directory):
+                os.replace(directory, old_directory)
+            os.replace(tmp_directory, directory)
+            shutil.rmtree(old_directory, ignore_errors=True)
+
+            self.ids, self.codes, self.offsets = ids, codes, offsets
+            self.delta_ids, self.delta_lists, self.delta_codes = [], [], []
+            self._delta_cache = None
+
+        logger.info(f"Saved IVF-PQ index with {len(ids)} entries to {directory}")
+
+    @classmethod
+    def load(cls, directory, mmap=True, nprobe=None, rerank=None):
+        """Load an index from disk, memory-mapping the large arrays by default"""
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+
+        index = cls(
+            dim=meta['dim'],
+            nlist=meta['nlist'],
+            m=meta['m'],
+            nprobe=nprobe or meta['nprobe'],
+            rerank=meta['rerank'] if rerank is None else rerank
+        )
+        mmap_mode = 'r' if mmap else None
+
+        index.last_id = meta['last_id']
+        index.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        index.codebooks = np.load(os.path.join(directory, 'codebooks.npy'))
+        index.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode)
+        index.codes = np.load(os.path.join(directory, 'codes.npy'), mmap_mode=mmap_mode)
+        index.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+
+        logger.info(f"Loaded IVF-PQ index with {len(index.ids)} entries from {directory}")
+        return index
+
+    def _encode(self, residuals):
+        dsub = self.dim // self.m
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign(residuals[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+        return codes
+
+    def _lookup(self, tables, codes):
+        return tables[np.arange(self.m), codes].sum(axis=1)
+
+    def _delta(self):
+        """Get the delta as flat arrays"""
+        cache = self._delta_cache
+        if cache is None:
+            if self.delta_ids:
+                cache = (np.concatenate(self.delta_ids), np.concatenate(self.delta_lists), np.concatenate(self.delta_codes))
+            else:
+                cache = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, self.m), dtype=np.uint8))
+            self._delta_cache = cache
+        return cache
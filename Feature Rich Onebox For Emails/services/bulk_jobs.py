@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app import app, db
+from models import BulkJob, BulkJobItem, Email
+
+logger = logging.getLogger(__name__)
+
+# Filters a bulk job or export (see email_export) can select emails by
+JOB_FILTERS = ('ids', 'account_id', 'folder', 'category', 'received_after', 'received_before')
+MAX_FILTER_IDS = 10000
+
+
+def email_query(filters):
+    """Build the query for a filter set (see JOB_FILTERS), raising ValueError if it is invalid"""
+    if not isinstance(filters, dict):
+        raise ValueError("filter must be an object")
+    unknown = set(filters) - set(JOB_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    query = Email.query
+    try:
+        if 'ids' in filters:
+            ids = [int(email_id) for email_id in filters['ids']]
+            if not ids or len(ids) > MAX_FILTER_IDS:
+                raise ValueError(f"ids must list 1 to {MAX_FILTER_IDS} emails")
+            query = query.filter(Email.id.in_(ids))
+        if filters.get('account_id') is not None:
+            query = query.filter(Email.account_id == int(filters['account_id']))
+        if filters.get('folder'):
+            query = query.filter(Email.folder == filters['folder'])
+        if filters.get('category'):
+            # Emails that were never categorized have no category at all
+            if filters['category'] == 'uncategorized':
+                query = query.filter(db.or_(Email.category.is_(None), Email.category == 'uncategorized'))
+            else:
+                query = query.filter(Email.category == filters['category'])
+        if filters.get('received_after'):
+            query = query.filter(Email.received_date >= datetime.fromisoformat(filters['received_after']))
+        if filters.get('received_before'):
+            query = query.filter(Email.received_date < datetime.fromisoformat(filters['received_before']))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid filter: {str(e)}") from e
+    return query
+
+
+class BulkJobRunner:
+    """Background jobs over many emails
+
+    A job selects emails with a filter set and works through them in id order,
+    CHUNK_SIZE at a time: each chunk is categorized with one batched
+    categorize_emails() call (rules, local model and memo cache first, the
+    rest as concurrent LLM calls) and committed together with its per-email
+    results and the job's progress marker. Jobs run one at a time, survive
+    restarts via resume(), and can be cancelled between chunks.
+
+    Every process may resume() the same jobs: a runner first claims a job
+    with a conditional UPDATE and a lease it renews with each chunk, so only
+    one runner works on a job. Others watch it and take over once the lease
+    runs out, e.g. because the owning process died.
+    """
+
+    def __init__(self, ai_service, integration_service):
+        self.ai_service = ai_service
+        self.integration_service = integration_service
+        self.chunk_size = int(os.environ.get('BULK_JOB_CHUNK_SIZE', '100'))
+        # Long enough for any chunk to finish before another runner may take the job over
+        self.lease = timedelta(seconds=float(os.environ.get('BULK_JOB_LEASE', '600')))
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        # One job at a time; each job already runs its LLM calls concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-job')
+
+    def submit_recategorize(self, filters):
+        """Queue recategorizing every email matching filters
+
+        Raises ValueError for an invalid filter set. Returns the job.
+        """
+        email_query(filters)  # Validate before queueing
+        job = BulkJob(kind='recategorize', params=json.dumps({"filters": filters}))
+        db.session.add(job)
+        db.session.commit()
+
+        self.executor.submit(self.run_job, job.id)
+        return job
+
+    def resume(self):
+        """Queue jobs that are queued or running; ones another runner holds are watched"""
+        job_ids = [job_id for job_id, in db.session.query(BulkJob.id).filter(
+            BulkJob.status.in_(['queued', 'running'])
+        ).order_by(BulkJob.id)]
+        for job_id in job_ids:
+            self.executor.submit(self.run_job, job_id)
+        if job_ids:
+            logger.info(f"Resuming {len(job_ids)} bulk jobs")
+        return len(job_ids)
+
+    def cancel(self, job):
+        """Stop a job after its current chunk; returns False if it already finished"""
+        if job.status not in ('queued', 'running'):
+            return False
+        job.status = 'cancelled'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+
+    def run_job(self, job_id):
+        """Run a job to completion (executor thread entry point)"""
+        with app.app_context():
+            try:
+                held_until = self._run(job_id)
+            except Exception as e:
+                logger.error(f"Bulk job {job_id} failed: {str(e)}")
+                db.session.rollback()
+                # Unless another runner took the job over meanwhile
+                db.session.execute(db.update(BulkJob).where(
+                    BulkJob.id == job_id, BulkJob.worker == self.worker_id
+                ).values(status='failed', error=str(e), finished_at=datetime.utcnow()))
+                db.session.commit()
+                return
+            finally:
+                db.session.remove()
+
+        if held_until is not None:
+            # Check again when the other runner's lease would run out
+            delay = max((held_until - datetime.utcnow()).total_seconds(), 0) + 1
+            timer = threading.Timer(delay, self.executor.submit, (self.run_job, job_id))
+            timer.daemon = True
+            timer.start()
+
+    def _claim(self, job_id):
+        """Take a queued job, or a running one whose lease ran out; returns whether this runner got it"""
+        now = datetime.utcnow()
+        claimed = db.session.execute(db.update(BulkJob).where(
+            BulkJob.id == job_id,
+            db.or_(
+                BulkJob.status == 'queued',
+                db.and_(BulkJob.status == 'running',
+                        db.or_(BulkJob.lease_until.is_(None), BulkJob.lease_until < now))
+            )
+        ).values(
+            status='running', worker=self.worker_id, lease_until=now + self.lease,
+            started_at=db.func.coalesce(BulkJob.started_at, now)
+        ), execution_options={'synchronize_session': False}).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def _commit_held(self, job):
+        """Commit the session if this runner still holds job, renewing its lease
+
+        The conditional UPDATE locks the job row, so a runner whose lease was
+        taken over rolls its work back instead of committing it twice.
+        """
+        # Before the flush, so a lost job's results are never written
+        with db.session.no_autoflush:
+            held = db.session.execute(db.update(BulkJob).where(
+                BulkJob.id == job.id, BulkJob.worker == self.worker_id
+            ).values(lease_until=datetime.utcnow() + self.lease), execution_options={'synchronize_session': False}).rowcount
+        if not held:
+            db.session.rollback()
+            logger.warning(f"Bulk job {job.id} was taken over by another runner")
+            return False
+        db.session.commit()
+        return True
+
+    def _run(self, job_id):
+        """Run the job if it can be claimed
+
+        Returns the lease expiry of a job another runner holds, so it can be
+        checked on again, otherwise None.
+        """
+        if not self._claim(job_id):
+            job = db.session.get(BulkJob, job_id)
+            if job is not None and job.status == 'running' and job.worker != self.worker_id:
+                return job.lease_until
+            return None
+
+        job = db.session.get(BulkJob, job_id)
+        query = email_query(json.loads(job.params)["filters"])
+        if job.total is None:
+            job.total = query.count()
+            if not self._commit_held(job):
+                return None
+            logger.info(f"Bulk job {job.id} started: {job.kind} of {job.total} emails")
+        else:
+            logger.info(f"Bulk job {job.id} resumed after email {job.last_email_id}")
+
+        while True:
+            # Picks up a cancellation from another request
+            db.session.refresh(job)
+            if job.status != 'running' or job.worker != self.worker_id:
+                return None
+
+            emails = query.options(
+                db.undefer(Email.body_clean_z), db.undefer(Email._body_clean),
+                db.undefer(Email.body_text_z), db.undefer(Email._body_text)
+            ).filter(Email.id > job.last_email_id).order_by(Email.id).limit(self.chunk_size).all()
+            if not emails:
+                break
+            if not self._recategorize_chunk(job, emails):
+                return None
+
+        job.status = 'completed'
+        job.finished_at = datetime.utcnow()
+        if self._commit_held(job):
+            logger.info(f"Bulk job {job.id} completed: {job.succeeded} succeeded, {job.failed} failed")
+        return None
+
+    def _recategorize_chunk(self, job, emails):
+        """Categorize and save one chunk; returns False if the job was taken over"""
+        previous = {email.id: email.category for email in emails}
+        try:
+            categories = self.ai_service.categorize_emails(emails)
+        except Exception as e:
+            logger.error(f"Bulk job {job.id} chunk failed: {str(e)}")
+            db.session.rollback()
+            db.session.add_all(BulkJobItem(
+                job_id=job.id, email_id=email.id, status='error', old_value=previous[email.id], error=str(e)
+            ) for email in emails)
+            job.processed += len(emails)
+            job.failed += len(emails)
+            job.last_email_id = emails[-1].id
+            return self._commit_held(job)
+
+        changed, failed = [], 0
+        for email, category in zip(emails, categories):
+            if category is None:
+                # The LLM call failed; the email keeps its category
+                failed += 1
+                db.session.add(BulkJobItem(
+                    job_id=job.id, email_id=email.id, status='error', old_value=previous[email.id],
+                    error='Categorization failed'
+                ))
+                continue
+
+            status = 'unchanged'
+            if category != previous[email.id]:
+                email.category = category
+                changed.append(email)
+                status = 'changed'
+                # Queued in the same transaction as the new category
+                self.integration_service.trigger_webhooks('email.categorized', {
+                    'email_id': email.id,
+                    'category': category
+                })
+            db.session.add(BulkJobItem(
+                job_id=job.id, email_id=email.id, status=status, old_value=previous[email.id], new_value=category
+            ))
+
+        job.processed += len(emails)
+        job.succeeded += len(emails) - failed
+        job.failed += failed
+        job.last_email_id = emails[-1].id
+        if not self._commit_held(job):
+            return False
+
+        self.ai_service.precompute_reply_drafts(changed)
+        return True
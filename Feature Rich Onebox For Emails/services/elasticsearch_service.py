@@ -88,6 +88,30 @@ class ElasticsearchService:
             logger.error(f"Error indexing email {email.id}: {str(e)}")
             return False
     
+    def delete_emails(self, email_ids):
+        """Remove emails from the index"""
+        if not email_ids:
+            return True
+        
+        if not self.initialized:
+            self.initialize()
+        
+        if not self.initialized:
+            logger.error("Cannot delete emails: Elasticsearch not initialized")
+            return False
+        
+        try:
+            response = self.client.delete_by_query(
+                index=self.index_name,
+                query={"ids": {"values": [str(email_id) for email_id in email_ids]}},
+                conflicts='proceed'
+            )
+            logger.debug(f"Deleted {response.get('deleted', 0)} emails from Elasticsearch")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting {len(email_ids)} emails: {str(e)}")
+            return False
+    
     def search_emails(self, options):
         """Search emails in Elasticsearch"""
         if not self.initialized:
@@ -172,7 +196,10 @@ class ElasticsearchService:
             query = query.filter(
                 db.or_(
                     Email.subject.ilike(search_term),
-                    Email.body_text.ilike(search_term),
+                    # Compressed bodies can't be searched in SQL; their snippets can
+                    Email.snippet.ilike(search_term),
+                    Email._body_clean.ilike(search_term),
+                    Email._body_text.ilike(search_term),
                     Email.sender.ilike(search_term)
                 )
             )
@@ -0,0 +1,200 @@
+import logging
+import os
+import re
+from html import escape
+from html.parser import HTMLParser
+from services.text_processing import BLANK_LINES
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the output below changes; emails rendered by an older version
+# are re-rendered the next time they are viewed
+SANITIZER_VERSION = 2
+
+MAX_HTML_CHARS = int(os.environ.get('SANITIZED_HTML_MAX_CHARS', str(256 * 1024)))
+MAX_TEXT_CHARS = int(os.environ.get('HTML_TEXT_MAX_CHARS', str(100 * 1000)))
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'center', 'code', 'col', 'colgroup', 'dd', 'div', 'dl', 'dt',
+    'em', 'font', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'small', 'span',
+    'strike', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul'
+}
+VOID_TAGS = {'br', 'col', 'hr', 'img'}
+# Dropped together with everything inside them
+DROPPED_TAGS = {
+    'script', 'style', 'title', 'iframe', 'frame', 'frameset', 'object', 'embed', 'applet', 'noscript',
+    'template', 'svg', 'math', 'select', 'textarea', 'button'
+}
+
+ALLOWED_ATTRIBUTES = {
+    'align', 'alt', 'bgcolor', 'border', 'cellpadding', 'cellspacing', 'color', 'colspan', 'dir', 'face', 'height',
+    'rowspan', 'size', 'style', 'title', 'valign', 'width'
+}
+URL_ATTRIBUTES = {'a': 'href', 'img': 'src'}
+URL_SCHEMES = {
+    'href': re.compile(r"^(https?:|mailto:|#)", re.IGNORECASE),
+    'src': re.compile(r"^(https?:|data:image/(png|gif|jpe?g|webp);)", re.IGNORECASE),
+}
+# Inline CSS that can run code or load resources. Styles with a backslash or a
+# comment are dropped too: CSS escapes (\75rl( is url() and comments can hide the rest
+UNSAFE_STYLE = re.compile(
+    r"\\|/\*|expression|javascript:|url\s*\(|image-set|image\s*\(|@import|behavior|-moz-binding",
+    re.IGNORECASE
+)
+
+# Tags that start a new line in the plain-text rendering
+BLOCK_TAGS = {
+    'blockquote', 'br', 'caption', 'center', 'dd', 'div', 'dl', 'dt', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li',
+    'ol', 'p', 'pre', 'table', 'tr', 'ul'
+}
+# Tags whose start implicitly closes an open tag of the listed kinds (<li>a<li>b)
+IMPLIED_END_TAGS = {
+    'li': {'li'}, 'p': {'p'}, 'dt': {'dt', 'dd'}, 'dd': {'dt', 'dd'},
+    'tr': {'tr', 'td', 'th'}, 'td': {'td', 'th'}, 'th': {'td', 'th'},
+}
+TRUNCATION_NOTICE = '<p><em>[Message truncated]</em></p>'
+
+
+class _Sanitizer(HTMLParser):
+    """Re-emit an allowlisted subset of HTML, collecting a plain-text rendering alongside"""
+
+    def __init__(self, max_html, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_html = max_html
+        self.max_chars = max_chars
+        self.html = []
+        self.html_size = 0
+        self.text = []
+        self.text_size = 0
+        self.open_tags = []
+        self.dropping = 0
+        self.truncated = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping:
+            return
+
+        if tag in BLOCK_TAGS:
+            self._text('\n')
+        if tag == 'li':
+            self._text('- ')
+        elif tag in ('td', 'th'):
+            self._text(' ')
+
+        if tag not in ALLOWED_TAGS:
+            return
+
+        while self.open_tags and self.open_tags[-1] in IMPLIED_END_TAGS.get(tag, ()):
+            self._html(f"</{self.open_tags.pop()}>")
+
+        kept = []
+        for name, value in attrs:
+            value = (value or '').strip()
+            if name == URL_ATTRIBUTES.get(tag):
+                if not URL_SCHEMES[name].match(value):
+                    continue
+            elif name not in ALLOWED_ATTRIBUTES:
+                continue  # event handlers, ids and classes (which could hook the page's CSS), etc.
+            elif name == 'style' and UNSAFE_STYLE.search(value):
+                continue
+            kept.append(f' {name}="{escape(value, quote=True)}"')
+        if tag == 'a':
+            kept.append(' rel="noopener noreferrer"')
+
+        self._html(f"<{tag}{''.join(kept)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in DROPPED_TAGS:
+            self.dropping -= 1
+        elif tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping:
+            return
+
+        if tag in BLOCK_TAGS:
+            self._text('\n')
+        # Close anything left open inside this tag; ignore stray end tags
+        if tag in self.open_tags:
+            while self.open_tags:
+                open_tag = self.open_tags.pop()
+                self._html(f"</{open_tag}>")
+                if open_tag == tag:
+                    break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self._html(escape(data, quote=False))
+        self._text(data)
+
+    def _html(self, fragment):
+        if self.truncated:
+            return
+        if self.html_size + len(fragment) > self.max_html:
+            self.truncated = True
+            return
+        self.html.append(fragment)
+        self.html_size += len(fragment)
+
+    def _text(self, fragment):
+        if self.text_size < self.max_chars:
+            self.text.append(fragment)
+            self.text_size += len(fragment)
+
+    def result(self):
+        # Whatever is still open is closed even when the body was cut short
+        closing = ''.join(f"</{tag}>" for tag in reversed(self.open_tags))
+        html = ''.join(self.html) + closing + (TRUNCATION_NOTICE if self.truncated else '')
+
+        lines = (re.sub(r"[ \t\r\f\v\xa0]+", ' ', line).strip() for line in ''.join(self.text).split('\n'))
+        text = BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()[:self.max_chars]
+        return html, text
+
+
+def sanitize_html(html, max_html=None, max_chars=None):
+    """Reduce untrusted email HTML to safe, size-bounded markup plus a plain-text rendering
+
+    Only allowlisted tags and attributes survive; scripts, styles, forms,
+    frames, event handlers and non-http(s) URLs are removed. Returns
+    (safe_html, text); both are empty for an empty body.
+    """
+    if not html:
+        return '', ''
+
+    parser = _Sanitizer(max_html or MAX_HTML_CHARS, max_chars or MAX_TEXT_CHARS)
+    try:
+        # Feed in chunks so a huge body stops costing anything once the output is full
+        for start in range(0, len(html), 64 * 1024):
+            parser.feed(html[start:start + 64 * 1024])
+            if parser.truncated and parser.text_size >= parser.max_chars:
+                break
+        parser.close()
+    except Exception as e:  # HTMLParser is lenient, but never let a body break ingest
+        logger.error(f"Error sanitizing HTML: {str(e)}")
+        return '', ''
+
+    return parser.result()
+
+
+def render_email(email, html=None):
+    """Store the sanitized HTML and text rendering of an email's HTML body
+
+    Returns True if the email was (re-)rendered, False if it was current.
+    """
+    if email.html_version == SANITIZER_VERSION:
+        return False
+
+    email.html_safe, email.html_text = sanitize_html(html if html is not None else email.body_html)
+    email.html_version = SANITIZER_VERSION
+    return True
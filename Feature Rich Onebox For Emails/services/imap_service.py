@@ -1,3 +1,4 @@
+import json
 import logging
 import email
 import email.header
@@ -9,6 +10,11 @@ from email.header import decode_header
 from imap_tools import MailBox, A, MailMessageFlags, MailMessage
 from models import EmailAccount, Email, Attachment
 from app import db
+from db_utils import dialect_insert
+import email_counters
+import email_threads
+from services.text_processing import clean_email_body, make_snippet
+from services.html_sanitizer import SANITIZER_VERSION, sanitize_html
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,7 @@ class ImapService:
         self.integration_service = integration_service
         self.active_connections = {}  # Store active connections
         self.sync_in_progress = set()  # Track accounts currently syncing
+        self.categorize_batch_size = 20  # New emails categorized per concurrent batch
         
     def test_connection(self, account):
         """Test connection to an email account"""
@@ -51,6 +58,9 @@ class ImapService:
             
             logger.info(f"Syncing account {account.email} from {sync_from_date}")
             
+            # Finish emails stored by an earlier sync whose categorization failed or was interrupted
+            self.retry_pending_categorization(account)
+            
             # Connect to mailbox
             with MailBox(account.host).login(account.email, account.password) as mailbox:
                 # Get list of folders
@@ -79,10 +89,12 @@ class ImapService:
                         logger.info(f"Searching folder {folder_name}")
                         messages = mailbox.fetch(query, limit=None)
                         
-                        # Process emails
+                        # Process emails; new ones are categorized in batches so
+                        # their LLM calls run concurrently
+                        pending = []
                         for msg in messages:
                             try:
-                                result = self._process_email(account, msg, folder_name)
+                                result = self._process_email(account, msg, folder_name, pending)
                                 if result == "new":
                                     new_emails += 1
                                 elif result == "updated":
@@ -90,6 +102,12 @@ class ImapService:
                             except Exception as e:
                                 logger.error(f"Error processing email in {folder_name}: {str(e)}")
                                 error_count += 1
+                            
+                            if len(pending) >= self.categorize_batch_size:
+                                error_count += self._categorize_new_emails(account, pending)
+                                pending = []
+                        
+                        error_count += self._categorize_new_emails(account, pending)
                                 
                     except Exception as e:
                         logger.error(f"Error processing folder {folder_name}: {str(e)}")
@@ -100,13 +118,19 @@ class ImapService:
             
             logger.info(f"Sync completed for {account.email}: {new_emails} new, {updated_emails} updated, {error_count} errors")
             
+            # Report how often identical content skipped an API call
+            memo_stats = self.ai_service.get_stats().get('memo_cache', {})
+            for kind, counts in memo_stats.items():
+                logger.info(f"Memo cache '{kind}': {counts['hits']} hits, {counts['misses']} misses ({counts['hit_rate']:.0%} hit rate)")
+            
             # Return results
             return {
                 "success": True,
                 "account_id": account.id,
                 "new_emails": new_emails,
                 "updated_emails": updated_emails,
-                "errors": error_count
+                "errors": error_count,
+                "memo_cache": memo_stats
             }
             
         except Exception as e:
@@ -116,48 +140,70 @@ class ImapService:
         finally:
             self.sync_in_progress.remove(account.id)
     
-    def _process_email(self, account, msg, folder_name):
-        """Process a single email message"""
-        # Check if email already exists (by message ID)
-        existing_email = Email.query.filter_by(
-            account_id=account.id,
-            message_id=msg.uid
-        ).first()
+    def _process_email(self, account, msg, folder_name, pending=None):
+        """Process a single email message
         
-        if existing_email:
-            # Update existing email if needed
-            if existing_email.folder != folder_name:
-                existing_email.folder = folder_name
-                db.session.commit()
-                return "updated"
-            return "existing"
-        
-        # Create new email record
+        If a pending list is given, new emails are appended to it for batched
+        categorization instead of being categorized immediately.
+        """
         try:
             # Parse email date
             msg_date = None
             if msg.date:
                 msg_date = msg.date
             
-            # Create email object
-            email_obj = Email(
+            uid = int(msg.uid) if msg.uid.isdigit() else None
+            flags = ", ".join(msg.flags)
+            headers = {name: list(values) for name, values in msg.headers.items()}
+            message_id, in_reply_to, reference_ids = email_threads.header_ids(headers)
+            # Sanitize once here so viewing an email does no HTML processing
+            html_safe, html_text = sanitize_html(msg.html)
+            # HTML-only emails get their text from the rendering
+            body_clean = clean_email_body(msg.text or html_text)
+            
+            # Insert unless the (account, folder, uid) ingest key is already stored;
+            # one round trip instead of a lookup followed by an insert
+            email_obj = db.session.scalar(dialect_insert(Email).values(
                 account_id=account.id,
-                message_id=msg.uid,
+                message_id=message_id,
+                in_reply_to=in_reply_to,
+                reference_ids=reference_ids,
                 folder=folder_name,
                 subject=msg.subject or "(No Subject)",
                 sender=msg.from_ or "",
                 recipients=", ".join(msg.to or []),
                 cc=", ".join(msg.cc or []),
-                body_text=msg.text or "",
-                body_html=msg.html or None,
+                headers=json.dumps(headers),
+                body_text_z=msg.text or "",
+                body_clean_z=body_clean,
+                snippet=make_snippet(body_clean or msg.text or html_text),
+                body_html_z=msg.html or None,
+                html_safe_z=html_safe or None,
+                html_text_z=html_text or None,
+                html_version=SANITIZER_VERSION,
                 date=msg_date,
                 received_date=datetime.utcnow(),
-                uid=int(msg.uid) if msg.uid.isdigit() else None,
-                flags=", ".join(msg.flags)
-            )
+                uid=uid,
+                flags=flags,
+                categorize_pending=True
+            ).on_conflict_do_nothing(
+                index_elements=['account_id', 'folder', 'uid']
+            ).returning(Email))
             
-            db.session.add(email_obj)
-            db.session.flush()  # Flush to get the ID
+            if email_obj is None:
+                # Already stored; just pick up read/answered flag changes
+                updated = db.session.execute(db.update(Email).where(
+                    Email.account_id == account.id,
+                    Email.folder == folder_name,
+                    Email.uid == uid,
+                    db.or_(Email.flags.is_(None), Email.flags != flags)
+                ).values(flags=flags)).rowcount
+                db.session.commit()
+                return "updated" if updated else "existing"
+            
+            # Core inserts skip the flush hook, so count the new email here
+            email_counters.adjust({email_counters.counter_key(account.id, None, folder_name): 1})
+            email_threads.assign_thread(email_obj)
             
             # Process attachments
             for att in msg.attachments:
@@ -174,19 +220,10 @@ class ImapService:
             # Index in Elasticsearch
             self.elasticsearch_service.index_email(email_obj)
             
-            # Categorize email
-            category = self.ai_service.categorize_email(email_obj)
-            email_obj.category = category
-            db.session.commit()
-            
-            # Trigger webhooks
-            self.integration_service.trigger_webhooks('email.new', {
-                'email_id': email_obj.id,
-                'account_id': account.id,
-                'subject': email_obj.subject,
-                'sender': email_obj.sender,
-                'category': category
-            })
+            if pending is not None:
+                pending.append(email_obj)
+            else:
+                self._categorize_new_emails(account, [email_obj])
             
             return "new"
             
@@ -195,6 +232,72 @@ class ImapService:
             logger.error(f"Error processing email: {str(e)}")
             raise
     
+    def retry_pending_categorization(self, account):
+        """Categorize an account's emails still marked categorize_pending and trigger their webhooks
+        
+        Returns the number of emails that are still pending afterwards.
+        """
+        left, last_id = 0, 0
+        while True:
+            emails = Email.query.options(db.undefer_group('body')).filter(
+                Email.account_id == account.id,
+                Email.categorize_pending.is_(True),
+                Email.id > last_id
+            ).order_by(Email.id).limit(self.categorize_batch_size).all()
+            if not emails:
+                break
+            
+            last_id = emails[-1].id
+            logger.info(f"Retrying categorization of {len(emails)} emails for {account.email}")
+            left += self._categorize_new_emails(account, emails)
+        return left
+    
+    def _categorize_new_emails(self, account, emails):
+        """Categorize newly stored emails and trigger their webhooks
+        
+        Emails whose categorization failed (an LLM error, or the batch could
+        not be saved) keep categorize_pending and get no webhook yet, so the
+        next sync retries them. Returns the number of such emails.
+        """
+        if not emails:
+            return 0
+        
+        try:
+            categories = self.ai_service.categorize_emails(emails)
+            done = []
+            for email_obj, category in zip(emails, categories):
+                if category is None:
+                    continue
+                email_obj.category = category
+                email_obj.categorize_pending = None
+                done.append(email_obj)
+            
+            # Queue webhooks in the same transaction as the categories
+            for email_obj in done:
+                self.integration_service.trigger_webhooks('email.new', {
+                    'email_id': email_obj.id,
+                    'account_id': account.id,
+                    'subject': email_obj.subject,
+                    'sender': email_obj.sender,
+                    'category': email_obj.category
+                })
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error categorizing {len(emails)} new emails, will retry on the next sync: {str(e)}")
+            return len(emails)
+        
+        failed = len(emails) - len(done)
+        if failed:
+            logger.warning(f"Categorization failed for {failed} new emails, will retry on the next sync")
+        
+        # Slack: hot leads right away, the rest in digests
+        self.integration_service.notify_new_emails(done)
+        
+        # Draft replies for high-value emails before anyone asks for them
+        self.ai_service.precompute_reply_drafts(done)
+        return failed
+    
     def sync_all_accounts(self, days=30, force=False):
         """Sync all active email accounts"""
         accounts = EmailAccount.query.filter_by(active=True).all()
@@ -1,10 +1,14 @@
 import json
 import logging
 import os
+import threading
+import time
 import requests
 from datetime import datetime
-from models import Webhook, Email
+from models import Webhook, WebhookDelivery, WebhookEvent, Email
 from app import db
+from services.slack_notifier import CATEGORY_MESSAGES, DEFAULT_MESSAGE, SlackNotifier, email_payload
+from services.webhook_dispatcher import signature_headers
 
 logger = logging.getLogger(__name__)
 
@@ -13,70 +17,82 @@ class IntegrationService:
     
     def __init__(self):
         self.slack_webhook_url = os.environ.get('SLACK_WEBHOOK_URL')
+        self.slack_notifier = SlackNotifier(self.slack_webhook_url)
+        
+        # event -> ids of active subscribed webhooks. Invalidated locally on
+        # webhook changes; the TTL bounds staleness in other processes
+        self.routes_ttl = float(os.environ.get('WEBHOOK_ROUTES_TTL', '30'))
+        self._routes = None
+        self._routes_loaded_at = 0.0
+        self._routes_generation = 0
+        self._routes_lock = threading.Lock()
     
     def trigger_webhooks(self, event, data):
-        """Trigger all matching webhooks for an event"""
+        """Queue a delivery to every webhook subscribed to an event
+        
+        Deliveries are added to the current session without committing, so
+        they are saved atomically with the change being reported; the caller
+        commits. The webhook dispatcher sends them in the background.
+        """
         try:
             # Find webhooks that are subscribed to this event
-            webhooks = Webhook.query.filter(
-                Webhook.events.like(f"%{event}%"),
-                Webhook.active == True
-            ).all()
+            webhook_ids = self._webhook_ids_for(event)
             
-            if not webhooks:
+            if not webhook_ids:
                 logger.debug(f"No webhooks found for event {event}")
                 return []
-                
-            results = []
-            
-            # Call each webhook
-            for webhook in webhooks:
-                try:
-                    # Prepare webhook data
-                    webhook_data = {
-                        "event": event,
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "data": data
-                    }
-                    
-                    # Call webhook URL
-                    response = requests.post(
-                        webhook.url,
-                        json=webhook_data,
-                        headers={"Content-Type": "application/json"},
-                        timeout=5
-                    )
-                    
-                    success = 200 <= response.status_code < 300
-                    
-                    # Record result
-                    results.append({
-                        "webhook_id": webhook.id,
-                        "name": webhook.name,
-                        "success": success,
-                        "status_code": response.status_code,
-                        "response": response.text[:100]  # Truncate long responses
-                    })
-                    
-                    # Update last triggered time
-                    webhook.last_triggered = datetime.utcnow()
-                    db.session.commit()
-                    
-                except Exception as e:
-                    logger.error(f"Error calling webhook {webhook.name}: {str(e)}")
-                    results.append({
-                        "webhook_id": webhook.id,
-                        "name": webhook.name,
-                        "success": False,
-                        "error": str(e)
-                    })
-            
-            return results
+            
+            # Prepare webhook data
+            payload = json.dumps({
+                "event": event,
+                "timestamp": datetime.utcnow().isoformat(),
+                "data": data
+            })
+            
+            deliveries = []
+            for webhook_id in webhook_ids:
+                delivery = WebhookDelivery(webhook_id=webhook_id, event=event, payload=payload)
+                db.session.add(delivery)
+                deliveries.append(delivery)
+            
+            logger.debug(f"Queued {len(deliveries)} deliveries for event {event}")
+            return deliveries
             
         except Exception as e:
-            logger.error(f"Error triggering webhooks: {str(e)}")
+            logger.error(f"Error queueing webhooks: {str(e)}")
             return []
     
+    def invalidate_routes(self):
+        """Drop the cached event routing after webhooks are added, changed or deleted"""
+        with self._routes_lock:
+            self._routes = None
+            self._routes_generation += 1
+    
+    def _webhook_ids_for(self, event):
+        """Get the ids of active webhooks subscribed to exactly this event"""
+        routes = self._routes
+        if routes is None or time.monotonic() - self._routes_loaded_at > self.routes_ttl:
+            routes = self._load_routes()
+        return routes.get(event, ())
+    
+    def _load_routes(self):
+        with self._routes_lock:
+            generation = self._routes_generation
+        
+        rows = db.session.query(WebhookEvent.event, WebhookEvent.webhook_id).join(Webhook).filter(
+            Webhook.active == True
+        )
+        routes = {}
+        for event, webhook_id in rows:
+            routes.setdefault(event, []).append(webhook_id)
+        
+        with self._routes_lock:
+            # Don't cache a table read from before a concurrent invalidation
+            if generation == self._routes_generation:
+                self._routes = routes
+                self._routes_loaded_at = time.monotonic()
+        return routes
+    
     def test_webhook(self, webhook):
         """Test a webhook with sample data"""
         try:
@@ -91,11 +107,12 @@ class IntegrationService:
                 }
             }
             
-            # Call webhook URL
+            # Call webhook URL, signed the same way as real deliveries
+            body = json.dumps(test_data)
             response = requests.post(
                 webhook.url,
-                json=test_data,
-                headers={"Content-Type": "application/json"},
+                data=body,
+                headers={"Content-Type": "application/json", "X-Webhook-Event": "test", **signature_headers(webhook.secret, body)},
                 timeout=5
             )
             
@@ -112,30 +129,19 @@ class IntegrationService:
             return {"success": False, "error": str(e)}
     
     def send_slack_notification(self, message, email=None, color="#36a64f"):
-        """Send a notification to Slack"""
+        """Send a notification to Slack right away"""
         if not self.slack_webhook_url:
             logger.debug("Slack webhook URL not configured")
             return False
             
         try:
             # Create Slack message payload
-            payload = {
-                "attachments": [
-                    {
-                        "color": color,
-                        "pretext": message,
-                        "mrkdwn_in": ["text", "pretext"]
-                    }
-                ]
-            }
-            
-            # Add email details if provided
-            if email:
-                payload["attachments"][0].update({
-                    "title": email.subject,
-                    "text": f"From: {email.sender}\nCategory: {email.category or 'uncategorized'}",
-                    "footer": f"Email ID: {email.id}"
-                })
+            payload = email_payload(message, email and {
+                "id": email.id,
+                "subject": email.subject,
+                "sender": email.sender,
+                "category": email.category
+            }, color)
             
             # Send to Slack
             response = requests.post(
@@ -163,24 +169,19 @@ class IntegrationService:
             return False
             
         # Determine message based on category
-        category = email.category or "uncategorized"
-        color = "#36a64f"  # default green
-        
-        if category == "interested":
-            message = "🔥 New Interested Lead!"
-            color = "#36a64f"  # green
-        elif category == "meeting_booked":
-            message = "📅 New Meeting Booked!"
-            color = "#2eb6f2"  # blue
-        elif category == "spam":
-            message = "🗑️ Spam Email Received"
-            color = "#dddddd"  # gray
-        elif category == "out_of_office":
-            message = "🏖️ Out of Office Reply"
-            color = "#dddddd"  # gray
-        else:
-            message = "📬 New Email Received"
-            color = "#f2c744"  # yellow
+        message, color = CATEGORY_MESSAGES.get(email.category or "uncategorized", DEFAULT_MESSAGE)
             
         # Send notification
-        return self.send_slack_notification(message, email, color)
\ No newline at end of file
+        return self.send_slack_notification(message, email, color)
+    
+    def notify_new_emails(self, emails):
+        """Queue Slack notifications for newly synced emails
+        
+        High-priority categories are posted individually, the rest in periodic
+        digests; see SlackNotifier. Never blocks on Slack.
+        """
+        try:
+            return self.slack_notifier.notify(emails)
+        except Exception as e:
+            logger.error(f"Error queueing Slack notifications: {str(e)}")
+            return False
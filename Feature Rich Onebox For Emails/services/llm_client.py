@@ -0,0 +1,118 @@
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Interactive work (reply suggestions) must never queue behind bulk work
+# (categorization, backfills, ingestion)
+LANES = ('interactive', 'bulk')
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+
+
+class LlmClient:
+    """Shared, rate-limit-aware execution layer for OpenAI calls
+
+    Calls run on per-lane thread pools under a shared request budget
+    (OPENAI_REQUESTS_PER_MINUTE) and token budget (OPENAI_TOKENS_PER_MINUTE),
+    each enforced with a token bucket in which the interactive lane has
+    priority. Rate limits, timeouts and 5xx errors are retried with jittered
+    exponential backoff, honoring Retry-After when the API sends it.
+    """
+
+    def __init__(self):
+        requests_per_minute = float(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', '500'))
+        tokens_per_minute = float(os.environ.get('OPENAI_TOKENS_PER_MINUTE', '200000'))
+        self.request_bucket = TokenBucket(requests_per_minute / 60, capacity=max(requests_per_minute / 60, 1))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute / 6)
+
+        self.max_retries = int(os.environ.get('OPENAI_MAX_RETRIES', '5'))
+        self.backoff_base = 0.5
+        self.backoff_cap = 30.0
+
+        self.executors = {
+            'interactive': ThreadPoolExecutor(
+                max_workers=int(os.environ.get('LLM_INTERACTIVE_WORKERS', '4')),
+                thread_name_prefix='llm-interactive'
+            ),
+            'bulk': ThreadPoolExecutor(
+                max_workers=int(os.environ.get('LLM_BULK_WORKERS', '8')),
+                thread_name_prefix='llm-bulk'
+            )
+        }
+        self.stats = {lane: {"calls": 0, "retries": 0, "failures": 0} for lane in LANES}
+
+    def submit(self, lane, fn, *args, estimated_tokens=0, **kwargs):
+        """Schedule an API call on a lane, returning a Future"""
+        if lane not in LANES:
+            raise ValueError(f"Unknown LLM lane '{lane}'")
+        return self.executors[lane].submit(self._run, lane, fn, args, kwargs, estimated_tokens)
+
+    def call(self, lane, fn, *args, estimated_tokens=0, **kwargs):
+        """Run an API call on a lane and wait for the result"""
+        return self.submit(lane, fn, *args, estimated_tokens=estimated_tokens, **kwargs).result()
+
+    def get_stats(self):
+        """Get per-lane call/retry/failure counts"""
+        return {lane: dict(counts) for lane, counts in self.stats.items()}
+
+    def _run(self, lane, fn, args, kwargs, estimated_tokens):
+        priority = lane == 'interactive'
+
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire(1, priority=priority)
+            if estimated_tokens:
+                self.token_bucket.acquire(estimated_tokens, priority=priority)
+
+            try:
+                self.stats[lane]["calls"] += 1
+                return fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.stats[lane]["failures"] += 1
+                    raise
+
+                self.stats[lane]["retries"] += 1
+                retry_after = self._retry_after(e)
+                if retry_after is not None:
+                    # The server told everyone to wait, so hold back the whole budget;
+                    # the next acquire() blocks until it has passed
+                    logger.warning(f"OpenAI call failed ({type(e).__name__}), server asked to retry in {retry_after:.1f}s "
+                                   f"(attempt {attempt + 1}/{self.max_retries})")
+                    self.request_bucket.drain(retry_after)
+                else:
+                    delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                    logger.warning(f"OpenAI call failed ({type(e).__name__}), retrying in {delay:.1f}s "
+                                   f"(attempt {attempt + 1}/{self.max_retries})")
+                    time.sleep(delay)
+            except Exception:
+                self.stats[lane]["failures"] += 1
+                raise
+
+    @staticmethod
+    def _retry_after(error):
+        """Get the server-requested delay in seconds from an API error, if any"""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+
+        headers = response.headers
+        try:
+            if headers.get('retry-after-ms'):
+                return float(headers['retry-after-ms']) / 1000
+            if headers.get('retry-after'):
+                return float(headers['retry-after'])
+        except ValueError:
+            # HTTP-date form; fall back to our own backoff
+            pass
+        return None
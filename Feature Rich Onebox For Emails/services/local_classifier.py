@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9']+")
+
+
+class LocalClassifier:
+    """TF-IDF + logistic regression classifier trained from past LLM labels
+
+    Everything is plain NumPy so the model trains in seconds on the stored
+    categories and classifies a single email in microseconds. The model is
+    serialized to LOCAL_CLASSIFIER_PATH and loaded once per process.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('LOCAL_CLASSIFIER_PATH', 'data/local_classifier.npz')
+        self.threshold = float(os.environ.get('LOCAL_CLASSIFIER_THRESHOLD', '0.9'))
+        self.vocabulary = None
+        self.idf = None
+        self.weights = None
+        self.bias = None
+        self.classes = None
+        self.load_attempted = False
+        self._lock = threading.Lock()
+
+    @property
+    def trained(self):
+        return self.vocabulary is not None
+
+    @staticmethod
+    def tokenize(text):
+        """Split text into unigrams and bigrams"""
+        words = TOKEN_PATTERN.findall((text or '').lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    @staticmethod
+    def email_text(email):
+        """Get the text the classifier sees for an email"""
+        return f"{email.subject or ''}\n{email.body_text or ''}"
+
+    def train(self, texts, labels, min_df=2, max_features=50000, l2=1e-4, iterations=300, learning_rate=0.1):
+        """Fit the model on texts and their labels"""
+        documents = [Counter(self.tokenize(text)) for text in texts]
+
+        # Build vocabulary from document frequencies
+        document_frequency = Counter()
+        for tokens in documents:
+            document_frequency.update(tokens.keys())
+
+        terms = [term for term, df in document_frequency.most_common(max_features) if df >= min_df]
+        vocabulary = {term: i for i, term in enumerate(terms)}
+
+        n_documents = len(documents)
+        df = np.array([document_frequency[term] for term in terms], dtype=np.float64)
+        idf = (np.log((1 + n_documents) / (1 + df)) + 1.0).astype(np.float32)
+
+        classes = sorted(set(labels))
+        class_index = {label: i for i, label in enumerate(classes)}
+
+        # Sparse document matrix as coordinate arrays
+        rows, columns, values = [], [], []
+        for row, tokens in enumerate(documents):
+            indices, weights = self._weights(tokens, vocabulary, idf)
+            rows.append(np.full(len(indices), row, dtype=np.int64))
+            columns.append(indices)
+            values.append(weights)
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+        values = np.concatenate(values)
+
+        targets = np.zeros((n_documents, len(classes)), dtype=np.float32)
+        targets[np.arange(n_documents), [class_index[label] for label in labels]] = 1.0
+
+        # Multinomial logistic regression, full-batch Adam
+        weights = np.zeros((len(terms), len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        moments = [np.zeros_like(weights), np.zeros_like(weights), np.zeros_like(bias), np.zeros_like(bias)]
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+
+        for step in range(1, iterations + 1):
+            logits = np.zeros((n_documents, len(classes)), dtype=np.float32)
+            for c in range(len(classes)):
+                logits[:, c] = np.bincount(rows, weights=values * weights[columns, c], minlength=n_documents)
+            logits += bias
+
+            probabilities = self._softmax(logits)
+            error = (probabilities - targets) / n_documents
+
+            grad_weights = np.empty_like(weights)
+            for c in range(len(classes)):
+                grad_weights[:, c] = np.bincount(columns, weights=values * error[rows, c], minlength=len(terms))
+            grad_weights += l2 * weights
+            grad_bias = error.sum(axis=0)
+
+            for param, grad, m, v in ((weights, grad_weights, moments[0], moments[1]),
+                                      (bias, grad_bias, moments[2], moments[3])):
+                m *= beta1
+                m += (1 - beta1) * grad
+                v *= beta2
+                v += (1 - beta2) * grad * grad
+                param -= learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.classes = classes
+
+        logger.info(f"Trained local classifier on {n_documents} emails, {len(terms)} features")
+
+    def predict(self, text):
+        """Predict a label for text
+
+        Returns a (label, confidence) tuple, or (None, 0.0) if the model is not
+        available.
+        """
+        if not self.trained:
+            return None, 0.0
+
+        indices, weights = self._weights(Counter(self.tokenize(text)), self.vocabulary, self.idf)
+        probabilities = self._softmax(weights @ self.weights[indices] + self.bias)
+
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def classify(self, email):
+        """Classify an email, returning a label only when confidence is above the threshold"""
+        if not self.load_attempted:
+            self.load()
+
+        label, confidence = self.predict(self.email_text(email))
+        if label and confidence >= self.threshold:
+            return label, confidence
+        return None, confidence
+
+    def save(self, path=None):
+        """Serialize the model to disk"""
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                terms=np.array(json.dumps(terms)),
+                classes=np.array(json.dumps(self.classes)),
+                idf=self.idf,
+                weights=self.weights,
+                bias=self.bias
+            )
+        logger.info(f"Saved local classifier to {path}")
+
+    def load(self, path=None):
+        """Load the model from disk if one has been trained"""
+        path = path or self.path
+
+        with self._lock:
+            self.load_attempted = True
+
+            if not os.path.exists(path):
+                logger.info(f"No local classifier found at {path}")
+                return False
+
+            try:
+                with np.load(path) as data:
+                    terms = json.loads(str(data['terms']))
+                    self.classes = json.loads(str(data['classes']))
+                    self.idf = data['idf']
+                    self.weights = data['weights']
+                    self.bias = data['bias']
+                    self.vocabulary = {term: i for i, term in enumerate(terms)}
+
+                logger.info(f"Loaded local classifier from {path} ({len(terms)} features)")
+                return True
+            except Exception as e:
+                logger.error(f"Error loading local classifier: {str(e)}")
+                self.vocabulary = None
+                return False
+
+    @staticmethod
+    def _softmax(logits):
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    @staticmethod
+    def _weights(tokens, vocabulary, idf):
+        """Get L2-normalized TF-IDF weights for known tokens"""
+        indices = []
+        counts = []
+        for token, count in tokens.items():
+            index = vocabulary.get(token)
+            if index is not None:
+                indices.append(index)
+                counts.append(count)
+
+        indices = np.array(indices, dtype=np.int64)
+        weights = (1 + np.log(np.array(counts, dtype=np.float32))) * idf[indices]
+
+        norm = np.linalg.norm(weights)
+        if norm > 0:
+            weights /= norm
+        return indices, weights
+
+
+def evaluate(classifier, texts, labels, threshold):
+    """Build an accuracy report for a classifier against held-out labels"""
+    predictions = [classifier.predict(text) for text in texts]
+
+    correct = sum(1 for (label, _), expected in zip(predictions, labels) if label == expected)
+    confident = [(label, expected) for (label, confidence), expected in zip(predictions, labels) if confidence >= threshold]
+    confident_correct = sum(1 for label, expected in confident if label == expected)
+
+    per_class = {}
+    for category in sorted(set(labels) | {label for label, _ in predictions if label}):
+        true_positive = sum(1 for (label, _), expected in zip(predictions, labels) if label == category and expected == category)
+        predicted = sum(1 for label, _ in predictions if label == category)
+        actual = sum(1 for expected in labels if expected == category)
+        per_class[category] = {
+            "precision": true_positive / predicted if predicted else 0.0,
+            "recall": true_positive / actual if actual else 0.0,
+            "support": actual
+        }
+
+    total = len(labels)
+    return {
+        "samples": total,
+        "accuracy": correct / total if total else 0.0,
+        "threshold": threshold,
+        "coverage": len(confident) / total if total else 0.0,
+        "accuracy_above_threshold": confident_correct / len(confident) if confident else 0.0,
+        "per_class": per_class
+    }
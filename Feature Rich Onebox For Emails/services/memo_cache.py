@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from models import MemoEntry
+from app import db
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = re.compile(r"\s+")
+# last_used_at only needs to be coarse for LRU eviction; refreshing it on every hit would make each read a write
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+class MemoCache:
+    """Persistent LRU memo cache for AI results
+
+    Keys are a hash of the result kind, the model name and the normalized
+    content, so byte-identical (after normalization) emails reuse one API
+    result. Entries live in the memo_entry table, bounded to
+    MEMO_CACHE_MAX_ENTRIES with least-recently-used eviction, and a small
+    in-process LRU sits in front of the table for hot keys.
+    """
+
+    def __init__(self):
+        self.max_entries = int(os.environ.get('MEMO_CACHE_MAX_ENTRIES', '100000'))
+        self.local_size = int(os.environ.get('MEMO_CACHE_LOCAL_SIZE', '2048'))
+        self.evict_interval = 100  # Check the table size every N writes
+        self.local = OrderedDict()
+        self.stats = {}
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text):
+        """Normalize content so trivially different copies share a key"""
+        return WHITESPACE.sub(' ', (text or '')).strip().lower()
+
+    def make_key(self, kind, model, *parts):
+        """Build a cache key from the kind, model and content parts"""
+        digest = hashlib.sha256()
+        digest.update(f"{kind}\x00{model}".encode('utf-8'))
+        for part in parts:
+            digest.update(b"\x00")
+            digest.update(self.normalize(part).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, kind, key):
+        """Get a cached value, or None on a miss"""
+        with self._lock:
+            local_hit = key in self.local
+            if local_hit:
+                self.local.move_to_end(key)
+                value = self.local[key]
+
+        if local_hit:
+            self._record(kind, hit=True)
+            return value
+
+        try:
+            table = MemoEntry.__table__
+            with db.engine.begin() as conn:
+                row = conn.execute(select(table.c.value, table.c.last_used_at).where(table.c.key == key)).first()
+                value = row.value if row else None
+                now = datetime.utcnow()
+                if row and (row.last_used_at is None or now - row.last_used_at > TOUCH_INTERVAL):
+                    conn.execute(update(table).where(table.c.key == key).values(last_used_at=now))
+        except Exception as e:
+            logger.error(f"Error reading memo cache: {str(e)}")
+            value = None
+
+        if value is None:
+            self._record(kind, hit=False)
+            return None
+
+        value = json.loads(value)
+        self._remember(key, value)
+        self._record(kind, hit=True)
+        return value
+
+    def put(self, kind, key, value):
+        """Store a value in the cache"""
+        self._remember(key, value)
+
+        try:
+            now = datetime.utcnow()
+            with db.engine.begin() as conn:
+                conn.execute(MemoEntry.__table__.insert().values(
+                    key=key,
+                    kind=kind,
+                    value=json.dumps(value),
+                    created_at=now,
+                    last_used_at=now
+                ))
+        except IntegrityError:
+            # Another worker stored the same content first
+            pass
+        except Exception as e:
+            logger.error(f"Error writing memo cache: {str(e)}")
+            return
+
+        with self._lock:
+            self.writes += 1
+            should_evict = self.writes % self.evict_interval == 0
+
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries beyond the size bound"""
+        table = MemoEntry.__table__
+        try:
+            with db.engine.begin() as conn:
+                count = conn.execute(select(func.count()).select_from(table)).scalar()
+                excess = count - self.max_entries
+                if excess <= 0:
+                    return 0
+
+                oldest = select(table.c.key).order_by(table.c.last_used_at).limit(excess)
+                conn.execute(delete(table).where(table.c.key.in_(oldest.scalar_subquery())))
+
+            logger.info(f"Evicted {excess} memo cache entries")
+            return excess
+        except Exception as e:
+            logger.error(f"Error evicting memo cache entries: {str(e)}")
+            return 0
+
+    def get_stats(self):
+        """Get hit/miss counts and hit rates per kind"""
+        with self._lock:
+            return {
+                kind: dict(counts, hit_rate=counts['hits'] / (counts['hits'] + counts['misses']))
+                for kind, counts in self.stats.items()
+            }
+
+    def _remember(self, key, value):
+        with self._lock:
+            self.local[key] = value
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def _record(self, kind, hit):
+        with self._lock:
+            counts = self.stats.setdefault(kind, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
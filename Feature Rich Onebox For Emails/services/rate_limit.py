@@ -0,0 +1,74 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Callers
+    marked as priority are served before any waiting non-priority callers.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.priority_waiters = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount=1, priority=False, timeout=None):
+        """Block until `amount` tokens are available and take them
+
+        Returns False if the timeout expired first. Requests larger than the
+        capacity are clamped so they can't wait forever.
+        """
+        amount = min(float(amount), self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            if priority:
+                self.priority_waiters += 1
+            try:
+                while True:
+                    self._refill()
+                    if self.tokens >= amount and (priority or not self.priority_waiters):
+                        self.tokens -= amount
+                        # Let others re-check (e.g. non-priority callers once priority drains)
+                        self._condition.notify_all()
+                        return True
+
+                    wait = (amount - self.tokens) / self.rate if self.tokens < amount else 0.05
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        wait = min(wait, remaining)
+                    self._condition.wait(max(wait, 0.001))
+            finally:
+                if priority:
+                    self.priority_waiters -= 1
+                    self._condition.notify_all()
+
+    def try_acquire(self, amount=1):
+        """Take tokens if available right now, without waiting"""
+        with self._condition:
+            self._refill()
+            if self.tokens >= amount and not self.priority_waiters:
+                self.tokens -= amount
+                return True
+            return False
+
+    def drain(self, seconds):
+        """Push the bucket into debt, e.g. after the server asked us to back off
+
+        Idempotent: several calls reporting the same back-off at once wait it out once.
+        """
+        with self._condition:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
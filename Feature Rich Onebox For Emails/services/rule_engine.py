@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+RuleMatch = namedtuple('RuleMatch', ['name', 'category'])
+
+# Categories an email can be given, by rules or by the LLM
+VALID_CATEGORIES = ['interested', 'not_interested', 'meeting_booked', 'spam', 'out_of_office']
+
+# Built-in rules, checked in order. Out of office rules come first because
+# auto-replies frequently carry bulk headers as well.
+DEFAULT_RULES = [
+    {"name": "auto_submitted_reply", "category": "out_of_office", "header": "auto-submitted", "pattern": r"^auto-replied"},
+    {"name": "x_autoreply", "category": "out_of_office", "header": "x-autoreply", "pattern": r"\S"},
+    {"name": "x_autorespond", "category": "out_of_office", "header": "x-autorespond", "pattern": r"\S"},
+    {"name": "precedence_auto_reply", "category": "out_of_office", "header": "precedence", "pattern": r"^auto_reply$"},
+    {"name": "out_of_office_subject", "category": "out_of_office", "field": "subject",
+     "pattern": r"^(automatic reply|auto[- ]?reply|out of (the )?office|autoreply)\b"},
+    {"name": "precedence_bulk", "category": "spam", "header": "precedence", "pattern": r"^(bulk|junk)$"},
+    {"name": "list_unsubscribe", "category": "spam", "header": "list-unsubscribe", "pattern": r"\S"},
+]
+
+RULE_FIELDS = ('subject', 'sender', 'body_text')
+
+
+class Rule:
+    """A single compiled categorization rule"""
+
+    def __init__(self, name, category, pattern, header=None, field=None):
+        if bool(header) == bool(field):
+            raise ValueError(f"Rule '{name}' must set exactly one of 'header' or 'field'")
+        if field and field not in RULE_FIELDS:
+            raise ValueError(f"Rule '{name}' has unsupported field '{field}'")
+        if category not in VALID_CATEGORIES:
+            raise ValueError(f"Rule '{name}' has unknown category '{category}'")
+
+        self.name = name
+        self.category = category
+        self.header = header.lower() if header else None
+        self.field = field
+        self.regex = re.compile(pattern, re.IGNORECASE)
+
+    def matches(self, email, headers):
+        """Check whether the rule matches an email"""
+        if self.header:
+            values = headers.get(self.header, [])
+        else:
+            values = [getattr(email, self.field, None) or '']
+
+        return any(self.regex.search(value.strip()) for value in values)
+
+
+class RuleEngine:
+    """Deterministic header/pattern rules that categorize emails without the LLM
+
+    Rules are compiled once, on first use. Custom rules can be loaded from a JSON
+    file (CATEGORY_RULES_PATH) containing a list of objects with 'name',
+    'category', 'pattern' and either 'header' or 'field'. They are checked before
+    the built-in rules, which can be turned off with CATEGORY_RULES_DEFAULTS=false.
+    """
+
+    def __init__(self):
+        self.rules_path = os.environ.get('CATEGORY_RULES_PATH')
+        self.use_defaults = os.environ.get('CATEGORY_RULES_DEFAULTS', 'true').lower() != 'false'
+        self.rules = None
+        self.hits = {}
+        self.evaluated = 0
+        self.fallthrough = 0
+        self._lock = threading.Lock()
+
+    def load_rules(self):
+        """Compile the configured rule set"""
+        definitions = []
+
+        if self.rules_path:
+            try:
+                with open(self.rules_path) as f:
+                    definitions.extend(json.load(f))
+            except Exception as e:
+                logger.error(f"Error loading category rules from {self.rules_path}: {str(e)}")
+
+        if self.use_defaults:
+            definitions.extend(DEFAULT_RULES)
+
+        rules = []
+        for definition in definitions:
+            try:
+                rules.append(Rule(
+                    name=definition['name'],
+                    category=definition['category'],
+                    pattern=definition['pattern'],
+                    header=definition.get('header'),
+                    field=definition.get('field')
+                ))
+            except Exception as e:
+                logger.error(f"Skipping invalid category rule {definition!r}: {str(e)}")
+
+        with self._lock:
+            self.rules = rules
+            self.hits = {rule.name: 0 for rule in rules}
+
+        logger.info(f"Loaded {len(rules)} category rules")
+        return rules
+
+    def match(self, email):
+        """Return the first matching rule for an email, or None to fall through to the LLM"""
+        if self.rules is None:
+            self.load_rules()
+
+        headers = self._parse_headers(email)
+        matched = None
+
+        for rule in self.rules:
+            if rule.matches(email, headers):
+                matched = RuleMatch(rule.name, rule.category)
+                break
+
+        with self._lock:
+            self.evaluated += 1
+            if matched:
+                self.hits[matched.name] += 1
+            else:
+                self.fallthrough += 1
+
+        return matched
+
+    def get_stats(self):
+        """Get per-rule hit counters"""
+        with self._lock:
+            return {
+                "evaluated": self.evaluated,
+                "fallthrough": self.fallthrough,
+                "hits": dict(self.hits)
+            }
+
+    def _parse_headers(self, email):
+        """Get stored headers as a dict of lowercase name -> list of values"""
+        if not getattr(email, 'headers', None):
+            return {}
+
+        try:
+            headers = json.loads(email.headers)
+            return {name.lower(): list(values) for name, values in headers.items()}
+        except Exception as e:
+            logger.warning(f"Could not parse headers for email {email.id}: {str(e)}")
+            return {}
@@ -0,0 +1,204 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+import requests
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Headline and attachment color per category
+CATEGORY_MESSAGES = {
+    "interested": ("🔥 New Interested Lead!", "#36a64f"),  # green
+    "meeting_booked": ("📅 New Meeting Booked!", "#2eb6f2"),  # blue
+    "spam": ("🗑️ Spam Email Received", "#dddddd"),  # gray
+    "out_of_office": ("🏖️ Out of Office Reply", "#dddddd"),  # gray
+}
+DEFAULT_MESSAGE = ("📬 New Email Received", "#f2c744")  # yellow
+
+
+def email_payload(message, email, color="#36a64f"):
+    """Build a Slack message for a single email (a dict with id, subject, sender, category)"""
+    attachment = {
+        "color": color,
+        "pretext": message,
+        "mrkdwn_in": ["text", "pretext"]
+    }
+    if email:
+        attachment.update({
+            "title": email["subject"],
+            "text": f"From: {email['sender']}\nCategory: {email['category'] or 'uncategorized'}",
+            "footer": f"Email ID: {email['id']}"
+        })
+    return {"attachments": [attachment]}
+
+
+class SlackNotifier:
+    """Non-blocking, rate-limited Slack notifications for new email
+
+    Emails in SLACK_PRIORITY_CATEGORIES are posted individually as soon as
+    possible; everything else is summarized in a digest every
+    SLACK_DIGEST_INTERVAL seconds. Messages are sent from a background thread
+    and each Slack webhook URL has its own token bucket (Slack allows about
+    one message per second per incoming webhook). notify() only enqueues.
+    """
+
+    def __init__(self, webhook_url=None):
+        self.webhook_url = webhook_url or os.environ.get('SLACK_WEBHOOK_URL')
+        # High-priority and digest messages can go to different channels
+        self.priority_url = os.environ.get('SLACK_PRIORITY_WEBHOOK_URL') or self.webhook_url
+        self.digest_url = os.environ.get('SLACK_DIGEST_WEBHOOK_URL') or self.webhook_url
+
+        self.priority_categories = {
+            category.strip()
+            for category in os.environ.get('SLACK_PRIORITY_CATEGORIES', 'interested,meeting_booked').split(',')
+            if category.strip()
+        }
+        self.digest_interval = float(os.environ.get('SLACK_DIGEST_INTERVAL', '300'))
+        self.messages_per_second = float(os.environ.get('SLACK_MESSAGES_PER_SECOND', '1'))
+        self.digest_samples = 10
+
+        self.queue = queue.Queue(maxsize=1000)
+        self.buckets = {}
+        self.session = requests.Session()
+        self.stats = Counter()
+
+        self._digest = []
+        self._digest_started = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.priority_url or self.digest_url)
+
+    def notify(self, emails):
+        """Queue notifications for new emails without waiting for Slack"""
+        if not self.enabled:
+            return False
+
+        for email in emails:
+            # Copy what the message needs; the worker thread has no database session
+            summary = {
+                "id": email.id,
+                "subject": email.subject,
+                "sender": email.sender,
+                "category": email.category
+            }
+
+            if summary["category"] in self.priority_categories and self.priority_url:
+                message, color = CATEGORY_MESSAGES.get(summary["category"], DEFAULT_MESSAGE)
+                try:
+                    self.queue.put_nowait((self.priority_url, email_payload(message, summary, color)))
+                    self.stats["queued"] += 1
+                    continue
+                except queue.Full:
+                    # Slack is far behind; fall back to the digest rather than block ingest
+                    self.stats["overflowed"] += 1
+
+            with self._lock:
+                if not self._digest:
+                    self._digest_started = time.monotonic()
+                self._digest.append(summary)
+
+        self._ensure_worker()
+        return True
+
+    def flush(self):
+        """Queue the digest now instead of waiting for the interval"""
+        with self._lock:
+            emails, self._digest = self._digest, []
+            self._digest_started = None
+
+        if emails and self.digest_url:
+            try:
+                self.queue.put_nowait((self.digest_url, self._digest_payload(emails)))
+                self.stats["digests"] += 1
+            except queue.Full:
+                logger.warning(f"Slack queue full, dropped digest of {len(emails)} emails")
+                self.stats["dropped"] += len(emails)
+
+    def get_stats(self):
+        """Get notification counts and the current queue/digest sizes"""
+        with self._lock:
+            pending_digest = len(self._digest)
+        return dict(self.stats, queue_size=self.queue.qsize(), pending_digest=pending_digest)
+
+    def _ensure_worker(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='slack-notifier', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self._lock:
+                    digest_due = self._digest_started is not None and time.monotonic() - self._digest_started >= self.digest_interval
+                if digest_due:
+                    self.flush()
+
+                try:
+                    url, payload = self.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+                self._send(url, payload)
+            except Exception as e:
+                logger.error(f"Slack notifier error: {str(e)}")
+
+    def _send(self, url, payload):
+        """Post one message, waiting for the channel's rate budget"""
+        bucket = self.buckets.get(url)
+        if bucket is None:
+            bucket = self.buckets[url] = TokenBucket(self.messages_per_second, capacity=max(self.messages_per_second, 3))
+        bucket.acquire()
+
+        try:
+            response = self.session.post(url, json=payload, timeout=5)
+        except requests.RequestException as e:
+            logger.error(f"Error sending Slack notification: {str(e)}")
+            self.stats["failed"] += 1
+            return
+
+        if response.status_code == 429:
+            # Back off as told and requeue the message
+            try:
+                retry_after = float(response.headers.get('Retry-After', '1'))
+            except ValueError:
+                retry_after = 1.0
+            logger.warning(f"Slack rate limited us, pausing {retry_after:.0f}s")
+            bucket.drain(retry_after)
+            try:
+                self.queue.put_nowait((url, payload))
+            except queue.Full:
+                self.stats["dropped"] += 1
+        elif 200 <= response.status_code < 300:
+            self.stats["sent"] += 1
+        else:
+            logger.error(f"Slack notification failed: {response.status_code} {response.text}")
+            self.stats["failed"] += 1
+
+    def _digest_payload(self, emails):
+        counts = Counter(email["category"] or "uncategorized" for email in emails)
+        summary = ", ".join(f"{count} {category}" for category, count in counts.most_common())
+
+        lines = [f"• {email['subject'] or '(No Subject)'} — {email['sender']}" for email in emails[:self.digest_samples]]
+        if len(emails) > self.digest_samples:
+            lines.append(f"…and {len(emails) - self.digest_samples} more")
+
+        return {
+            "attachments": [
+                {
+                    "color": DEFAULT_MESSAGE[1],
+                    "pretext": f"📬 {len(emails)} new emails: {summary}",
+                    "text": "\n".join(lines),
+                    "mrkdwn_in": ["text", "pretext"]
+                }
+            ]
+        }
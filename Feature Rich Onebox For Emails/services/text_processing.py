@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:  # ImportError, or the encoding could not be downloaded
+    _encoding = None
+
+# Rough stand-in for BPE tokens when tiktoken isn't available: words and
+# individual punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+WHITESPACE = re.compile(r"\s+")
+BLANK_LINES = re.compile(r"\n\s*\n\s*\n+")
+
+# Lines where quoted history starts; everything from here on is dropped
+REPLY_HEADER = re.compile(r"^\s*On\b.{0,300}\bwrote:\s*$", re.IGNORECASE | re.DOTALL)  # Gmail, Apple Mail, Thunderbird
+QUOTE_SEPARATORS = [
+    re.compile(r"^\s*-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^\s*_{10,}\s*$"),  # Outlook
+]
+OUTLOOK_FROM = re.compile(r"^\s*\*?From:\*?\s", re.IGNORECASE)
+OUTLOOK_FIELDS = re.compile(r"^\s*\*?(Sent|Date|To|Subject):\*?\s", re.IGNORECASE)
+
+# Lines where a signature starts; everything from here on is dropped
+SIGNATURE_MARKERS = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^\s*Sent from my \w+", re.IGNORECASE),
+    re.compile(r"^\s*Get Outlook for \w+", re.IGNORECASE),
+]
+
+# Paragraphs that open with confidentiality boilerplate; only stripped from the
+# end of the body, where mail clients and gateways append them
+DISCLAIMER = re.compile(
+    r"^\W*(confidentiality notice\b"
+    r"|(this|the information (contained )?in this) (e-?mail|message|communication)"
+    r"( and any (attachments|files)[^.]*)? (is|are|may be|contains?) (strictly )?(confidential|privileged)"
+    r"|(this (e-?mail|message)( and any (attachments|files)[^.]*)? (is|are) )?"
+    r"intended (solely |only )*for the (use of the )?(individual|person|addressee|(intended )?recipient)"
+    r"|if you (are not the intended recipient|have received this (e-?mail|message) in error))",
+    re.IGNORECASE
+)
+
+
+def content_hash(text):
+    """Hash text after collapsing whitespace, for deduplication"""
+    return hashlib.sha256(WHITESPACE.sub(' ', text or '').strip().encode('utf-8')).hexdigest()
+
+
+def count_tokens(text):
+    """Count tokens in text (exact with tiktoken, approximate otherwise)"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def chunk_text(text, max_tokens=500, overlap=50):
+    """Split text into overlapping chunks of at most max_tokens tokens"""
+    if not text or not text.strip():
+        return []
+    if max_tokens <= 0 or not 0 <= overlap < max_tokens:
+        raise ValueError("max_tokens must be positive and overlap from 0 to max_tokens - 1")
+
+    step = max_tokens - overlap
+
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return [
+            _encoding.decode(tokens[start:start + max_tokens]).strip()
+            for start in range(0, max(len(tokens) - overlap, 1), step)
+        ]
+
+    # Slice the original text at token boundaries so formatting is kept
+    spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+    chunks = []
+    for start in range(0, max(len(spans) - overlap, 1), step):
+        window = spans[start:start + max_tokens]
+        chunks.append(text[window[0][0]:window[-1][1]].strip())
+    return chunks
+
+
+def clean_email_body(text):
+    """Strip quoted history, signatures and legal disclaimers from an email body"""
+    if not text:
+        return ''
+
+    lines = text.replace('\r\n', '\n').split('\n')
+    kept = []
+    for i, line in enumerate(lines):
+        # Reply headers often wrap onto a second line
+        next_line = lines[i + 1] if i + 1 < len(lines) else ''
+        if REPLY_HEADER.match(line) or REPLY_HEADER.match(f"{line} {next_line}"):
+            break
+        if any(pattern.match(line) for pattern in QUOTE_SEPARATORS):
+            break
+        if OUTLOOK_FROM.match(line) and any(OUTLOOK_FIELDS.match(following) for following in lines[i + 1:i + 4]):
+            break
+        if any(pattern.match(line) for pattern in SIGNATURE_MARKERS):
+            break
+        if line.lstrip().startswith('>'):
+            continue
+        kept.append(line)
+
+    paragraphs = re.split(r"\n\s*\n", '\n'.join(kept).strip())
+    # Only the trailing block: a paragraph mentioning confidentiality mid-email is content
+    while paragraphs and DISCLAIMER.match(paragraphs[-1]):
+        paragraphs.pop()
+    return BLANK_LINES.sub('\n\n', '\n\n'.join(paragraphs)).strip()
+
+
+def make_snippet(text, length=200):
+    """Get a one-line preview of at most length characters"""
+    text = WHITESPACE.sub(' ', text or '').strip()
+    if len(text) <= length:
+        return text
+    return text[:length - 1].rstrip() + '…'
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text to at most max_tokens tokens, keeping the beginning
+
+    Emails are top-posted, so once quoted history is removed the beginning is
+    the newest content.
+    """
+    if not text or max_tokens <= 0:
+        return ''
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return _encoding.decode(tokens[:max_tokens]).rstrip()
+
+    for count, match in enumerate(TOKEN_PATTERN.finditer(text), 1):
+        if count == max_tokens:
+            return text[:match.end()]
+    return text
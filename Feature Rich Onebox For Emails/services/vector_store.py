@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import func, select, update
+from models import VectorEntry
+from app import db
+from services.ann_index import IvfPqIndex
+
+logger = logging.getLogger(__name__)
+
+
+def pack_vector(vector):
+    """Pack an embedding into a float32 blob"""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def unpack_vector(blob):
+    """Unpack a float32 blob into an embedding"""
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def normalize_rows(vectors):
+    """Scale vectors to unit length so inner product is cosine similarity"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class VectorStore:
+    """In-memory matrix of RAG embeddings for fast similarity search
+
+    All VectorEntry embeddings are kept resident as a single row-normalized
+    float32 matrix, so a top-k query is one matrix-vector product plus
+    argpartition. New rows are appended incrementally; a full reload only
+    happens when rows were deleted behind our back.
+
+    With VECTOR_INDEX=ivfpq, searches go through an approximate IVF-PQ index
+    persisted in VECTOR_INDEX_DIR instead (built with 'flask vector-index-build'),
+    and the full matrix is never loaded. Rows added after the build are
+    inserted into the index incrementally.
+    """
+
+    # Counting rows is much slower than max(id), so deletions are only
+    # checked for this often
+    recount_interval = 60
+
+    def __init__(self):
+        self.matrix = None  # Pre-allocated, only the first `size` rows are valid
+        self.ids = None
+        self.size = 0
+        self.last_id = 0
+        self.counted_at = 0
+        self._lock = threading.Lock()
+
+        self.backend = os.environ.get('VECTOR_INDEX', 'exact')  # exact, ivfpq
+        self.index_dir = os.environ.get('VECTOR_INDEX_DIR', 'data/vector_index')
+        self.nprobe = int(os.environ.get('VECTOR_INDEX_NPROBE', '0')) or None
+        self.rerank = int(os.environ['VECTOR_INDEX_RERANK']) if os.environ.get('VECTOR_INDEX_RERANK') else None
+        self.index = None
+        self.index_load_attempted = False
+
+    def refresh(self):
+        """Load rows added since the last refresh (by this or another process)"""
+        if self._get_index() is not None:
+            # The ANN index picks up new rows itself at search time
+            return 0
+
+        table = VectorEntry.__table__
+        recount = time.monotonic() - self.counted_at > self.recount_interval
+
+        with db.engine.connect() as conn:
+            max_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            count = conn.execute(select(func.count(table.c.id))).scalar() if recount else None
+
+        with self._lock:
+            if recount:
+                self.counted_at = time.monotonic()
+            if max_id < self.last_id or (count is not None and count < self.size):
+                # Rows were deleted, start over
+                self.matrix, self.ids, self.size, self.last_id = None, None, 0, 0
+            elif max_id == self.last_id:
+                return 0
+            last_id = self.last_id
+
+        ids, vectors = self._load_rows(last_id)
+        if len(ids):
+            self.add(ids, vectors)
+        return len(ids)
+
+    def add(self, ids, vectors):
+        """Append rows to the matrix"""
+        vectors = normalize_rows(vectors)
+
+        with self._lock:
+            # Rows may already be loaded if a refresh raced an explicit add
+            new = np.asarray(ids, dtype=np.int64) > self.last_id
+            if not new.any():
+                return
+            ids = np.asarray(ids, dtype=np.int64)[new]
+            vectors = vectors[new]
+
+            needed = self.size + len(ids)
+            if self.matrix is None or needed > len(self.matrix):
+                # Grow geometrically so incremental adds stay amortized O(1)
+                capacity = max(needed, 2 * (len(self.matrix) if self.matrix is not None else 0), 1024)
+                matrix = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+                id_buffer = np.empty(capacity, dtype=np.int64)
+                if self.matrix is not None:
+                    matrix[:self.size] = self.matrix[:self.size]
+                    id_buffer[:self.size] = self.ids[:self.size]
+                self.matrix, self.ids = matrix, id_buffer
+
+            self.matrix[self.size:needed] = vectors
+            self.ids[self.size:needed] = ids
+            self.size = needed
+            self.last_id = int(ids.max())
+
+    def search(self, query_vector, limit=3):
+        """Find the most similar rows
+
+        Returns a list of (entry_id, similarity) tuples, most similar first.
+        """
+        index = self._get_index()
+        if index is not None:
+            return self._search_index(index, query_vector, limit)
+
+        self.refresh()
+
+        with self._lock:
+            if not self.size:
+                return []
+            matrix = self.matrix[:self.size]
+            ids = self.ids[:self.size]
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = matrix @ query
+        limit = min(limit, len(scores))
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def build_index(self, nlist=1024, m=16, sample_size=50000, iterations=10):
+        """Train an IVF-PQ index on the stored vectors and persist it"""
+        rng = np.random.default_rng(0)
+        sample = None
+        seen = 0
+
+        # Reservoir-sample training vectors in one streaming pass
+        for ids, vectors in self._iter_rows(0):
+            if sample is None:
+                sample = np.empty((sample_size, vectors.shape[1]), dtype=np.float32)
+            for vector in normalize_rows(vectors):
+                if seen < sample_size:
+                    sample[seen] = vector
+                else:
+                    slot = rng.integers(0, seen + 1)
+                    if slot < sample_size:
+                        sample[slot] = vector
+                seen += 1
+
+        if not seen:
+            raise ValueError("No vectors stored, nothing to index")
+
+        sample = sample[:min(seen, sample_size)]
+        index = IvfPqIndex(dim=sample.shape[1], nlist=min(nlist, len(sample)), m=m)
+        index.train(sample, iterations=iterations)
+
+        for ids, vectors in self._iter_rows(0):
+            index.add(ids, normalize_rows(vectors))
+
+        index.save(self.index_dir)
+        with self._lock:
+            self.index = index
+            self.index_load_attempted = True
+        return index
+
+    def _get_index(self):
+        """Get the ANN index if it is enabled and has been built"""
+        if self.backend != 'ivfpq':
+            return None
+
+        if not self.index_load_attempted:
+            with self._lock:
+                if not self.index_load_attempted:
+                    self.index_load_attempted = True
+                    if os.path.exists(os.path.join(self.index_dir, 'meta.json')):
+                        try:
+                            self.index = IvfPqIndex.load(self.index_dir, nprobe=self.nprobe, rerank=self.rerank)
+                        except Exception as e:
+                            logger.error(f"Error loading vector index: {str(e)}")
+                    else:
+                        logger.warning(f"No vector index at {self.index_dir}, using exact search")
+
+        return self.index
+
+    def _search_index(self, index, query_vector, limit):
+        """Search the ANN index after inserting rows it hasn't seen yet"""
+        table = VectorEntry.__table__
+        with db.engine.connect() as conn:
+            max_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+
+        if max_id > index.last_id:
+            with self._lock:
+                if max_id > index.last_id:
+                    for ids, vectors in self._iter_rows(index.last_id):
+                        index.add(ids, normalize_rows(vectors))
+
+        query = normalize_rows(query_vector)[0]
+        ids, scores = index.search(query, limit, fetch_vectors=self._fetch_vectors)
+        return [(int(entry_id), float(score)) for entry_id, score in zip(ids, scores)]
+
+    def _fetch_vectors(self, ids):
+        """Get exact vectors for ids; rows deleted since indexing come back as zeros"""
+        table = VectorEntry.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(select(table.c.id, table.c.vector).where(table.c.id.in_([int(i) for i in ids])))
+            found = {entry_id: unpack_vector(blob) for entry_id, blob in rows if blob is not None}
+
+        dim = len(next(iter(found.values()))) if found else 1
+        vectors = np.zeros((len(ids), dim), dtype=np.float32)
+        for position, entry_id in enumerate(ids):
+            if int(entry_id) in found:
+                vectors[position] = found[int(entry_id)]
+        return normalize_rows(vectors) if found else vectors
+
+    def _load_rows(self, after_id):
+        """Load all rows with id > after_id as (ids, vectors)"""
+        chunks = list(self._iter_rows(after_id))
+        if not chunks:
+            return np.empty(0, dtype=np.int64), None
+        return np.concatenate([ids for ids, _ in chunks]), np.vstack([vectors for _, vectors in chunks])
+
+    def _iter_rows(self, after_id, chunk_size=10000):
+        """Stream rows with id > after_id in chunks of (ids, vectors)"""
+        table = VectorEntry.__table__
+
+        while True:
+            ids, vectors, legacy = [], [], []
+            with db.engine.connect() as conn:
+                rows = conn.execute(
+                    select(table.c.id, table.c.vector, table.c.embedding)
+                    .where(table.c.id > after_id)
+                    .order_by(table.c.id)
+                    .limit(chunk_size)
+                )
+                for entry_id, blob, embedding in rows:
+                    if blob is None:
+                        # Row written before packed vectors; convert it once
+                        vector = np.asarray(json.loads(embedding), dtype=np.float32)
+                        legacy.append((entry_id, vector))
+                    else:
+                        vector = unpack_vector(blob)
+                    ids.append(entry_id)
+                    vectors.append(vector)
+
+            if legacy:
+                self._pack_legacy(legacy)
+            if not ids:
+                return
+
+            yield np.asarray(ids, dtype=np.int64), np.vstack(vectors)
+            after_id = ids[-1]
+
+    def _pack_legacy(self, rows):
+        """Store packed vectors for rows that only have JSON embeddings"""
+        try:
+            table = VectorEntry.__table__
+            with db.engine.begin() as conn:
+                for entry_id, vector in rows:
+                    conn.execute(update(table).where(table.c.id == entry_id).values(vector=pack_vector(vector)))
+            logger.info(f"Packed {len(rows)} legacy vector embeddings")
+        except Exception as e:
+            logger.error(f"Error packing legacy embeddings: {str(e)}")
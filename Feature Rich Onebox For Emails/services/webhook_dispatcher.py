@@ -0,0 +1,319 @@
+import hashlib
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from app import app, db
+from models import Webhook, WebhookBatch, WebhookDelivery
+
+logger = logging.getLogger(__name__)
+
+# Client errors that a retry could fix; any other 4xx is dead-lettered immediately
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429}
+
+
+def signature_headers(secret, body):
+    """Sign a request body so receivers can verify it came from us
+
+    The signature is HMAC-SHA256 over "<timestamp>.<body>" with the webhook's
+    secret; including the timestamp lets receivers reject replays.
+    """
+    if not secret:
+        return {}
+    timestamp = str(int(time.time()))
+    digest = hmac.new(secret.encode('utf-8'), f"{timestamp}.{body}".encode('utf-8'), hashlib.sha256).hexdigest()
+    return {"X-Webhook-Timestamp": timestamp, "X-Webhook-Signature": f"sha256={digest}"}
+
+
+class WebhookDispatcher:
+    """Background delivery of queued webhook calls
+
+    Due rows in the webhook_delivery outbox are claimed with a lease (so
+    several processes can run dispatchers without double-sending) and posted
+    from a worker pool. Each worker keeps its own keep-alive HTTP session.
+    Webhooks with a batch_size get their events coalesced into one request
+    per batch; requests to webhooks with a secret are HMAC-signed.
+    Failures are retried with jittered exponential backoff; after
+    WEBHOOK_MAX_ATTEMPTS, or on a non-retryable 4xx, a delivery is marked
+    dead and kept for inspection.
+    """
+
+    def __init__(self):
+        self.workers = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+        self.timeout = float(os.environ.get('WEBHOOK_TIMEOUT', '5'))
+        self.max_attempts = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+        self.poll_interval = float(os.environ.get('WEBHOOK_POLL_INTERVAL', '1'))
+        self.backoff_base = 5.0
+        self.backoff_cap = 3600.0
+        # Long enough that a claimed delivery is finished before anyone else may take it
+        self.lease = timedelta(seconds=self.timeout * 2 + 30)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='webhook')
+        self._sessions = threading.local()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the dispatch loop on a daemon thread (no-op if running)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook dispatcher started with {self.workers} workers")
+
+    def stop(self):
+        """Ask the dispatch loop to exit after its current deliveries"""
+        self._stop.set()
+
+    def run(self):
+        """Deliver due webhooks until stop() is called"""
+        in_flight = {}
+        with app.app_context():
+            while not self._stop.is_set():
+                try:
+                    self._form_batches()
+
+                    capacity = self.workers * 2 - len(in_flight)
+                    if capacity > 0:
+                        for key, request in self._claim(capacity):
+                            in_flight[self.executor.submit(self._post, request)] = key
+
+                    if not in_flight:
+                        self._stop.wait(self.poll_interval)
+                        continue
+
+                    # Record results as they come in so a slow endpoint only holds its own worker
+                    done, _ = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    self._record({in_flight.pop(future): future.result() for future in done})
+
+                except Exception as e:
+                    logger.error(f"Webhook dispatcher error: {str(e)}")
+                    db.session.rollback()
+                    self._stop.wait(self.poll_interval)
+
+            # Let in-flight deliveries finish and record them
+            if in_flight:
+                done, _ = wait(in_flight)
+                self._record({in_flight[future]: future.result() for future in done})
+
+    def dispatch_pending(self):
+        """Deliver everything currently due and wait for the results
+
+        Batches still inside their window are left for later. Returns the
+        number of requests attempted.
+        """
+        attempted = 0
+        while True:
+            self._form_batches()
+            claimed = self._claim(self.workers * 4)
+            if not claimed:
+                return attempted
+            futures = {self.executor.submit(self._post, request): key for key, request in claimed}
+            self._record({key: future.result() for future, key in futures.items()})
+            attempted += len(claimed)
+
+    def get_stats(self):
+        """Count outbox rows and batches by status, with batch size and latency averages"""
+        deliveries = db.session.query(WebhookDelivery.status, db.func.count(WebhookDelivery.id)).group_by(WebhookDelivery.status)
+        batches = db.session.query(
+            WebhookBatch.status,
+            db.func.count(WebhookBatch.id),
+            db.func.avg(WebhookBatch.size),
+            db.func.avg(WebhookBatch.last_duration_ms)
+        ).group_by(WebhookBatch.status)
+
+        return {
+            "deliveries": {status: count for status, count in deliveries},
+            "batches": {
+                status: {
+                    "count": count,
+                    "avg_size": round(float(avg_size or 0), 1),
+                    "avg_duration_ms": round(float(avg_duration or 0), 1)
+                }
+                for status, count, avg_size, avg_duration in batches
+            }
+        }
+
+    def _form_batches(self):
+        """Group pending deliveries of batched webhooks into batches
+
+        A webhook gets a batch once it has batch_size pending events or its
+        oldest pending event has waited batch_window seconds.
+        """
+        now = datetime.utcnow()
+        backlog = db.session.query(
+            Webhook,
+            db.func.count(WebhookDelivery.id),
+            db.func.min(WebhookDelivery.created_at)
+        ).join(WebhookDelivery).filter(
+            Webhook.batch_size > 1,
+            Webhook.active == True,
+            WebhookDelivery.status == 'pending',
+            WebhookDelivery.batch_id.is_(None)
+        ).group_by(Webhook.id).all()
+
+        formed = 0
+        for webhook, pending, oldest in backlog:
+            window_elapsed = oldest <= now - timedelta(seconds=webhook.batch_window or 0)
+            batches = -(-pending // webhook.batch_size) if window_elapsed else pending // webhook.batch_size
+
+            for _ in range(batches):
+                deliveries = WebhookDelivery.query.filter(
+                    WebhookDelivery.webhook_id == webhook.id,
+                    WebhookDelivery.status == 'pending',
+                    WebhookDelivery.batch_id.is_(None)
+                ).order_by(WebhookDelivery.id).limit(webhook.batch_size).with_for_update(skip_locked=True).all()
+                if not deliveries:
+                    break
+
+                batch = WebhookBatch(webhook_id=webhook.id, size=len(deliveries), next_attempt_at=now)
+                db.session.add(batch)
+                db.session.flush()
+                for delivery in deliveries:
+                    delivery.batch_id = batch.id
+                    delivery.status = 'batched'
+                formed += 1
+
+        if formed:
+            db.session.commit()
+            logger.debug(f"Formed {formed} webhook batches")
+
+    def _claim(self, limit):
+        """Lease up to limit due deliveries and batches
+
+        Returns ((model, id), request) pairs.
+        """
+        now = datetime.utcnow()
+
+        # Deliveries of active batched webhooks are sent through batches instead
+        deliveries = WebhookDelivery.query.join(Webhook).filter(
+            WebhookDelivery.status == 'pending',
+            WebhookDelivery.next_attempt_at <= now,
+            db.or_(Webhook.batch_size.is_(None), Webhook.batch_size <= 1, Webhook.active == False)
+        ).order_by(WebhookDelivery.next_attempt_at).limit(limit).with_for_update(of=WebhookDelivery, skip_locked=True).all()
+
+        batches = WebhookBatch.query.filter(
+            WebhookBatch.status == 'pending',
+            WebhookBatch.next_attempt_at <= now
+        ).order_by(WebhookBatch.next_attempt_at).limit(limit).with_for_update(skip_locked=True).all()
+
+        webhook_ids = {item.webhook_id for item in deliveries + batches}
+        webhooks = {webhook.id: webhook for webhook in Webhook.query.filter(Webhook.id.in_(webhook_ids))} if webhook_ids else {}
+
+        claimed = []
+        for item in deliveries + batches:
+            webhook = webhooks.get(item.webhook_id)
+            if not webhook or not webhook.active:
+                self._mark_dead(item, "Webhook disabled")
+                continue
+
+            item.next_attempt_at = now + self.lease
+            if isinstance(item, WebhookBatch):
+                payloads = [delivery.payload for delivery in sorted(item.deliveries, key=lambda delivery: delivery.id)]
+                body = f'{{"batch_id": {item.id}, "events": [{", ".join(payloads)}]}}'
+                headers = {"X-Webhook-Event": "batch", "X-Webhook-Batch": str(item.id)}
+            else:
+                body = item.payload
+                # Lets receivers drop duplicates of an at-least-once delivery
+                headers = {"X-Webhook-Event": item.event, "X-Webhook-Delivery": str(item.id)}
+
+            headers["Content-Type"] = "application/json"
+            headers.update(signature_headers(webhook.secret, body))
+            claimed.append(((type(item), item.id), {"url": webhook.url, "body": body, "headers": headers}))
+
+        db.session.commit()
+        return claimed
+
+    def _post(self, request):
+        """Send one request; runs on a worker thread without touching the database
+
+        Returns (status_code or None, error or None, retry_after or None, duration in ms).
+        """
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=4))
+            session.mount('https://', HTTPAdapter(pool_maxsize=4))
+            self._sessions.session = session
+
+        start = time.monotonic()
+        try:
+            response = session.post(request["url"], data=request["body"], headers=request["headers"], timeout=self.timeout)
+            duration = int((time.monotonic() - start) * 1000)
+            if 200 <= response.status_code < 300:
+                return response.status_code, None, None, duration
+            return response.status_code, f"HTTP {response.status_code}: {response.text[:500]}", self._retry_after(response), duration
+        except Exception as e:  # connection errors, timeouts, invalid URLs
+            return None, str(e), None, int((time.monotonic() - start) * 1000)
+
+    def _record(self, results):
+        """Store request outcomes, scheduling retries or dead-lettering"""
+        if not results:
+            return
+
+        now = datetime.utcnow()
+        for model in (WebhookDelivery, WebhookBatch):
+            ids = [item_id for item_model, item_id in results if item_model is model]
+            if not ids:
+                continue
+
+            for item in model.query.filter(model.id.in_(ids)).all():
+                status_code, error, retry_after, duration = results[(model, item.id)]
+                item.attempts += 1
+                item.last_status_code = status_code
+                item.last_error = error
+                if model is WebhookBatch:
+                    item.last_duration_ms = duration
+
+                label = f"{'Webhook batch' if model is WebhookBatch else 'Webhook delivery'} {item.id} to {item.webhook.name}"
+
+                if error is None:
+                    item.status = 'delivered'
+                    item.delivered_at = now
+                    item.webhook.last_triggered = now
+                    if model is WebhookBatch:
+                        self._update_batch_deliveries(item)
+                    continue
+
+                retryable = status_code is None or status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+                if not retryable or item.attempts >= self.max_attempts:
+                    self._mark_dead(item, error)
+                    logger.error(f"{label} failed permanently after {item.attempts} attempts: {error}")
+                    continue
+
+                delay = retry_after or random.uniform(0.5, 1) * min(self.backoff_cap, self.backoff_base * 2 ** (item.attempts - 1))
+                item.next_attempt_at = now + timedelta(seconds=delay)
+                logger.warning(f"{label} failed ({error[:100]}), retrying in {delay:.0f}s")
+
+        db.session.commit()
+
+    def _mark_dead(self, item, error):
+        item.status = 'dead'
+        item.last_error = error
+        if isinstance(item, WebhookBatch):
+            self._update_batch_deliveries(item)
+
+    @staticmethod
+    def _update_batch_deliveries(batch):
+        """Copy a batch's final outcome onto its deliveries"""
+        WebhookDelivery.query.filter_by(batch_id=batch.id).update({
+            "status": batch.status,
+            "attempts": batch.attempts,
+            "last_status_code": batch.last_status_code,
+            "last_error": batch.last_error,
+            "delivered_at": batch.delivered_at
+        }, synchronize_session=False)
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return None
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# app.py reads the database URL at import; tests run against in-memory SQLite
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    """The app's database in an app context, emptied after the test"""
+    from app import app, db
+
+    with app.app_context():
+        yield db
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+import pytest
+import email_threads
+from email_threads import assign_thread, normalize_subject
+from models import Email, EmailAccount, EmailThread, ThreadReference
+
+START = datetime(2025, 3, 1, 9, 0)
+
+
+@pytest.fixture
+def account(db):
+    account = EmailAccount(name='Sales', email='sales@example.com', host='imap.example.com', password='secret')
+    db.session.add(account)
+    db.session.commit()
+    return account
+
+
+@pytest.fixture
+def store(db, account):
+    uids = iter(range(1, 1000))
+
+    def store(subject, message_id=None, in_reply_to=None, references=(), days=0):
+        date = START + timedelta(days=days)
+        email = Email(account_id=account.id, folder='INBOX', uid=next(uids), subject=subject,
+                      message_id=message_id, in_reply_to=in_reply_to,
+                      reference_ids=' '.join(references) or None, date=date, received_date=date)
+        db.session.add(email)
+        db.session.flush()
+        assign_thread(email)
+        db.session.commit()
+        return email
+    return store
+
+
+@pytest.mark.parametrize('subject, expected', [
+    ('Pricing', 'pricing'),
+    ('RE: Fwd: [sales-list]  Pricing   for 2025', 'pricing for 2025'),
+    ('Re[2]: AW: Pricing', 'pricing'),
+    ('  ', None),
+    (None, None),
+])
+def test_normalize_subject(subject, expected):
+    assert normalize_subject(subject) == expected
+
+
+def test_header_ids():
+    headers = {'message-id': ['<c@example.com>'], 'In-Reply-To': ['<b@example.com>'],
+               'references': ['<a@example.com> <b@example.com> <a@example.com>']}
+    assert email_threads.header_ids(headers) == ('c@example.com', 'b@example.com', 'a@example.com b@example.com')
+
+
+def test_reply_joins_its_parents_thread(store):
+    root = store('Pricing', 'm1')
+    reply = store('Re: Pricing', 'm2', in_reply_to='m1', references=['m1'], days=1)
+
+    thread = reply.thread
+    assert root.thread_id == thread.id
+    assert thread.message_count == 2
+    assert thread.last_email_id == reply.id
+    assert thread.last_date == reply.date
+
+
+def test_root_arriving_after_its_reply(store):
+    reply = store('Re: Deal', 'm2', in_reply_to='m1', references=['m1'], days=1)
+    root = store('Deal', 'm1')
+
+    thread = root.thread
+    assert reply.thread_id == thread.id
+    assert thread.message_count == 2
+    # The earliest message names the thread, the latest stays the latest
+    assert thread.subject == 'Deal'
+    assert thread.first_date == root.date
+    assert thread.last_email_id == reply.id
+
+
+def test_message_referencing_two_threads_merges_them(db, store):
+    first = store('Pricing', 'm1')
+    second = store('Contract', 'm3', days=1)
+    assert first.thread_id != second.thread_id
+    merged_away = second.thread_id
+
+    bridge = store('Re: Contract', 'm4', in_reply_to='m3', references=['m1', 'm3'], days=2)
+
+    thread_id = first.thread_id
+    assert {email.thread_id for email in Email.query} == {thread_id}
+    assert bridge.thread_id == thread_id
+    assert db.session.get(EmailThread, merged_away) is None
+    assert {ref.thread_id for ref in ThreadReference.query} == {thread_id}
+    thread = db.session.get(EmailThread, thread_id)
+    assert thread.message_count == 3
+    assert thread.last_email_id == bridge.id
+
+
+def test_reply_without_headers_falls_back_to_subject(store):
+    root = store('Pricing', 'm1')
+    reply = store('RE: [ext] Pricing', 'm2', days=3)
+    assert reply.thread_id == root.thread_id
+
+
+def test_subject_fallback_needs_a_reply_prefix(store):
+    root = store('Pricing', 'm1')
+    repeat = store('Pricing', 'm2', days=1)
+    assert repeat.thread_id != root.thread_id
+
+
+def test_subject_fallback_only_within_the_window(store):
+    root = store('Pricing', 'm1')
+    late = store('Re: Pricing', 'm2', days=email_threads.SUBJECT_WINDOW.days + 1)
+    assert late.thread_id != root.thread_id
@@ -0,0 +1,69 @@
+import pytest
+from services.html_sanitizer import sanitize_html
+
+
+@pytest.mark.parametrize('style', [
+    r'background:\75rl(https://tracker.example/p.gif)',
+    r'background:u\72l(https://tracker.example/p.gif)',
+    'background:&#92;75rl(https://tracker.example/p.gif)',
+    'background:url /**/(https://tracker.example/p.gif)',
+    'background:URL(https://tracker.example/p.gif)',
+    'background-image:image-set("https://tracker.example/p.gif" 1x)',
+    'width:expression(alert(1))',
+])
+def test_drops_styles_that_load_resources(style):
+    html, _ = sanitize_html(f'<div style="{style}">Hi</div>')
+    assert html == '<div>Hi</div>'
+
+
+def test_keeps_plain_styles():
+    html, _ = sanitize_html('<p style="color:#333;font-size:14px">Hi</p>')
+    assert html == '<p style="color:#333;font-size:14px">Hi</p>'
+
+
+@pytest.mark.parametrize('href', [
+    'javascript:alert(1)',
+    ' JaVaScRiPt:alert(1)',
+    'java&#x09;script:alert(1)',
+    '&#106;avascript:alert(1)',
+    'vbscript:msgbox(1)',
+    'data:text/html;base64,PHNjcmlwdD5hbGVydCgxKTwvc2NyaXB0Pg==',
+])
+def test_drops_script_hrefs(href):
+    html, _ = sanitize_html(f'<a href="{href}">link</a>')
+    assert html == '<a rel="noopener noreferrer">link</a>'
+
+
+def test_keeps_web_and_mail_links():
+    html, _ = sanitize_html('<a href="https://example.com/a?b=1&amp;c=2">x</a><a href="mailto:a@example.com">y</a>')
+    assert 'href="https://example.com/a?b=1&amp;c=2"' in html
+    assert 'href="mailto:a@example.com"' in html
+
+
+def test_drops_srcset_and_unsafe_image_sources():
+    html, _ = sanitize_html(
+        '<img src="https://cdn.example.com/a.png" srcset="https://tracker.example/p.gif 2x">'
+        '<img src="javascript:alert(1)"><img src="data:image/svg+xml;base64,PHN2Zz4=">'
+    )
+    assert html == '<img src="https://cdn.example.com/a.png"><img><img>'
+
+
+@pytest.mark.parametrize('payload', [
+    '<svg><script>alert(1)</script></svg>',
+    '<svg onload="alert(1)"><a href="https://example.com">x</a></svg>',
+    '<svg/onload=alert(1)>',
+    '<math><mtext><table><mglyph><style><img src=x onerror=alert(1)></style></mglyph></table></mtext></math>',
+    '<svg><foreignObject><img src="https://tracker.example/p.gif" onerror="alert(1)"></foreignObject></svg>',
+])
+def test_drops_svg_and_math_with_their_content(payload):
+    html, text = sanitize_html(f'<p>before</p>{payload}')
+    assert html.startswith('<p>before</p>')
+    for fragment in ('svg', 'math', 'img', 'onerror', 'onload', 'script', 'alert', 'tracker'):
+        assert fragment not in html.lower()
+    assert 'alert' not in text
+
+
+def test_drops_event_handlers_and_escapes_text():
+    html, text = sanitize_html('<p onclick="alert(1)" title="a&quot;b">1 &lt; 2 <b>bold</b></p>')
+    assert html == '<p title="a&quot;b">1 &lt; 2 <b>bold</b></p>'
+    assert text == '1 < 2 bold'
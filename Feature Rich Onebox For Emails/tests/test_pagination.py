@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+import pytest
+from models import Email, EmailAccount
+from pagination import InvalidCursor, decode_cursor, encode_cursor, paginate_emails
+
+START = datetime(2025, 3, 1, 9, 0)
+
+
+@pytest.mark.parametrize('sort_date', [datetime(2025, 3, 1, 9, 30, 15, 123456), None])
+def test_cursor_round_trip(sort_date):
+    assert decode_cursor(encode_cursor(sort_date, 42)) == (sort_date, 42)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not-a-cursor', encode_cursor(START, 1)[:-3]])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+@pytest.fixture
+def emails(db):
+    account = EmailAccount(name='Sales', email='sales@example.com', host='imap.example.com', password='secret')
+    db.session.add(account)
+    db.session.commit()
+    # Pairs share a date to exercise the id tiebreak; some have no date at all
+    dates = [START + timedelta(hours=i // 2) for i in range(7)] + [None, None, None]
+    db.session.execute(Email.__table__.insert(), [
+        {'account_id': account.id, 'folder': 'INBOX', 'uid': uid, 'subject': f'Email {uid}', 'received_date': date}
+        for uid, date in enumerate(dates, 1)
+    ])
+    db.session.commit()
+    # Newest first, emails without a date ahead of the rest
+    return [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def test_pages_forward_and_back(emails):
+    pages, cursor = [], None
+    while True:
+        page, next_cursor, prev_cursor = paginate_emails(Email.query, after=cursor, per_page=3)
+        assert (prev_cursor is None) == (cursor is None)
+        pages.append([email.id for email in page])
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+    assert pages == [[10, 9, 8], [7, 6, 5], [4, 3, 2], [1]]
+
+    # And back again from the last page
+    _, _, cursor = paginate_emails(Email.query, after=cursor, per_page=3)
+    back = []
+    while cursor:
+        page, _, cursor = paginate_emails(Email.query, before=cursor, per_page=3)
+        back.append([email.id for email in page])
+    assert back == [[4, 3, 2], [7, 6, 5], [10, 9, 8]]
+
+
+def test_page_inside_emails_without_a_date(emails):
+    page, next_cursor, prev_cursor = paginate_emails(Email.query, per_page=2)
+    assert [email.id for email in page] == [10, 9]
+    assert decode_cursor(next_cursor) == (None, 9)
+
+    page, next_cursor, prev_cursor = paginate_emails(Email.query, after=next_cursor, per_page=2)
+    assert [email.id for email in page] == [8, 7]
+
+    page, _, prev_cursor = paginate_emails(Email.query, before=prev_cursor, per_page=2)
+    assert [email.id for email in page] == [10, 9]
+    assert prev_cursor is None
@@ -0,0 +1,42 @@
+from services.text_processing import clean_email_body
+
+
+def test_keeps_request_that_mentions_disclaimer():
+    body = (
+        "Hi Anna,\n\n"
+        "Thanks, we are interested. Can you send the disclaimer wording for our site?\n\n"
+        "Best,\nMark"
+    )
+    assert "Can you send the disclaimer wording for our site?" in clean_email_body(body)
+
+
+def test_keeps_confidentiality_language_before_the_end():
+    body = (
+        "Hi,\n\n"
+        "This message is confidential until the launch, please don't forward it.\n\n"
+        "We'd like to book a demo next week.\n\n"
+        "Thanks"
+    )
+    assert "This message is confidential until the launch" in clean_email_body(body)
+
+
+def test_strips_trailing_confidentiality_notice():
+    body = (
+        "Hi,\n\n"
+        "We'd like to book a demo next week.\n\n"
+        "Thanks,\nMark\n\n"
+        "CONFIDENTIALITY NOTICE: This email and any attachments are for the exclusive use of the addressee.\n\n"
+        "If you are not the intended recipient, please delete this message."
+    )
+    assert clean_email_body(body) == "Hi,\n\nWe'd like to book a demo next week.\n\nThanks,\nMark"
+
+
+def test_strips_quoted_history_and_signature():
+    body = (
+        "Sounds good, let's talk Tuesday.\n"
+        "--\n"
+        "Mark Smith\n\n"
+        "On Mon, 3 Mar 2025 at 10:00, Anna <anna@example.com> wrote:\n"
+        "> Are you free next week?"
+    )
+    assert clean_email_body(body) == "Sounds good, let's talk Tuesday."